@@ -1,80 +1,55 @@
-import pandas as pd
 import streamlit as st
-from shared import db 
+import tempfile
+from datetime import date, datetime, timedelta
+import metrics
+from metrics import timed
+from shared import OPEN_STATUSES, ORDER_STATUSES, SORT_KEYS, get_db, paged_orders
 
+# Columns of the orders table
+ORDER_COLUMNS = ['order_id', 'customer', 'item', 'quantity', 'total_price', 'status', 'date']
+
+@timed("page.admin_dashboard_page")
 def admin_dashboard_page():
+    import pandas as pd  # Imported on first use, so other pages do not pay for it
     st.title("Admin Dashboard")
+    db = get_db()
 
     # Ensure we have orders data
-    if not db.orders:
+    if not db.query_orders(limit=0)[1]:
         st.warning("No orders found in the database.")
         return
 
-    # Convert orders to DataFrame for easier analysis
-    orders_data = pd.DataFrame(db.orders)
-
-    # Display the order data with the 'date' column
-    st.dataframe(orders_data[['order_id', 'customer', 'item', 'quantity', 'total_price', 'status', 'date']])
-
-    # Check for required fields
-    required_fields = ['item', 'quantity', 'total_price', 'date']
-    missing_fields = [field for field in required_fields if field not in orders_data.columns]
-    if missing_fields:
-        st.error(f"Orders data is missing required fields: {', '.join(missing_fields)}.")
-        return
-
-    # **Order Status Update Section**
-    st.subheader("Mark Orders as Ready")
-
-    # Create a list of order IDs to select from
-    order_options = [order['order_id'] for order in db.orders if order['status'] != 'Ready']
-    selected_order_id = st.selectbox("Select Order ID to mark as Ready:", order_options)
-
-    if st.button("Mark as Ready"):
-        order_found = False
-        for order in db.orders:
-            if order['order_id'] == selected_order_id:
-                order['status'] = 'Ready'
-                order['notification_sent'] = False
-                order_found = True
-                db.save_orders()
-                st.success(f"Order ID {selected_order_id} marked as Ready.")
-                break
-        if not order_found:
-            st.error(f"Order ID {selected_order_id} not found.")
-
-
-    # Ensure date column is properly formatted
-    try:
-        orders_data['date'] = pd.to_datetime(orders_data['date']).dt.normalize()
-    except Exception as e:
-        st.error(f"Error parsing 'date' field: {e}")
-        return
-
-    # Check if orders_data is empty after loading
-    if orders_data.empty:
-        st.warning("No orders to display.")
-        return
+    # Filters, applied by the storage backend so only one page of orders is loaded
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        customer = st.text_input("Customer", key="orders_customer").strip()
+        statuses = st.multiselect("Status", ORDER_STATUSES, key="orders_statuses")
+    with col2:
+        start = st.date_input("From", value=None, key="orders_start")
+        end = st.date_input("To", value=None, key="orders_end")
+    with col3:
+        sort = st.selectbox("Sort by", SORT_KEYS, key="orders_sort")
+        descending = st.checkbox("Descending", value=True, key="orders_descending")
+        page_size = st.selectbox("Rows per page", [25, 50, 100], key="orders_page_size")
 
-    # Mock inventory costs for profit calculation (adjust as needed)
-    inventory_costs = {
-        'Americano': 1.0,
-        'Cappuccino': 1.2,
-        'Latte': 1.5,
-        'Caramel Macchiato': 2.0
-    }
+    orders, total = paged_orders("orders_page", page_size=page_size, customer=customer or None, statuses=statuses,
+                                 start=start, end=end, sort=sort, descending=descending)
+    with timed("dataframe.orders"):
+        orders_data = pd.DataFrame(orders, columns=ORDER_COLUMNS)
 
-    # Add 'cost' and 'profit' columns
-    orders_data['cost'] = orders_data['item'].map(inventory_costs).fillna(0)  # Default cost to 0 if not found
-    orders_data['profit'] = orders_data['total_price'] - (orders_data['quantity'] * orders_data['cost'])
+    # Display the order data with the 'date' column
+    st.caption(f"{total} matching orders")
+    st.dataframe(orders_data)
 
-    # Normalize the current date for accurate comparison
-    today = pd.Timestamp.today().normalize()
+    # Sales figures come from the rollup kept up to date as orders change,
+    # so nothing below has to touch the full order history
+    sales = db.sales
+    today = date.today()
 
-    # Calculate Daily, Weekly, and Monthly Totals after 'profit' is added
-    daily_data = orders_data[orders_data['date'] == today]
-    weekly_data = orders_data[orders_data['date'] >= (today - pd.Timedelta(weeks=1))]
-    monthly_data = orders_data[orders_data['date'] >= (today - pd.Timedelta(days=30))]
+    # Calculate Daily, Weekly, and Monthly Totals
+    daily_totals = sales.totals(today, today)
+    weekly_totals = sales.totals(today - timedelta(weeks=1), today)
+    monthly_totals = sales.totals(today - timedelta(days=30), today)
 
     # Display Total Sales Report
     st.subheader("Total Sales Report")
@@ -96,40 +71,18 @@ def admin_dashboard_page():
         """
 
     # Display Daily, Weekly, Monthly Sales in the columns
-    with col1:
-        if 'profit' in daily_data.columns:
-            total_revenue = daily_data['total_price'].sum()
-            total_quantity = daily_data['quantity'].sum()
-            total_profit = daily_data['profit'].sum()
-            st.markdown(create_card("Daily", total_revenue, total_quantity, total_profit), unsafe_allow_html=True)
-        else:
-            st.error("The 'profit' column is missing in the daily data.")
-
-    with col2:
-        if 'profit' in weekly_data.columns:
-            total_revenue = weekly_data['total_price'].sum()
-            total_quantity = weekly_data['quantity'].sum()
-            total_profit = weekly_data['profit'].sum()
-            st.markdown(create_card("Weekly", total_revenue, total_quantity, total_profit), unsafe_allow_html=True)
-        else:
-            st.error("The 'profit' column is missing in the weekly data.")
-
-    with col3:
-        if 'profit' in monthly_data.columns:
-            total_revenue = monthly_data['total_price'].sum()
-            total_quantity = monthly_data['quantity'].sum()
-            total_profit = monthly_data['profit'].sum()
-            st.markdown(create_card("Monthly", total_revenue, total_quantity, total_profit), unsafe_allow_html=True)
-        else:
-            st.error("The 'profit' column is missing in the monthly data.")
+    for column, label, (total_revenue, total_quantity, total_profit) in (
+        (col1, "Daily", daily_totals),
+        (col2, "Weekly", weekly_totals),
+        (col3, "Monthly", monthly_totals),
+    ):
+        with column:
+            st.markdown(create_card(label, total_revenue, total_quantity, total_profit), unsafe_allow_html=True)
 
     # Sales Breakdown by Coffee Type
     st.subheader("Sales Breakdown by Coffee Type")
-    breakdown = orders_data.groupby('item').agg(
-        total_sold=('quantity', 'sum'),
-        total_revenue=('total_price', 'sum'),
-        total_profit=('profit', 'sum')
-    ).reset_index()
+    with timed("dataframe.sales_breakdown"):
+        breakdown = pd.DataFrame(sales.item_breakdown(), columns=['item', 'total_sold', 'total_revenue', 'total_profit'])
 
     if breakdown.empty:
         st.info("No sales data available for breakdown.")
@@ -157,40 +110,241 @@ def admin_dashboard_page():
     else:
         st.info("No sales data available to identify best or worst sellers.")
 
+    # Customer Feedback, from the rating rollup rather than the entries themselves
+    st.subheader("Customer Feedback")
+    ratings = db.ratings
+    with timed("dataframe.feedback"):
+        by_item = pd.DataFrame(ratings.item_summary())
+        by_day = pd.DataFrame(ratings.daily(today - timedelta(days=30), today))
+    if by_item.empty:
+        st.info("No feedback yet.")
+    else:
+        st.write("Average ratings by coffee type (1 to 5)")
+        st.bar_chart(by_item.set_index('item')[['rating', 'service']])
+        st.dataframe(by_item.round({'rating': 2, 'service': 2}), hide_index=True)
+        if not by_day.empty:
+            st.write("Average ratings per order date, last 30 days")
+            st.line_chart(by_day.set_index('day')[['rating', 'service']])
+
+
+# Kitchen Queue
+KITCHEN_PAGE_SIZE = 20
+
+def mark_selected_ready():
+    selected = st.session_state.get("kitchen_selected", [])
+    if selected:
+        db = get_db()
+        # One write for the whole batch; the status changes are published to
+        # the order event feed, which notifies the customers
+        db.update_orders(selected, status='Ready')
+        st.session_state["kitchen_message"] = f"Marked {len(selected)} order(s) as Ready."
+    st.session_state["kitchen_selected"] = []
+
+
+@timed("page.kitchen_queue_page")
+def kitchen_queue_page():
+    import pandas as pd
+    st.title("Kitchen Queue")
+    db = get_db()
+
+    # Runs before the rest of the page so the queue below is already up to date
+    message = st.session_state.pop("kitchen_message", None)
+    if message:
+        st.success(message)
+
+    admission_controls(db)
+
+    total = db.count_by_status(*OPEN_STATUSES)
+    if not total:
+        st.info("No open orders.")
+        return
+    pages = (total + KITCHEN_PAGE_SIZE - 1) // KITCHEN_PAGE_SIZE
+    page = st.number_input("Page", min_value=1, max_value=pages, value=1) if pages > 1 else 1
+    orders, total = db.kitchen_queue(offset=(page - 1) * KITCHEN_PAGE_SIZE, limit=KITCHEN_PAGE_SIZE)
+    st.caption(f"{total} open orders, oldest first. Page {page} of {pages}.")
+
+    st.dataframe(pd.DataFrame(orders, columns=['order_id', 'date', 'customer', 'item', 'quantity', 'status']),
+                 hide_index=True, use_container_width=True)
+
+    labels = {order['order_id']: f"#{order['order_id']}: {order['quantity']} x {order['item']} for {order['customer']}"
+              for order in orders}
+    st.multiselect("Orders to mark as Ready:", list(labels), format_func=labels.get, key="kitchen_selected")
+    st.button("Mark as Ready", on_click=mark_selected_ready)
+
+
+def admission_controls(db):
+    """The kitchen's pace and the wait a new order would get, and the limits on taking new orders."""
+    admission = db.admission()
+    settings = db.admission_settings()
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Open orders", admission['backlog'])
+    col2.metric("Minutes per order", f"{admission['seconds_per_order'] / 60:.1f}")
+    col3.metric("Wait for a new order", f"{admission['wait'] / 60:.0f} min")
+    if admission['refused']:
+        st.warning(f"New orders are refused: {admission['refused']}")
+
+    with st.expander("Admission control"):
+        with st.form("admission"):
+            paused = st.checkbox("Pause new orders", value=settings['paused'])
+            max_backlog = st.number_input("Refuse orders at this many open orders (0 for no limit):", min_value=0,
+                                          value=settings['max_backlog'] or 0)
+            max_wait = st.number_input("Refuse orders waiting longer than, in minutes (0 for no limit):",
+                                       min_value=0, value=round((settings['max_wait'] or 0) / 60))
+            pace = st.number_input("Minutes per order until enough orders are marked Ready:", min_value=0.1,
+                                   value=settings['seconds_per_order'] / 60, step=0.5)
+            if st.form_submit_button("Save"):
+                db.update_admission(paused=paused, max_backlog=max_backlog or None,
+                                    max_wait=max_wait * 60 or None, seconds_per_order=pace * 60)
+                st.session_state["kitchen_message"] = "Admission settings saved."
+                st.rerun()
+
+
+def export_sidebar():
+    """Downloads of the orders, per-item sales and feedback, for a date range (last month by default)."""
+    from export import FORMATS, REPORTS, export, file_name
+    db = get_db()
+    with st.expander("Export"):
+        report = st.selectbox("Report", list(REPORTS), key="export_report")
+        format = st.selectbox("Format", FORMATS, key="export_format")
+        this_month = date.today().replace(day=1)
+        start = st.date_input("From", value=(this_month - timedelta(days=1)).replace(day=1), key="export_start")
+        end = st.date_input("To", value=this_month - timedelta(days=1), key="export_end")
+        statuses, customer = (), None
+        if REPORTS[report][2]:
+            statuses = st.multiselect("Status", ORDER_STATUSES, key="export_statuses")
+            customer = st.text_input("Customer", key="export_customer").strip() or None
+
+        def build():
+            # Runs when the button is clicked; the export is streamed to a temporary
+            # file, so only its compressed bytes are held when it is served
+            file = tempfile.TemporaryFile()
+            export(db, report, file, format, start, end, statuses, customer)
+            file.seek(0)
+            return file
+
+        st.download_button("Download", build, file_name=file_name(report, format, start, end),
+                           mime="application/gzip", key="export_download")
+
 
 # Coupon Management
+@timed("page.admin_coupon_page")
 def admin_coupon_page():
+    import pandas as pd
+    from coupons import CouponError
     st.title("Create Coupons")
+    db = get_db()
     coupon_code = st.text_input("Enter coupon code:")
     discount = st.number_input("Enter discount percentage:", min_value=1, max_value=100)
 
     if st.button("Create Coupon"):
-        coupon_data = {
-            'coupon_code': coupon_code,
-            'discount': discount
-        }
-        db.coupons[coupon_code] = coupon_data
-        db.save_coupons()
-        st.success(f"Coupon {coupon_code} created with {discount}% discount.")
+        try:
+            # A single code is a campaign of its own, with no limits
+            db.create_coupons(coupon_code.strip().upper(), discount, codes=[coupon_code])
+        except CouponError as e:
+            st.error(str(e))
+        else:
+            st.success(f"Coupon {coupon_code} created with {discount}% discount.")
+
+    st.subheader("Bulk Codes")
+    with st.form("bulk_coupons"):
+        name = st.text_input("Campaign name:")
+        count = st.number_input("Number of codes:", min_value=1, max_value=1000000, value=1000)
+        prefix = st.text_input("Code prefix (optional):")
+        bulk_discount = st.number_input("Discount percentage:", min_value=1, max_value=100, key="bulk_discount")
+        expires = st.date_input("Valid until (optional):", value=None)
+        max_uses = st.number_input("Uses per code (0 for no limit):", min_value=0, value=1)
+        per_customer = st.number_input("Uses per customer (0 for no limit):", min_value=0, value=1)
+        submitted = st.form_submit_button("Generate Codes")
+    if submitted:
+        if not name.strip():
+            st.error("Give the campaign a name.")
+        else:
+            try:
+                codes = db.create_coupons(
+                    name.strip(), bulk_discount, count=count, prefix=prefix,
+                    # Valid through the whole of the last day
+                    expires=datetime.combine(expires + timedelta(days=1), datetime.min.time()).timestamp() if expires else None,
+                    max_uses=max_uses or None, per_customer=per_customer or None)
+            except CouponError as e:
+                st.error(str(e))
+            else:
+                st.success(f"Created {len(codes)} codes for {name.strip()}.")
+                st.download_button("Download codes", "\n".join(["code"] + codes),
+                                   file_name=f"{name.strip()}_codes.csv", mime="text/csv")
+
+    campaigns = db.coupon_campaigns()
+    if campaigns:
+        st.subheader("Campaigns")
+        table = pd.DataFrame(campaigns)
+        table['expires'] = [datetime.fromtimestamp(expires).strftime("%Y-%m-%d %H:%M") if pd.notna(expires) else ""
+                            for expires in table['expires']]
+        table[['max_uses', 'per_customer']] = table[['max_uses', 'per_customer']].astype('Int64')  # Blank: no limit
+        st.dataframe(table, hide_index=True)
 
 # Inventory Management
+# Days of order history the restock forecast looks at
+FORECAST_DAYS = 56
+
+@timed("page.manage_inventory")
 def manage_inventory():
     st.title("Inventory Management")
-    for item, stock in db.inventory.items():
-        st.write(f"{item}: {stock} units")
+    db = get_db()
+    levels = db.stock_levels()
+    for item in db.catalog.names():
+        stock, reserved = levels.get(item, (0, 0))
+        st.write(f"{item}: {stock} units ({reserved} reserved for unpaid orders)")
         additional_stock = st.number_input(f"Add stock for {item}:", min_value=0, key=f"stock_{item}")
         if st.button(f"Update {item} stock", key=f"button_{item}"):
-            db.inventory[item] += additional_stock
-            db.save_inventory()  # Save the updated inventory
-            st.success(f"Stock updated for {item}. New stock: {db.inventory[item]} units")
-
-# Sidebar for Navigation
-st.sidebar.title("Admin Panel")
-page = st.sidebar.selectbox("Choose a feature:", ["Dashboard", "Create Coupons", "Manage Inventory"])
-
-if page == "Dashboard":
-    admin_dashboard_page()
-elif page == "Create Coupons":
-    admin_coupon_page()
-elif page == "Manage Inventory":
-    manage_inventory()
+            # Added to whatever is on hand now, so concurrent orders are not overwritten
+            db.adjust_stock(item, additional_stock)
+            st.success(f"Stock updated for {item}. New stock: {db.inventory.get(item, 0)} units")
+
+    # Restock suggestions, forecast from the recent order history
+    from forecast import demand_series, restock_plan
+    st.subheader("Restock Suggestions")
+    col1, col2 = st.columns(2)
+    with col1:
+        cover = st.number_input("Days of stock to cover:", min_value=1, max_value=60, value=7)
+    with col2:
+        method = st.radio("Forecast", ["smoothing", "average"], horizontal=True,
+                          format_func={'smoothing': "Exponential smoothing", 'average': "7-day moving average"}.get)
+    today = datetime.combine(date.today(), datetime.min.time())
+    start = today - timedelta(days=FORECAST_DAYS)
+    # Whole days only: today's partial demand would drag the forecast down
+    with timed("forecast.restock_plan"):
+        demand = demand_series(db.orders_frame(start=start.date()), 'day', start, today, db.catalog.names())
+        plan = restock_plan(demand, levels, cover, method)
+    st.caption(f"Forecast units per day from the last {FORECAST_DAYS} days of orders; edit the restock column as needed.")
+    plan = st.data_editor(plan, hide_index=True, key="restock_plan",
+                          disabled=['item', 'on_hand', 'available', 'forecast', 'target'])
+    if st.button("Apply all restocks"):
+        restocks = dict(zip(plan['item'], plan['restock']))
+        # One write for every item
+        db.adjust_stocks(restocks)
+        st.success(f"Added {sum(int(units) for units in restocks.values())} units across "
+                   f"{sum(1 for units in restocks.values() if units)} items.")
+
+# Performance
+@timed("page.performance_page")
+def performance_page():
+    import pandas as pd
+    st.title("Performance")
+    db = get_db()
+    st.caption("Time spent per page, storage call and external call in this server process, "
+               f"percentiles over the last {metrics.WINDOW} calls of each.")
+
+    rows = metrics.summary()
+    if not rows:
+        st.info("Nothing has been timed yet.")
+        return
+    timings = pd.DataFrame(rows).sort_values('p95', ascending=False)
+    for column in ('mean', 'p50', 'p95', 'p99', 'max'):
+        timings[column] = timings[column] * 1000
+    st.subheader("Slowest operations (ms)")
+    st.dataframe(timings.set_index('operation'), use_container_width=True)
+
+    st.subheader("Cache")
+    st.dataframe(pd.DataFrame(db.cache_stats).T)
+
+    with st.expander("Prometheus metrics"):
+        st.code(metrics.prometheus_text(), language="text")
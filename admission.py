@@ -0,0 +1,125 @@
+"""Admission control: how long a new order would wait, and whether to take it.
+
+ThroughputWindow measures the kitchen's pace from the orders it marks
+Ready: the time between one Ready transition and the next, counted only
+when orders were still open after the first (an idle kitchen says nothing
+about its pace). The gaps go into fixed time buckets over the last WINDOW
+seconds, so adding one and reading the pace touch a fixed number of
+buckets however many orders there are. The window is fed from the order
+event feed, so every server process counts every process's Ready
+transitions, and a compacted feed keeps its buckets.
+
+The estimated wait of a new order is the open orders ahead of it plus its
+own, times the seconds per order. Orders are refused while the admin has
+paused them, once the backlog reaches max_backlog, or when the estimated
+wait is past max_wait; so at peak the shop only takes orders as fast as
+the kitchen gets through them. The settings live in admission.json plus
+its journal, shared by the processes.
+"""
+from storage import Journal
+
+# Seconds of Ready transitions the pace is measured over, and per bucket
+WINDOW = 15 * 60
+BUCKET = 30
+
+# Ready transitions in the window before the measured pace is trusted over seconds_per_order
+MIN_READY = 5
+
+DEFAULT_SETTINGS = {
+    'paused': False,
+    'max_backlog': None,       # Open orders at which new ones are refused
+    'max_wait': None,          # Seconds of estimated wait past which new orders are refused
+    'seconds_per_order': 120,  # Kitchen pace assumed until enough orders have been marked Ready
+}
+
+
+class ThroughputWindow:
+    """Orders marked Ready, and the kitchen time they took, per BUCKET seconds over the last WINDOW seconds."""
+
+    def __init__(self, window=WINDOW, bucket=BUCKET, buckets=(), last=(None, 0)):
+        self.bucket = bucket
+        self.size = window // bucket
+        self.epochs = [-1] * self.size  # The bucket number each slot counts for
+        self.counts = [0] * self.size
+        self.busy = [0.0] * self.size
+        for epoch, count, busy in buckets:
+            self._add(epoch, count, busy)
+        # When the last order was marked Ready, and how many were still open after it
+        self.last_at, self.last_backlog = last
+
+    @classmethod
+    def from_json(cls, data):
+        data = data or {}
+        return cls(buckets=data.get('buckets', ()), last=tuple(data.get('last', (None, 0))))
+
+    def to_json(self):
+        return {'buckets': [[epoch, count, busy] for epoch, count, busy in zip(self.epochs, self.counts, self.busy)
+                            if count],
+                'last': [self.last_at, self.last_backlog]}
+
+    def _add(self, epoch, count, busy):
+        slot = epoch % self.size
+        if self.epochs[slot] < epoch:
+            self.epochs[slot], self.counts[slot], self.busy[slot] = epoch, 0, 0.0
+        if self.epochs[slot] == epoch:
+            self.counts[slot] += count
+            self.busy[slot] += busy
+        # An epoch older than the slot's is out of the window already
+
+    def ready(self, at, backlog):
+        """Count an order marked Ready at time at, with backlog orders still open after it."""
+        if self.last_at is not None and at < self.last_at:
+            return  # Out of order; its gap is unknown
+        if self.last_at is not None and self.last_backlog > 0:
+            self._add(int(at // self.bucket), 1, at - self.last_at)
+        self.last_at, self.last_backlog = at, backlog
+
+    def pace(self, now):
+        """Return (orders timed, seconds of kitchen time they took) over the window."""
+        first = int(now // self.bucket) - self.size + 1
+        ready, busy = 0, 0.0
+        for epoch, count, seconds in zip(self.epochs, self.counts, self.busy):
+            if epoch >= first:
+                ready += count
+                busy += seconds
+        return ready, busy
+
+
+def seconds_per_order(window, now, default):
+    """The kitchen's current seconds per order: measured once MIN_READY orders are timed, else default."""
+    ready, busy = window.pace(now)
+    return busy / ready if ready >= MIN_READY else default
+
+
+def estimate_wait(window, backlog, now, default):
+    """Seconds a new order would wait, with backlog open orders ahead of it."""
+    return (backlog + 1) * seconds_per_order(window, now, default)
+
+
+def refusal(settings, backlog, wait):
+    """Return why a new order cannot be taken now, or None if it can."""
+    if settings['paused']:
+        return "We are not taking new orders right now."
+    if settings['max_backlog'] is not None and backlog >= settings['max_backlog']:
+        return "The kitchen is at capacity. Please try again in a few minutes."
+    if settings['max_wait'] is not None and wait > settings['max_wait']:
+        return (f"The kitchen is busy: orders are taking over {settings['max_wait'] / 60:.0f} minutes. "
+                "Please try again in a few minutes.")
+    return None
+
+
+class AdmissionJournal(Journal):
+    """admission.json plus admission.journal.jsonl, held as the settings dict."""
+
+    def __init__(self, path="admission.json", **kwargs):
+        super().__init__(path, "admission.journal.jsonl", dict, **kwargs)
+
+    def new_state(self, data, compacting=False):
+        return dict(DEFAULT_SETTINGS, **data)
+
+    def apply(self, state, entry):
+        if entry.get('op') == 'settings':
+            state.update(entry['settings'])
+
+    def dump(self, state):
+        return state
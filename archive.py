@@ -0,0 +1,255 @@
+"""Closed orders, moved out of orders.json into one file per month.
+
+Ready and Cancelled orders placed before a cutoff never change again, so
+the archive job (Database.archive_orders, or this module run from the data
+directory, e.g. nightly from cron) moves them into
+orders_archive/YYYY-MM.json:
+
+    python archive.py --before 2024-12-01
+
+orders.json is left with recent and still open orders, so loading it at
+startup and compacting its journal cost the same however many years of
+history build up. Next to the segments, sales.json holds each month's
+per-day, per-item sales (what the SalesRollup starts from) and index.json
+each month's order count, date and ID range, and per-customer and
+per-status counts. Queries pick the segments they need from the index and
+only read those, keeping the last few in memory.
+"""
+import argparse
+import os
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+from datetime import date
+from operator import attrgetter
+
+from metrics import timed
+from order_model import Order, OrderColumns, concat_frames, format_timestamp, order_from_json
+from rollups import NON_SALE_STATUSES
+from storage import atomic_write_json, file_version, load_json
+
+ARCHIVE_DIR = "orders_archive"
+
+# Orders in these statuses are done with, and archived once placed before the cutoff
+CLOSED_STATUSES = ('Ready', 'Cancelled')
+
+# Segments kept in memory once read
+CACHED_SEGMENTS = 12
+
+
+def load_orders(path):
+    return [order for order in load_json(path, [], object_hook=order_from_json) if isinstance(order, Order)]
+
+
+def month_of(order):
+    """The 'YYYY-MM' segment an order belongs in."""
+    return format_timestamp(order.timestamp)[:7]
+
+
+class Segment:
+    """One month of archived orders, oldest first, indexed by customer and ID."""
+
+    def __init__(self, orders):
+        self.orders = sorted(orders, key=attrgetter('timestamp'))
+        self.by_customer = {}
+        self.by_id = {}
+        for order in self.orders:
+            self.by_customer.setdefault(order.customer, []).append(order)
+            self.by_id.setdefault(order.order_id, []).append(order)
+
+    def matches(self, customer=None, statuses=(), start=None, end=None):
+        """Return the matching orders, oldest first. start and end are timestamps, end exclusive."""
+        orders = self.by_customer.get(customer, []) if customer is not None else self.orders
+        low = bisect_left(orders, start, key=attrgetter('timestamp')) if start is not None else 0
+        high = bisect_left(orders, end, key=attrgetter('timestamp')) if end is not None else len(orders)
+        orders = orders[low:high]
+        if statuses:
+            orders = [order for order in orders if order.status in statuses]
+        return orders
+
+    def frame(self):
+        return OrderColumns(len(self.orders), self.orders).frame()
+
+    def summary(self):
+        """The segment's index.json entry."""
+        ids = [order.order_id for order in self.orders if isinstance(order.order_id, int)]
+        customers, statuses = {}, {}
+        for order in self.orders:
+            customers[order.customer] = customers.get(order.customer, 0) + 1
+            statuses[order.status] = statuses.get(order.status, 0) + 1
+        return {
+            'count': len(self.orders),
+            'first': self.orders[0].timestamp,
+            'last': self.orders[-1].timestamp,
+            'ids': [min(ids), max(ids)] if ids else None,
+            'customers': customers,
+            'statuses': statuses,
+        }
+
+    def sales(self):
+        """The segment's (day, item, quantity, revenue) rows for sales.json."""
+        totals = {}
+        for order in self.orders:
+            if order.status not in NON_SALE_STATUSES:
+                bucket = totals.setdefault((order.day, order.item), [0, 0.0])
+                bucket[0] += order.quantity
+                bucket[1] += order.total_price
+        return [[day, item, quantity, revenue] for (day, item), (quantity, revenue) in sorted(totals.items())]
+
+
+class OrderArchive:
+    """The monthly segments of archived orders, read lazily and cached."""
+
+    def __init__(self, directory=ARCHIVE_DIR):
+        self.directory = directory
+        self.index_path = os.path.join(directory, "index.json")
+        self.sales_path = os.path.join(directory, "sales.json")
+        self._index = {}
+        self._index_version = None
+        self._segments = OrderedDict()  # month -> (file version, Segment), least recently used first
+        self._frame = (None, None)      # (index version, DataFrame of every archived order)
+        self._lock = threading.Lock()
+
+    def segment_path(self, month):
+        return os.path.join(self.directory, f"{month}.json")
+
+    def index(self):
+        """Return {month: summary}, re-read whenever index.json changes."""
+        version = file_version(self.index_path)
+        if version != self._index_version:
+            with self._lock:
+                if version != self._index_version:
+                    self._index = load_json(self.index_path, {})
+                    self._index_version = version
+        return self._index
+
+    def sales_rows(self):
+        """Return the (day, item, quantity, revenue) rows of every archived month."""
+        return [row for rows in load_json(self.sales_path, {}).values() for row in rows]
+
+    @timed("archive.segment")
+    def segment(self, month):
+        """Return a month's Segment, from memory unless its file changed."""
+        path = self.segment_path(month)
+        version = file_version(path)
+        with self._lock:
+            cached = self._segments.get(month)
+            if cached and cached[0] == version:
+                self._segments.move_to_end(month)
+                return cached[1]
+        segment = Segment(load_orders(path))
+        with self._lock:
+            self._segments[month] = (version, segment)
+            self._segments.move_to_end(month)
+            while len(self._segments) > CACHED_SEGMENTS:
+                self._segments.popitem(last=False)
+        return segment
+
+    def months(self, customer=None, start=None, end=None, statuses=()):
+        """Return the months that may hold matching orders, oldest first."""
+        return [month for month, summary in sorted(self.index().items())
+                if (start is None or summary['last'] >= start) and (end is None or summary['first'] < end)
+                and (customer is None or customer in summary['customers'])
+                and (not statuses or any(status in summary['statuses'] for status in statuses))]
+
+    def count(self, customer=None, statuses=(), start=None, end=None):
+        """Count the matching orders, from the index alone where it can."""
+        index = self.index()
+        total = 0
+        for month in self.months(customer, start, end, statuses):
+            summary = index[month]
+            whole = (start is None or summary['first'] >= start) and (end is None or summary['last'] < end)
+            if whole and not statuses:
+                total += summary['customers'][customer] if customer is not None else summary['count']
+            elif whole and customer is None:
+                total += sum(summary['statuses'].get(status, 0) for status in statuses)
+            else:
+                total += len(self.segment(month).matches(customer, statuses, start, end))
+        return total
+
+    def stream(self, customer=None, statuses=(), start=None, end=None, descending=False):
+        """Yield the matching orders in date order, reading each segment only when reached."""
+        months = self.months(customer, start, end, statuses)
+        for month in reversed(months) if descending else months:
+            orders = self.segment(month).matches(customer, statuses, start, end)
+            yield from reversed(orders) if descending else orders
+
+    def find(self, order_id):
+        """Return the archived order with the given ID, or None."""
+        if not isinstance(order_id, int):
+            return None  # Archived order ID ranges are only kept for integer IDs
+        for month, summary in self.index().items():
+            ids = summary['ids']
+            if ids and ids[0] <= order_id <= ids[1]:
+                matches = self.segment(month).by_id.get(order_id)
+                if matches:
+                    return matches[0]
+        return None
+
+    def count_by_status(self, *statuses):
+        return sum(summary['statuses'].get(status, 0) for summary in self.index().values() for status in statuses)
+
+    def max_order_id(self):
+        return max((summary['ids'][1] for summary in self.index().values() if summary['ids']), default=None)
+
+    @timed("archive.frame")
+    def frame(self, start=None):
+        """Return the archived orders from timestamp start on as a DataFrame, oldest first (see OrderColumns.frame).
+
+        Built once per archive run, as the archive only changes then.
+        """
+        self.index()
+        version, frame = self._frame
+        if frame is None or version != self._index_version:
+            version = self._index_version
+            frame = concat_frames([self.segment(month).frame() for month in self.months()])
+            self._frame = (version, frame)
+        if start is None:
+            return frame
+        import numpy as np
+        dates = frame['date'].to_numpy()
+        return frame.iloc[dates.searchsorted(np.datetime64(start, 's')):]
+
+    @timed("archive.add")
+    def add(self, orders):
+        """Merge orders into their months' segments, and rewrite the index and sales files.
+
+        Orders already in a segment are not added twice, so a job stopped
+        before orders.json was rewritten can simply be run again. Call with
+        the orders file locked, so archive jobs never overlap.
+        """
+        by_month = {}
+        for order in orders:
+            by_month.setdefault(month_of(order), []).append(order)
+        os.makedirs(self.directory, exist_ok=True)
+        index = load_json(self.index_path, {})
+        sales = load_json(self.sales_path, {})
+        for month, new_orders in sorted(by_month.items()):
+            existing = load_orders(self.segment_path(month))
+            seen = {(order.order_id, order.timestamp, order.customer) for order in existing}
+            segment = Segment(existing + [order for order in new_orders
+                                          if (order.order_id, order.timestamp, order.customer) not in seen])
+            atomic_write_json(self.segment_path(month), [order.to_json() for order in segment.orders], indent=None)
+            index[month] = segment.summary()
+            sales[month] = segment.sales()
+        # The index last: readers only look for what it lists
+        atomic_write_json(self.sales_path, sales, indent=None)
+        atomic_write_json(self.index_path, index, indent=None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move closed orders out of orders.json into the monthly archive.")
+    parser.add_argument('--before', type=date.fromisoformat, default=None,
+                        help="archive orders placed before this date, YYYY-MM-DD (default: today)")
+    args = parser.parse_args()
+
+    from shared import create_database
+    db = create_database()
+    try:
+        print(f"Archived {db.archive_orders(args.before)} orders")
+    except NotImplementedError as error:
+        print(error)
+
+
+if __name__ == "__main__":
+    main()
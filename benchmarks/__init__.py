@@ -0,0 +1,4 @@
+"""Benchmarks for the Koopi .Co app. Run them from the repo root, e.g.
+
+    python -m benchmarks.journal_writes
+"""
@@ -0,0 +1,139 @@
+"""How close the admission wait estimates come to the waits orders really get.
+
+Simulates a kitchen working through its orders one at a time, oldest
+first, with random preparation times, for a few hours of orders arriving
+in three patterns: steady, a lunch rush the kitchen cannot keep up with,
+and bursts of a dozen orders at once. Orders are marked Ready as they
+are done, or with --batch, by an admin clearing the finished ones every
+so many seconds. Every Ready transition goes into a ThroughputWindow, as
+the order event feed does, and every arriving order gets the wait
+Database.admission() would show, which is then compared with the wait it
+really had. The naive baseline is the same open orders times the
+configured seconds_per_order. With --max-wait or --max-backlog orders
+are refused as on the order page, which keeps the waits of the orders
+taken around the limit however many more come in.
+
+Also times ThroughputWindow.ready() and pace(), which stay the same
+however many orders have gone through.
+
+    python -m benchmarks.admission --hours 4 --service 90 --batch 60 --max-wait 900
+"""
+import argparse
+import heapq
+import math
+import time
+
+import numpy as np
+
+from admission import DEFAULT_SETTINGS, ThroughputWindow, estimate_wait, refusal
+
+PATTERNS = ('steady', 'rush', 'bursts')
+
+
+def arrivals(pattern, hours, service, rng):
+    """Order times, in seconds from the start, for one of PATTERNS."""
+    end = hours * 3600
+    if pattern == 'bursts':
+        # A dozen or so orders at once every 25 minutes or so, hardly any in between
+        times = []
+        start = 0.0
+        while start < end:
+            times.extend(start + rng.uniform(0, 60, rng.integers(6, 18)))
+            start += rng.exponential(1500)
+        times.extend(rng.uniform(0, end, int(end / service * 0.1)))
+        return np.sort(np.array(times)[np.array(times) < end])
+    # Orders per second: 70% of what the kitchen manages, or 130% during the middle hour of a rush
+    steady = 0.7 / service
+    peak = 1.3 / service if pattern == 'rush' else steady
+    times, now = [], 0.0
+    while True:
+        # Thinning: draw at the peak rate, keep each with the current rate's share
+        now += rng.exponential(1 / peak)
+        if now >= end:
+            return np.array(times)
+        rush = abs(now - end / 2) < 1800
+        if rng.random() < (peak if rush else steady) / peak:
+            times.append(now)
+
+
+def simulate(times, service, rng, settings, batch=0):
+    """Run the kitchen; return (estimated waits, naive estimates, actual waits, refused orders)."""
+    window = ThroughputWindow()
+    marks = []  # (time marked Ready, order number) of the orders taken and not yet marked
+    done = 0.0  # When the kitchen finishes the orders taken so far
+    estimates, naive, actual = [], [], []
+    refused = 0
+    # Preparation times: gamma distributed around service seconds
+    prep = rng.gamma(4, service / 4, len(times))
+    for number, at in enumerate(times):
+        while marks and marks[0][0] <= at:
+            marked, _ = heapq.heappop(marks)
+            window.ready(marked, len(marks))
+        backlog = len(marks)
+        wait = estimate_wait(window, backlog, at, settings['seconds_per_order'])
+        if refusal(settings, backlog, wait):
+            refused += 1
+            continue
+        done = max(done, at) + prep[number]
+        # With batches, done orders are only marked Ready at the admin's next round
+        marked = math.ceil(done / batch) * batch if batch else done
+        heapq.heappush(marks, (marked, number))
+        estimates.append(wait)
+        naive.append((backlog + 1) * settings['seconds_per_order'])
+        actual.append(marked - at)
+    return np.array(estimates), np.array(naive), np.array(actual), refused
+
+
+def errors(estimates, actual):
+    """Mean and 90th percentile absolute error in minutes, median error in percent of the actual wait."""
+    absolute = np.abs(estimates - actual)
+    return absolute.mean() / 60, np.percentile(absolute, 90) / 60, np.median(absolute / actual) * 100
+
+
+def time_window(count):
+    """Seconds per ready() and per pace() over count Ready transitions, one every 20 seconds."""
+    window = ThroughputWindow()
+    start = time.perf_counter()
+    for number in range(count):
+        window.ready(number * 20.0, 3)
+    ready = (time.perf_counter() - start) / count
+    start = time.perf_counter()
+    for number in range(1000):
+        window.pace(count * 20.0)
+    return ready, (time.perf_counter() - start) / 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--hours', type=float, default=4)
+    parser.add_argument('--service', type=float, default=90, help="mean seconds the kitchen takes per order")
+    parser.add_argument('--default', type=float, default=DEFAULT_SETTINGS['seconds_per_order'],
+                        help="the configured seconds_per_order")
+    parser.add_argument('--batch', type=float, default=0, help="seconds between the admin's Ready rounds")
+    parser.add_argument('--max-wait', type=float, default=None, help="refuse orders estimated to wait longer (s)")
+    parser.add_argument('--max-backlog', type=int, default=None, help="refuse orders at this many open orders")
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    settings = dict(DEFAULT_SETTINGS, seconds_per_order=args.default, max_wait=args.max_wait,
+                    max_backlog=args.max_backlog)
+    print(f"{args.hours:g} hours, {args.service:g} s per order (configured {args.default:g} s)"
+          + (f", marked Ready every {args.batch:g} s" if args.batch else ""))
+    print(f"{'pattern':<8} {'orders':>7} {'refused':>7} {'mean wait':>10} {'max wait':>9}   "
+          f"{'estimate: mean err':>18} {'p90':>6} {'median %':>8}   {'naive: mean err':>15} {'p90':>6} {'median %':>8}")
+    for pattern in PATTERNS:
+        rng = np.random.default_rng(args.seed)
+        times = arrivals(pattern, args.hours, args.service, rng)
+        estimates, naive, actual, refused = simulate(times, args.service, rng, settings, args.batch)
+        mean, p90, median = errors(estimates, actual)
+        naive_mean, naive_p90, naive_median = errors(naive, actual)
+        print(f"{pattern:<8} {len(actual):>7} {refused:>7} {actual.mean() / 60:>6.1f} min {actual.max() / 60:>5.1f} min   "
+              f"{mean:>14.1f} min {p90:>6.1f} {median:>7.0f}%   {naive_mean:>11.1f} min {naive_p90:>6.1f} {naive_median:>7.0f}%")
+
+    for count in (10_000, 1_000_000):
+        ready, pace = time_window(count)
+        print(f"window of {count:>9,} Ready transitions: ready() {ready * 1e6:.2f} us, pace() {pace * 1e6:.1f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Order-to-payment latency against the fake Stripe client.
+
+Simulated customers arrive at a steady rate, place an order (ID allocation
+plus journaled add_order) and queue a checkout session, like
+customer_order_process does. Reports p50/p99 for placing the order, which
+is all the script thread waits for, and for getting the payment URL.
+
+    python -m benchmarks.checkout_latency --orders 2000 --rate 200 --workers 8
+"""
+import argparse
+import os
+import tempfile
+import time
+from datetime import datetime
+
+from benchmarks.common import PRICES, percentile
+from payments import CheckoutQueue, FakeStripeClient
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--orders', type=int, default=2000)
+    parser.add_argument('--rate', type=float, default=200, help="orders placed per second")
+    parser.add_argument('--workers', type=int, default=8, help="checkout worker threads")
+    parser.add_argument('--latency', type=float, default=0.03, help="median fake Stripe latency in seconds")
+    parser.add_argument('--failure-rate', type=float, default=0.02, help="share of fake Stripe calls that fail")
+    args = parser.parse_args()
+
+    cwd = os.getcwd()
+    from shared import Database
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            db = Database()
+            client = FakeStripeClient(latency=args.latency, failure_rate=args.failure_rate, seed=1)
+            queue = CheckoutQueue(client, workers=args.workers, backoff=0.05)
+            place = []
+            futures = []
+            start = time.perf_counter()
+            for i in range(args.orders):
+                # Keep a steady arrival rate
+                delay = start + i / args.rate - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                begin = time.perf_counter()
+                order_id = db.generate_order_id()
+                db.add_order({
+                    'order_id': order_id,
+                    'customer': f"customer{i % 500}",
+                    'item': 'Latte',
+                    'quantity': 1,
+                    'total_price': PRICES['Latte'],
+                    'status': 'Pending',
+                    'date': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                })
+                futures.append(queue.submit(f"customer{i % 500}", int(PRICES['Latte'] * 100), order_id))
+                place.append(time.perf_counter() - begin)
+            failed = sum(1 for future in futures if future.exception() is not None)
+            elapsed = time.perf_counter() - start
+            queue.pool.shutdown()
+        finally:
+            os.chdir(cwd)
+
+    p50, p99 = queue.latency_percentiles(50, 99)
+    print(f"{args.orders} orders in {elapsed:.1f} s ({args.orders / elapsed:.0f}/s), "
+          f"{client.calls} Stripe calls, {failed} failed after retries")
+    print(f"place order:  p50 {percentile(place, 50) * 1e3:.2f} ms  p99 {percentile(place, 99) * 1e3:.2f} ms")
+    print(f"payment URL:  p50 {p50 * 1e3:.1f} ms  p99 {p99 * 1e3:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
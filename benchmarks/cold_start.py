@@ -0,0 +1,95 @@
+"""Cold start and per-rerun overhead of main.py.
+
+Each scenario runs in a fresh interpreter, in a temporary directory
+seeded with a synthetic order history, with the stubbed streamlit module
+(benchmarks/stub_streamlit.py). The cold start is the first run of
+main.py: imports, the Database, and the page. Reruns are main.py run
+again in the same process, which is what Streamlit does on every widget
+interaction. Also lists which of the heavier modules got imported.
+
+    python -m benchmarks.cold_start --orders 100000 --reruns 50
+"""
+import argparse
+import json
+import os
+import runpy
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.common import synthetic_orders
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# (name, session state, sidebar page)
+SCENARIOS = [
+    ('signed out', {}, None),
+    ('customer order', {'logged_in': True, 'role': 'Customer', 'username': 'customer1'}, 'Order Process'),
+    ('customer history', {'logged_in': True, 'role': 'Customer', 'username': 'customer1'}, 'Order History'),
+    ('admin dashboard', {'logged_in': True, 'role': 'Admin', 'username': 'admin'}, 'Dashboard'),
+    ('admin kitchen', {'logged_in': True, 'role': 'Admin', 'username': 'admin'}, 'Kitchen Queue'),
+]
+HEAVY_MODULES = ('pandas', 'numpy', 'stripe', 'sqlite3')
+
+
+def run_scenario(name, reruns):
+    """Run main.py as one session (in this interpreter) and print the timings as JSON."""
+    started = time.perf_counter()
+    from benchmarks import stub_streamlit
+    stub_streamlit.install()
+    _, state, page = next(scenario for scenario in SCENARIOS if scenario[0] == name)
+    stub_streamlit.session()['state'].update(state)
+    stub_streamlit.set_inputs({'Menu': page, 'Choose a feature:': page} if page else {})
+    ready = time.perf_counter()
+    runpy.run_path(os.path.join(ROOT, "main.py"), run_name="__main__")
+    first = time.perf_counter() - ready
+    loaded = [module for module in HEAVY_MODULES if module in sys.modules]
+    times = []
+    for _ in range(reruns):
+        start = time.perf_counter()
+        runpy.run_path(os.path.join(ROOT, "main.py"), run_name="__main__")
+        times.append(time.perf_counter() - start)
+    print(json.dumps({'first': first, 'setup': ready - started, 'reruns': times, 'loaded': loaded}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--orders', type=int, default=100000)
+    parser.add_argument('--reruns', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=3, help="fresh interpreters per scenario; the best is shown")
+    parser.add_argument('--run', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.run:
+        return run_scenario(args.run, args.reruns)
+
+    directory = tempfile.mkdtemp(prefix="cold_start_")
+    try:
+        shutil.copy(os.path.join(ROOT, "menu.json"), directory)
+        with open(os.path.join(directory, "orders.json"), 'w') as file:
+            json.dump(synthetic_orders(args.orders), file)
+        env = dict(os.environ, PYTHONPATH=ROOT, COFFEE_SHOP_STRIPE=os.environ.get("COFFEE_SHOP_STRIPE", ""))
+        print(f"{args.orders} orders, best of {args.repeat} cold starts, {args.reruns} reruns each")
+        print(f"{'':<18} {'process':>9} {'first run':>10} {'rerun p50':>10} {'rerun p95':>10}  imported")
+        for name, _, _ in SCENARIOS:
+            results = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                output = subprocess.run([sys.executable, "-m", "benchmarks.cold_start", "--run", name,
+                                         "--reruns", str(args.reruns)],
+                                        cwd=directory, env=env, check=True, capture_output=True, text=True).stdout
+                total = time.perf_counter() - start
+                results.append((total, json.loads(output.strip().splitlines()[-1])))
+            total, result = min(results, key=lambda entry: entry[1]['first'])
+            reruns = sorted(result['reruns']) or [0]
+            print(f"{name:<18} {total:>7.2f} s {result['first'] * 1e3:>7.0f} ms "
+                  f"{statistics.median(reruns) * 1e3:>7.1f} ms {reruns[int(len(reruns) * 0.95)] * 1e3:>7.1f} ms  "
+                  f"{', '.join(result['loaded']) or '-'}")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+"""Helpers shared by the benchmarks."""
+import random
+from datetime import datetime, timedelta
+
+ITEMS = ['Americano', 'Cappuccino', 'Latte', 'Caramel Macchiato']
+PRICES = {'Americano': 7.90, 'Cappuccino': 8.50, 'Latte': 9.00, 'Caramel Macchiato': 10.00}
+
+
+def synthetic_orders(count, start_id=1, days=365, customers=5000, seed=42):
+    """Generate plausible orders spread evenly over the last `days` days."""
+    rng = random.Random(seed)
+    end = datetime.now().replace(microsecond=0)
+    step = timedelta(days=days) / max(count, 1)
+    start = end - timedelta(days=days)
+    orders = []
+    for i in range(count):
+        item = rng.choice(ITEMS)
+        quantity = rng.randint(1, 3)
+        orders.append({
+            'order_id': start_id + i,
+            'customer': f"customer{rng.randint(1, customers)}",
+            'item': item,
+            'quantity': quantity,
+            'total_price': round(PRICES[item] * quantity, 2),
+            'status': rng.choice(['Pending', 'Paid', 'Ready']),
+            'date': (start + step * i).strftime("%Y-%m-%d %H:%M:%S"),
+            'notification_sent': False,
+        })
+    return orders
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
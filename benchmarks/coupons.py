@@ -0,0 +1,164 @@
+"""Coupon code generation, lookup and redemption under contention.
+
+Bulk generation: a campaign of --codes random codes made by
+create_coupons, one write, against the old way of adding coupons (set the
+code in db.coupons and save_coupons(), which rewrote coupons.json per
+code), timed for --legacy-codes codes and projected to --codes.
+
+Redemption: --processes worker processes with --threads buyers each race
+for --contested single-use codes (one use per customer too), every buyer
+trying random codes until all of them are gone:
+
+    python -m benchmarks.coupons --codes 100000 --processes 4 --threads 8
+    python -m benchmarks.coupons --backend sqlite
+
+Afterwards every contested code must be redeemed exactly once, and no
+customer more than once. Runs in a temporary directory.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import tempfile
+import threading
+import time
+
+from benchmarks.common import percentile
+
+DISCOUNT = 10
+
+
+def open_database(backend):
+    if backend == 'sqlite':
+        from sqlite_backend import SqliteDatabase
+        return SqliteDatabase("bench.db")
+    from shared import Database
+    return Database()
+
+
+def redemptions(db, campaign):
+    """(order_id, code, customer) of every redemption in a campaign."""
+    if hasattr(db, 'db_path'):
+        return db.connection().execute("SELECT order_id, code, customer FROM coupon_redemptions WHERE campaign = ?",
+                                       (campaign,)).fetchall()
+    db.coupons.refresh()
+    book = db.coupons.state
+    return [(order_id, code, customer) for order_id, (code, customer) in book.redemptions.items()
+            if book.codes[code] == campaign]
+
+
+def legacy_generation(count):
+    """Seconds to add count coupons the old way: the whole coupons.json rewritten per code."""
+    from coupons import generate_codes
+    coupons = {}
+    start = time.perf_counter()
+    for code in generate_codes(count):
+        coupons[code] = {'coupon_code': code, 'discount': DISCOUNT}
+        with open("legacy_coupons.json", 'w') as file:
+            json.dump(coupons, file, indent=4)
+    return time.perf_counter() - start
+
+
+def buyer(db, codes, seed, results):
+    from coupons import CouponError
+    rng = random.Random(seed)
+    customer = f"customer{seed}"
+    latencies, redeemed, refused = [], [], 0
+    left = list(codes)
+    rng.shuffle(left)
+    for attempt, code in enumerate(left):
+        start = time.perf_counter()
+        try:
+            db.redeem_coupon(code, customer, seed * 1000000 + attempt)
+        except CouponError:
+            refused += 1
+        else:
+            redeemed.append(code)
+            customer = f"customer{seed}-{attempt}"  # One use per customer: come back as someone else
+        latencies.append(time.perf_counter() - start)
+    results.append((latencies, redeemed, refused))
+
+
+def worker(directory, backend, process, threads, codes, queue):
+    os.chdir(directory)
+    db = open_database(backend)
+    results = []
+    buyers = [threading.Thread(target=buyer, args=(db, codes, process * threads + i + 1, results))
+              for i in range(threads)]
+    for thread in buyers:
+        thread.start()
+    for thread in buyers:
+        thread.join()
+    queue.put(results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--backend', choices=['json', 'sqlite'], default='json')
+    parser.add_argument('--codes', type=int, default=100000, help="codes in the bulk campaign")
+    parser.add_argument('--legacy-codes', type=int, default=2000, help="codes added the old way")
+    parser.add_argument('--lookups', type=int, default=100000)
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=8, help="buyers per process")
+    parser.add_argument('--contested', type=int, default=200, help="single-use codes the buyers race for")
+    args = parser.parse_args()
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            db = open_database(args.backend)
+
+            legacy = legacy_generation(args.legacy_codes)
+            start = time.perf_counter()
+            codes = db.create_coupons("bulk", DISCOUNT, count=args.codes, prefix="B", max_uses=1)
+            bulk = time.perf_counter() - start
+            assert len(set(codes)) == args.codes
+
+            sample = random.Random(1).choices(codes, k=args.lookups)
+            start = time.perf_counter()
+            for code in sample:
+                db.coupon_discount(code, "customer1")
+            lookup = time.perf_counter() - start
+
+            contested = db.create_coupons("race", DISCOUNT, count=args.contested, prefix="R",
+                                          max_uses=1, per_customer=1)
+            queue = multiprocessing.Queue()
+            processes = [multiprocessing.Process(target=worker, args=(tmp, args.backend, p, args.threads,
+                                                                      contested, queue))
+                         for p in range(args.processes)]
+            start = time.perf_counter()
+            for process in processes:
+                process.start()
+            results = [result for _ in processes for result in queue.get()]
+            for process in processes:
+                process.join()
+            elapsed = time.perf_counter() - start
+
+            latencies = [sample for samples, _, _ in results for sample in samples]
+            redeemed = [code for _, codes, _ in results for code in codes]
+            refused = sum(refused for _, _, refused in results)
+            recorded = redemptions(db, "race")
+        finally:
+            os.chdir(cwd)
+
+    print(f"{args.backend}: generating {args.codes} codes")
+    print(f"  {'bulk campaign, one write':<32} {bulk:8.2f} s ({args.codes / bulk:,.0f} codes/s)")
+    print(f"  {f'per code rewrite ({args.legacy_codes} codes)':<32} {legacy:8.2f} s, "
+          f"about {legacy * (args.codes / args.legacy_codes) ** 2:,.0f} s projected for {args.codes}")
+    print(f"lookup of {args.lookups} codes among {args.codes}: {lookup / args.lookups * 1e6:.1f} us each")
+    buyers = args.processes * args.threads
+    print(f"redeeming {args.contested} single-use codes: {buyers} buyers in {args.processes} processes, "
+          f"{len(latencies)} attempts in {elapsed:.2f} s ({len(latencies) / elapsed:,.0f}/s)")
+    print(f"  redeem latency p50 {percentile(latencies, 50) * 1e3:.2f} ms, "
+          f"p95 {percentile(latencies, 95) * 1e3:.2f} ms, p99 {percentile(latencies, 99) * 1e3:.2f} ms")
+    print(f"  {len(redeemed)} redeemed, {refused} refused, {len(recorded)} recorded")
+    customers = [customer for _, _, customer in recorded]
+    if sorted(redeemed) != sorted(contested) or sorted(code for _, code, _ in recorded) != sorted(contested) \
+            or len(set(customers)) != len(customers):
+        raise SystemExit("codes were not redeemed exactly once each")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""Dashboard sales figures: incremental rollup vs full recompute.
+
+The full recompute is what admin_dashboard_page used to do on every rerun:
+build a DataFrame from every order, parse every date, derive cost and
+profit, filter three windows and group by item. The rollup answers the
+same questions from per-day, per-item buckets.
+
+    python -m benchmarks.dashboard_rollups --sizes 10000 100000 1000000
+"""
+import argparse
+import time
+from datetime import date, timedelta
+
+import pandas as pd
+
+from benchmarks.common import synthetic_orders
+from catalog import Catalog
+from order_model import Order
+from rollups import SalesRollup
+
+COSTS = Catalog().costs
+
+
+def full_recompute(orders):
+    orders_data = pd.DataFrame(orders)
+    orders_data['date'] = pd.to_datetime(orders_data['date']).dt.normalize()
+    orders_data['cost'] = orders_data['item'].map(COSTS).fillna(0)
+    orders_data['profit'] = orders_data['total_price'] - (orders_data['quantity'] * orders_data['cost'])
+    today = pd.Timestamp.today().normalize()
+    results = []
+    for window in (orders_data[orders_data['date'] == today],
+                   orders_data[orders_data['date'] >= (today - pd.Timedelta(weeks=1))],
+                   orders_data[orders_data['date'] >= (today - pd.Timedelta(days=30))]):
+        results.append((window['total_price'].sum(), window['quantity'].sum(), window['profit'].sum()))
+    breakdown = orders_data.groupby('item').agg(
+        total_sold=('quantity', 'sum'),
+        total_revenue=('total_price', 'sum'),
+        total_profit=('profit', 'sum')
+    ).reset_index()
+    return results, breakdown
+
+
+def rollup_read(rollup):
+    today = date.today()
+    results = [rollup.totals(today, today),
+               rollup.totals(today - timedelta(weeks=1), today),
+               rollup.totals(today - timedelta(days=30), today)]
+    breakdown = pd.DataFrame(rollup.item_breakdown(), columns=['item', 'total_sold', 'total_revenue', 'total_profit'])
+    return results, breakdown
+
+
+def best_of(repeat, func, *args):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'orders':>10} {'full recompute':>15} {'rollup read':>12} {'rollup build':>13} {'per order':>10}")
+    for size in args.sizes:
+        orders = synthetic_orders(size, days=730)
+        full = best_of(args.repeat, full_recompute, orders)
+
+        compact = [Order.from_json(order) for order in orders]
+        start = time.perf_counter()
+        rollup = SalesRollup(COSTS)
+        for order in compact:
+            rollup.order_added(order)
+        build = time.perf_counter() - start
+
+        read = best_of(args.repeat, rollup_read, rollup)
+        print(f"{size:>10} {full * 1e3:>12.1f} ms {read * 1e3:>9.2f} ms {build * 1e3:>10.0f} ms "
+              f"{build / size * 1e6:>7.2f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""Memory and time of exporting orders, for a day up to three years of them.
+
+Fills a SQLite database in a temporary directory with --count orders
+spread over --days days, then exports the last day, month, year and all
+of them as gzipped CSV with export.export(), measuring the peak of
+Python allocations with tracemalloc. For comparison, the same exports
+through a DataFrame (orders_frame() filtered, then to_csv), which is
+what getting data out of the dashboard amounts to.
+
+    python -m benchmarks.export --count 1000000 --days 1095
+"""
+import argparse
+import gc
+import io
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta
+
+from benchmarks import stub_streamlit
+from benchmarks.common import synthetic_orders
+
+
+class Sink(io.RawIOBase):
+    """A binary file that only counts what is written to it."""
+
+    def __init__(self):
+        self.size = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.size += len(data)
+        return len(data)
+
+
+def measure(function, *args):
+    """Return (seconds, peak MB of Python allocations, result) of a call.
+
+    Run twice: tracing the allocations slows everything down several times.
+    """
+    gc.collect()
+    start = time.perf_counter()
+    function(*args)
+    seconds = time.perf_counter() - start
+    gc.collect()
+    tracemalloc.start()
+    result = function(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return seconds, peak / 2 ** 20, result
+
+
+def stream_export(db, start, end):
+    """Return (orders, gzipped bytes) of an export.export() of the orders from start to end."""
+    from export import export
+    sink = Sink()
+    return export(db, 'orders', sink, 'csv', start, end), sink.size
+
+
+def frame_export(db, start, end):
+    """The same through a DataFrame: the whole history, filtered, then written in one go."""
+    sink = Sink()
+    frame = db.orders_frame()
+    frame = frame[(frame['date'] >= datetime(start.year, start.month, start.day))
+                  & (frame['date'] < datetime(end.year, end.month, end.day) + timedelta(days=1))]
+    frame.to_csv(sink, compression='gzip', index=False)
+    return len(frame), sink.size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--count', type=int, default=1_000_000)
+    parser.add_argument('--days', type=int, default=3 * 365)
+    parser.add_argument('--skip-frame', action='store_true', help="leave out the DataFrame exports")
+    args = parser.parse_args()
+
+    root = os.getcwd()
+    directory = tempfile.mkdtemp(prefix="export_")
+    try:
+        shutil.copy("menu.json", directory)
+        os.chdir(directory)
+        stub_streamlit.install()
+        from sqlite_backend import ORDER_COLUMNS, ORDER_KEYS, SqliteDatabase, order_to_row
+        db = SqliteDatabase()
+        # Written in batches, so the benchmark itself does not hold every order
+        batch, span = 100_000, args.days / args.count  # Days between orders
+        for first in range(0, args.count, batch):
+            size = min(batch, args.count - first)
+            orders = synthetic_orders(size, start_id=first + 1, days=span * size, seed=first)
+            # synthetic_orders() ends at now; move the batch back to its place in the range
+            shift = timedelta(days=span * (args.count - first - size))
+            for order in orders:
+                order['date'] = (datetime.fromisoformat(order['date']) - shift).strftime("%Y-%m-%d %H:%M:%S")
+            with db.connection() as conn:
+                conn.executemany(f"INSERT INTO orders ({ORDER_COLUMNS}) "
+                                 f"VALUES ({', '.join('?' * (len(ORDER_KEYS) + 1))})", map(order_to_row, orders))
+        del orders
+        print(f"{args.count:,} orders over {args.days} days (SQLite)")
+
+        today = date.today()
+        print(f"{'range':<8} {'orders':>9} {'export':>9} {'peak':>9} {'gzip':>9}"
+              + ("" if args.skip_frame else f" {'frame':>9} {'peak':>9}"))
+        for name, days in (('day', 0), ('month', 30), ('year', 365), ('all', args.days)):
+            start = today - timedelta(days=days)
+            seconds, peak, (count, size) = measure(stream_export, db, start, today)
+            line = f"{name:<8} {count:>9,} {seconds:>8.2f}s {peak:>7.1f}MB {size / 2 ** 20:>7.1f}MB"
+            if not args.skip_frame:
+                frame_seconds, frame_peak, (frame_count, _) = measure(frame_export, db, start, today)
+                assert frame_count == count
+                line += f" {frame_seconds:>8.2f}s {frame_peak:>7.1f}MB"
+            print(line)
+    finally:
+        os.chdir(root)
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
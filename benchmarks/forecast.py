@@ -0,0 +1,126 @@
+"""Demand forecasting and restock planning on a year of minute-level orders.
+
+Builds an order frame like Database.orders_frame() returns (one order a
+minute for --days days, over --items items, a few cancelled) and times:
+
+- demand_series, daily and hourly, against counting the same demand in
+  a Python loop over the orders;
+- both forecasts and restock_plan on the daily series;
+- applying the restocks: adjust_stocks (one write) against adjust_stock
+  per item, in a temporary directory.
+
+    python -m benchmarks.forecast --days 365 --items 300
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks import stub_streamlit
+
+
+def order_frame(days, items, seed=42):
+    """A frame shaped like OrderColumns.frame(): one order a minute, popular items ordered more."""
+    import pandas as pd
+    rng = np.random.default_rng(seed)
+    count = days * 24 * 60
+    start = np.datetime64('now', 's').astype(np.int64) // 86400 * 86400 - days * 86400
+    popularity = rng.pareto(1.5, items) + 0.1
+    return pd.DataFrame({
+        'order_id': np.arange(count, dtype=np.int64),
+        'date': (start + np.arange(count, dtype=np.int64) * 60).view('datetime64[s]'),
+        'customer': pd.Categorical.from_codes(rng.integers(0, 5000, count).astype(np.int32),
+                                              [f"customer{number}" for number in range(5000)]),
+        'item': pd.Categorical.from_codes(rng.choice(items, count, p=popularity / popularity.sum()).astype(np.int32),
+                                          [f"Item {number}" for number in range(items)]),
+        'status': pd.Categorical.from_codes(rng.choice(3, count, p=[0.6, 0.35, 0.05]).astype(np.int32),
+                                            ['Ready', 'Paid', 'Cancelled']),
+        'quantity': rng.integers(1, 4, count),
+        'cents': rng.integers(500, 1500, count),
+    })
+
+
+def loop_demand(frame):
+    """The same daily demand, counted one order at a time."""
+    demand = {}
+    for day, item, status, quantity in zip(frame['date'].dt.strftime("%Y-%m-%d"), frame['item'],
+                                           frame['status'], frame['quantity']):
+        if status != 'Cancelled':
+            demand[day, item] = demand.get((day, item), 0) + quantity
+    return demand
+
+
+def best_of(repeat, function, *args, **kwargs):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args, **kwargs)
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--items', type=int, default=300)
+    parser.add_argument('--cover', type=int, default=7, help="days of stock the restocks cover")
+    parser.add_argument('--repeat', type=int, default=5, help="runs per measurement; the best is shown")
+    parser.add_argument('--skip-loop', action='store_true', help="leave out the (slow) per-order loop")
+    args = parser.parse_args()
+
+    from forecast import demand_series, restock_plan, smoothed
+    frame = order_frame(args.days, args.items)
+    names = list(frame['item'].cat.categories)
+    print(f"{len(frame):,} orders over {args.days} days, {args.items} items")
+
+    daily_time, daily = best_of(args.repeat, demand_series, frame, 'day', items=names)
+    hourly_time, hourly = best_of(args.repeat, demand_series, frame, 'hour', items=names)
+    smoothing_time, _ = best_of(args.repeat, smoothed, daily, 'smoothing')
+    average_time, _ = best_of(args.repeat, smoothed, daily, 'average')
+    levels = {item: (int(stock), 0) for item, stock in zip(names, np.random.default_rng(1).integers(0, 200, args.items))}
+    plan_time, plan = best_of(args.repeat, restock_plan, daily, levels, args.cover)
+    total_time, _ = best_of(args.repeat, lambda: restock_plan(demand_series(frame, 'day', items=names), levels,
+                                                              args.cover))
+    print(f"{'daily demand series':<28} {daily_time * 1e3:>8.1f} ms  {daily.shape[0]} x {daily.shape[1]}")
+    print(f"{'hourly demand series':<28} {hourly_time * 1e3:>8.1f} ms  {hourly.shape[0]} x {hourly.shape[1]}")
+    print(f"{'exponential smoothing':<28} {smoothing_time * 1e3:>8.1f} ms")
+    print(f"{'moving average':<28} {average_time * 1e3:>8.1f} ms")
+    print(f"{'restock plan':<28} {plan_time * 1e3:>8.1f} ms  {int((plan['restock'] > 0).sum())} items to restock")
+    print(f"{'orders to restock plan':<28} {total_time * 1e3:>8.1f} ms")
+    if not args.skip_loop:
+        loop_time, counted = best_of(1, loop_demand, frame)
+        assert sum(counted.values()) == daily.to_numpy().sum()
+        print(f"{'daily demand, Python loop':<28} {loop_time * 1e3:>8.1f} ms")
+
+    root = os.getcwd()
+    directory = tempfile.mkdtemp(prefix="forecast_")
+    try:
+        shutil.copy("menu.json", directory)
+        os.chdir(directory)
+        stub_streamlit.install()
+        from shared import Database
+        db = Database(compact_threshold=10 ** 9)
+        restocks = dict(zip(plan['item'], plan['restock']))
+        start = time.perf_counter()
+        for item, units in restocks.items():
+            db.adjust_stock(item, int(units))
+        each = time.perf_counter() - start
+        start = time.perf_counter()
+        db.adjust_stocks(restocks)
+        batched = time.perf_counter() - start
+        assert all(db.inventory[item] == 2 * units + db.default_inventory().get(item, 0)
+                   for item, units in restocks.items())
+        with open("inventory.journal.jsonl") as file:
+            writes = sum(1 for _ in file)
+        print(f"{'restock, per item':<28} {each * 1e3:>8.1f} ms  {writes - 1} writes")
+        print(f"{'restock, adjust_stocks':<28} {batched * 1e3:>8.1f} ms  1 write")
+    finally:
+        os.chdir(root)
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""Stock reservation under contention: many buyers racing for one item.
+
+Starts --processes worker processes with --threads buyers each, all
+reserving from the same limited stock. Each successful reservation is then
+paid (committed) or, with probability --cancel-rate, cancelled (released)
+so the stock can be reserved again:
+
+    python -m benchmarks.inventory_contention --processes 4 --threads 8 --stock 500
+    python -m benchmarks.inventory_contention --backend sqlite
+
+Afterwards the stock must add up exactly: nothing sold twice, nothing
+still reserved. Runs in a temporary directory.
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import tempfile
+import threading
+import time
+
+from benchmarks.common import percentile
+
+ITEM = 'Latte'
+
+
+def open_database(backend):
+    if backend == 'sqlite':
+        from sqlite_backend import SqliteDatabase
+        return SqliteDatabase("bench.db")
+    from shared import Database
+    return Database()
+
+
+def buyer(db, attempts, cancel_rate, seed, results):
+    rng = random.Random(seed)
+    latencies, paid, refused = [], 0, 0
+    for attempt in range(attempts):
+        order_id = seed * 1000000 + attempt
+        quantity = rng.randint(1, 3)
+        start = time.perf_counter()
+        reserved = db.reserve_stock(order_id, ITEM, quantity)
+        latencies.append(time.perf_counter() - start)
+        if not reserved:
+            refused += 1
+        elif rng.random() < cancel_rate:
+            db.release_stock(order_id)
+        else:
+            db.commit_stock(order_id)
+            paid += quantity
+    results.append((latencies, paid, refused))
+
+
+def worker(directory, backend, process, threads, attempts, cancel_rate, queue):
+    os.chdir(directory)
+    db = open_database(backend)
+    results = []
+    buyers = [threading.Thread(target=buyer, args=(db, attempts, cancel_rate, process * threads + i + 1, results))
+              for i in range(threads)]
+    for thread in buyers:
+        thread.start()
+    for thread in buyers:
+        thread.join()
+    queue.put(results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--backend', choices=['json', 'sqlite'], default='json')
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=8, help="buyers per process")
+    parser.add_argument('--attempts', type=int, default=200, help="reservations tried per buyer")
+    parser.add_argument('--stock', type=int, default=1000)
+    parser.add_argument('--cancel-rate', type=float, default=0.2)
+    args = parser.parse_args()
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            db = open_database(args.backend)
+            db.adjust_stock(ITEM, args.stock - db.inventory.get(ITEM, 0))
+
+            queue = multiprocessing.Queue()
+            processes = [multiprocessing.Process(target=worker, args=(tmp, args.backend, p, args.threads,
+                                                                      args.attempts, args.cancel_rate, queue))
+                         for p in range(args.processes)]
+            start = time.perf_counter()
+            for process in processes:
+                process.start()
+            results = [result for _ in processes for result in queue.get()]
+            for process in processes:
+                process.join()
+            elapsed = time.perf_counter() - start
+
+            db.refresh()
+            latencies = [sample for samples, _, _ in results for sample in samples]
+            paid = sum(paid for _, paid, _ in results)
+            refused = sum(refused for _, _, refused in results)
+            on_hand, reserved = db.stock_levels()[ITEM]
+        finally:
+            os.chdir(cwd)
+
+    buyers = args.processes * args.threads
+    print(f"{args.backend}: {buyers} buyers in {args.processes} processes, {len(latencies)} reservations "
+          f"in {elapsed:.2f} s ({len(latencies) / elapsed:,.0f}/s)")
+    print(f"reserve latency p50 {percentile(latencies, 50) * 1e3:.2f} ms, "
+          f"p95 {percentile(latencies, 95) * 1e3:.2f} ms, p99 {percentile(latencies, 99) * 1e3:.2f} ms")
+    print(f"sold {paid} of {args.stock}, {refused} refused, {on_hand} left on hand, {reserved} still reserved")
+    if on_hand != args.stock - paid or on_hand < 0 or reserved != 0:
+        raise SystemExit("stock does not add up")
+
+
+if __name__ == "__main__":
+    main()
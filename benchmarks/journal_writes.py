@@ -0,0 +1,75 @@
+"""Order write latency as the order history grows.
+
+Compares the journaled add_order (one appended JSON line per order) with the
+old full rewrite of orders.json, at several history sizes:
+
+    python -m benchmarks.journal_writes --sizes 1000 10000 100000 1000000
+
+Each size runs in its own temporary directory, so the real data files are
+never touched.
+"""
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+
+from benchmarks.common import percentile, synthetic_orders
+
+
+def run_size(Database, size, writes, legacy_writes, compact_threshold):
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        history = synthetic_orders(size)
+        with open("orders.json", 'w') as file:
+            json.dump(history, file)
+        del history
+
+        db = Database(journal=True, compact_threshold=compact_threshold)
+        new_orders = synthetic_orders(writes, start_id=size + 1)
+        samples = []
+        for order in new_orders:
+            start = time.perf_counter()
+            db.add_order(order)
+            samples.append(time.perf_counter() - start)
+
+        legacy = []
+        for _ in range(legacy_writes):
+            start = time.perf_counter()
+            db.save_orders()
+            legacy.append(time.perf_counter() - start)
+
+    return {
+        'size': size,
+        'p50_us': percentile(samples, 50) * 1e6,
+        'p99_us': percentile(samples, 99) * 1e6,
+        'max_us': max(samples) * 1e6,
+        'legacy_ms': statistics.median(legacy) * 1e3 if legacy else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000, 1000000])
+    parser.add_argument('--writes', type=int, default=2000, help="journaled writes timed per size")
+    parser.add_argument('--legacy-writes', type=int, default=3, help="full rewrites timed per size (0 to skip)")
+    parser.add_argument('--compact-threshold', type=int, default=1000)
+    args = parser.parse_args()
+
+    cwd = os.getcwd()
+    from shared import Database
+
+    print(f"{'orders':>10} {'journal p50':>12} {'p99':>10} {'max':>10} {'full rewrite':>14}")
+    try:
+        for size in args.sizes:
+            result = run_size(Database, size, args.writes, args.legacy_writes, args.compact_threshold)
+            legacy = f"{result['legacy_ms']:.1f} ms" if result['legacy_ms'] is not None else "-"
+            print(f"{result['size']:>10} {result['p50_us']:>9.1f} us {result['p99_us']:>7.1f} us "
+                  f"{result['max_us']:>7.1f} us {legacy:>14}")
+    finally:
+        os.chdir(cwd)
+
+
+if __name__ == "__main__":
+    main()
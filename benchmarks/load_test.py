@@ -0,0 +1,174 @@
+"""Load test: concurrent customers and admins driving the pages.
+
+Calls the page functions of customer_page and admin_dashboard directly, on
+one thread per simulated session, with a stubbed streamlit module
+(benchmarks/stub_streamlit.py) and the fake Stripe client. Runs in a
+temporary directory seeded with a synthetic order history:
+
+    python -m benchmarks.load_test --orders 100000 --sessions 32 --duration 30
+    python -m benchmarks.load_test --mix order=5,history=3,notifications=10,dashboard=1 --backend sqlite
+
+Each operation is one rerun: db.refresh() followed by the page function,
+as main.py does it. Streamlit's own work (serializing elements and
+DataFrames, the websocket) is not included, so the numbers are what the
+app and its storage cost per rerun.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+
+from benchmarks import stub_streamlit
+from benchmarks.common import ITEMS, percentile, synthetic_orders
+
+DEFAULT_MIX = "order=4,history=3,notifications=2,updates=8,kitchen=2,dashboard=1"
+CUSTOMERS = 5000
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def setup(directory, backend, orders):
+    """Seed the directory with an order history and import the app against it."""
+    shutil.copy("menu.json", directory)
+    os.chdir(directory)
+    with open("orders.json", 'w') as file:
+        json.dump(synthetic_orders(orders, customers=CUSTOMERS), file)
+
+    stub_streamlit.install()
+    os.environ["COFFEE_SHOP_STRIPE"] = "fake"
+    os.environ["COFFEE_SHOP_STORAGE"] = backend
+    os.environ["COFFEE_SHOP_SQLITE_PATH"] = "load_test.db"
+    import shared
+    if backend == 'sqlite':
+        shared.db.import_json(shared.Database())
+    # Enough stock that orders never sell out
+    for item in shared.db.catalog.names():
+        shared.db.adjust_stock(item, 10 ** 9)
+
+    import admin_dashboard
+    import customer_page
+    return shared.db, customer_page, admin_dashboard
+
+
+def operations(db, customer_page, admin_dashboard):
+    def order(rng, username):
+        stub_streamlit.set_inputs({'Choose your coffee:': rng.choice(ITEMS), 'Enter quantity:': rng.randint(1, 3)},
+                                  clicks={'Proceed to Payment'})
+        customer_page.customer_order_process()
+
+    def history(rng, username):
+        stub_streamlit.set_inputs()
+        customer_page.order_history_page()
+
+    def notifications(rng, username):
+        stub_streamlit.set_inputs()
+        customer_page.order_notifications_page(username)
+
+    def updates(rng, username):
+        # The order_updates fragment every customer session reruns on its own
+        stub_streamlit.set_inputs()
+        customer_page.order_updates(username)
+
+    def kitchen(rng, username):
+        # A barista marking the first few orders of the queue as Ready
+        orders, _ = db.kitchen_queue(limit=rng.randint(1, 10))
+        stub_streamlit.set_inputs({'kitchen_selected': [order['order_id'] for order in orders]},
+                                  clicks={'Mark as Ready'})
+        admin_dashboard.kitchen_queue_page()
+
+    def dashboard(rng, username):
+        stub_streamlit.set_inputs()
+        admin_dashboard.admin_dashboard_page()
+
+    return {'order': order, 'history': history, 'notifications': notifications, 'updates': updates,
+            'kitchen': kitchen, 'dashboard': dashboard}
+
+
+def session(db, ops, mix, seed, deadline, results):
+    rng = random.Random(seed)
+    username = f"customer{rng.randint(1, CUSTOMERS)}"
+    stub_streamlit.session()['state'].update({'logged_in': True, 'role': 'Customer', 'username': username})
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    samples = {name: [] for name in names}
+    failures = {name: 0 for name in names}
+    while time.perf_counter() < deadline:
+        name = rng.choices(names, weights)[0]
+        start = time.perf_counter()
+        try:
+            db.refresh()
+            ops[name](rng, username)
+        except Exception as e:
+            failures[name] += 1
+            if failures[name] == 1:
+                print(f"{name} failed: {e!r}")
+        else:
+            failures[name] += any(kind == 'error' for kind, _ in stub_streamlit.session()['messages'])
+        samples[name].append(time.perf_counter() - start)
+    results.append((samples, failures))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--orders', type=int, default=10000, help="orders in the synthetic history")
+    parser.add_argument('--sessions', type=int, default=16, help="concurrent sessions (threads)")
+    parser.add_argument('--duration', type=float, default=10, help="seconds to run")
+    parser.add_argument('--mix', default=DEFAULT_MIX, help="operation weights, e.g. " + DEFAULT_MIX)
+    parser.add_argument('--backend', choices=['json', 'sqlite'], default='json')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    mix = parse_mix(args.mix)
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        try:
+            db, customer_page, admin_dashboard = setup(tmp, args.backend, args.orders)
+            ops = operations(db, customer_page, admin_dashboard)
+            unknown = set(mix) - set(ops)
+            if unknown:
+                parser.error(f"unknown operations: {', '.join(sorted(unknown))}")
+
+            results = []
+            deadline = time.perf_counter() + args.duration
+            threads = [threading.Thread(target=session, args=(db, ops, mix, args.seed + i, deadline, results))
+                       for i in range(args.sessions)]
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - start
+            checkout = customer_page.checkout_queue().latency_percentiles(50, 99)
+        finally:
+            os.chdir(cwd)
+
+    print(f"{args.backend}: {args.orders} orders in history, {args.sessions} sessions, {elapsed:.1f} s")
+    print(f"{'operation':<14} {'count':>7} {'ops/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'failed':>7}")
+    total = 0
+    for name in mix:
+        samples = [sample for result, _ in results for sample in result[name]]
+        failed = sum(failures[name] for _, failures in results)
+        total += len(samples)
+        if not samples:
+            print(f"{name:<14} {0:>7}")
+            continue
+        print(f"{name:<14} {len(samples):>7} {len(samples) / elapsed:>8.1f} "
+              f"{percentile(samples, 50) * 1e3:>8.2f} {percentile(samples, 95) * 1e3:>8.2f} "
+              f"{percentile(samples, 99) * 1e3:>8.2f} {failed:>7}")
+    print(f"{'all':<14} {total:>7} {total / elapsed:>8.1f}")
+    if checkout[0] is not None:
+        print(f"checkout session latency (fake Stripe): p50 {checkout[0] * 1e3:.0f} ms, p99 {checkout[1] * 1e3:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+"""Menu image payload: original images vs generated thumbnails.
+
+Run from the directory holding menu_images/ (see menu_assets.py fetch).
+Reports the bytes a browser downloads per menu image before (the full
+original) and after (the thumbnail, and the same inlined as a data URI),
+plus the time to generate each thumbnail once.
+
+    python -m benchmarks.menu_payload
+"""
+import os
+import time
+
+import menu_assets
+from catalog import Catalog
+
+
+def main():
+    rows = []
+    for item in Catalog().names():
+        source = menu_assets.source_path(item)
+        if source is None:
+            print(f"{item}: no original in {menu_assets.SOURCE_DIR}/, skipped")
+            continue
+        start = time.perf_counter()
+        thumbnail = menu_assets.thumbnail_path(source)
+        generate = time.perf_counter() - start
+        inline = len(menu_assets.image_src(item))
+        rows.append((item, os.path.getsize(source), os.path.getsize(thumbnail), inline, generate))
+
+    if not rows:
+        return
+    print(f"{'item':<20} {'original':>10} {'thumbnail':>10} {'inline':>10} {'first build':>12}")
+    for item, original, thumbnail, inline, generate in rows:
+        print(f"{item:<20} {original:>10,} {thumbnail:>10,} {inline:>10,} {generate * 1e3:>9.0f} ms")
+    before = sum(row[1] for row in rows)
+    after = sum(row[2] for row in rows)
+    print(f"{'total':<20} {before:>10,} {after:>10,} {sum(row[3] for row in rows):>10,}"
+          f"   ({before / after:.1f}x smaller)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Order memory and DataFrame build time: orders.json dicts vs the compact order model.
+
+Dicts are what json.load gives for orders.json, and what the app used to
+keep in memory. The compact model is order_model.Order objects plus the
+OrderColumns arrays. The DataFrame build is what the dashboard used to do
+on every rerun (build a frame from the dicts and parse every date)
+against OrderColumns.frame().
+
+    python -m benchmarks.order_model --orders 1000000
+"""
+import argparse
+import gc
+import json
+import time
+import tracemalloc
+
+import pandas as pd
+
+from benchmarks.common import synthetic_orders
+from order_model import Order, OrderColumns
+
+
+def measure(build):
+    """Return what build() returns, the bytes it keeps allocated, and its time (without tracing)."""
+    gc.collect()
+    start = time.perf_counter()
+    result = build()
+    elapsed = time.perf_counter() - start
+    del result
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    gc.collect()
+    kept = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, kept, elapsed
+
+
+def best_of(repeat, func, *args):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def dict_frame(orders):
+    orders_data = pd.DataFrame(orders)
+    orders_data['date'] = pd.to_datetime(orders_data['date'])
+    return orders_data
+
+
+def build_compact(text):
+    # As OrderJournal.load_snapshot does it: each order converted as soon as it is parsed
+    orders = json.loads(text, object_hook=Order.from_json)
+    columns = OrderColumns()
+    for order in orders:
+        columns.order_added(order)
+    columns.frame()  # Writes the queued orders into the arrays
+    return orders, columns
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--orders', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    text = json.dumps(synthetic_orders(args.orders, days=730))
+    dicts, dict_bytes, dict_load = measure(lambda: json.loads(text))
+    (orders, columns), compact_bytes, compact_load = measure(lambda: build_compact(text))
+    assert [order.to_json() for order in orders[:1000]] == dicts[:1000]
+
+    dict_build = best_of(args.repeat, dict_frame, dicts)
+    compact_build = best_of(args.repeat, columns.frame)
+    array_bytes = sum(array.nbytes for array in columns.arrays.values())
+
+    print(f"{args.orders} orders")
+    print(f"{'':<22} {'bytes/order':>12} {'load':>10} {'DataFrame':>12}")
+    print(f"{'dicts':<22} {dict_bytes / args.orders:>12.0f} {dict_load:>8.2f} s {dict_build * 1e3:>9.1f} ms")
+    print(f"{'Order + OrderColumns':<22} {compact_bytes / args.orders:>12.0f} {compact_load:>8.2f} s "
+          f"{compact_build * 1e3:>9.1f} ms")
+    print(f"(of which OrderColumns arrays: {array_bytes / args.orders:.0f} bytes/order, with spare capacity)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+"""Payment confirmation throughput and idempotency, from a replayable fixture of Stripe events.
+
+The fixture is what Stripe would deliver for a batch of paid checkouts:
+signed checkout.session.completed events linked to their orders the way
+StripeCheckoutClient creates the sessions, with retried (duplicate)
+deliveries, events of other types and a few forged signatures, shuffled.
+Runs in a temporary directory against a synthetic history and compares:
+
+- per event: update_order_status(order_id, 'Paid') for every paid event,
+  as the success page used to do;
+- batched: PaymentEventProcessor.replay, one orders write per batch;
+- webhook: the same deliveries POSTed to the webhook receiver (--http).
+
+Each batched run is then replayed again, which must change nothing.
+
+    python -m benchmarks.payment_events --orders 100000 --paid 5000
+    python -m benchmarks.payment_events --paid 200 --write deliveries.jsonl  # then: python payment_events.py replay
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks import stub_streamlit
+from benchmarks.common import synthetic_orders
+
+SECRET = "whsec_benchmark"
+OTHER_EVENTS = ('payment_intent.created', 'charge.succeeded', 'checkout.session.expired')
+
+
+def fixture(orders, secret=SECRET, duplicates=0.2, others=0.3, forged=0.01, seed=42):
+    """Return signed webhook deliveries ({'payload', 'signature'}) for paid checkouts of orders."""
+    rng = random.Random(seed)
+    now = int(time.time())
+    events = []
+    for number, order in enumerate(orders):
+        events.append({
+            'id': f"evt_paid_{number}",
+            'object': 'event',
+            'type': 'checkout.session.completed',
+            'created': now,
+            'data': {'object': {
+                'id': f"cs_test_{order['order_id']}",
+                'object': 'checkout.session',
+                'amount_total': round(order['total_price'] * 100),
+                'client_reference_id': str(order['order_id']),
+                'metadata': {'order_id': str(order['order_id'])},
+                'payment_status': 'paid',
+            }},
+        })
+    for number in range(int(len(orders) * others)):
+        events.append({'id': f"evt_other_{number}", 'object': 'event', 'type': rng.choice(OTHER_EVENTS),
+                       'created': now, 'data': {'object': {}}})
+    # Stripe delivers again when it does not get a 2xx in time
+    events += [rng.choice(events) for _ in range(int(len(events) * duplicates))]
+    rng.shuffle(events)
+
+    from payment_events import sign_payload
+    deliveries = []
+    for event in events:
+        payload = json.dumps(event)
+        signature = sign_payload(payload, secret, now)
+        if rng.random() < forged:
+            payload = payload.replace('"paid"', '"paid" ', 1)  # Tampered after signing
+        deliveries.append({'payload': payload, 'signature': signature})
+    return deliveries
+
+
+def journal_lines():
+    with open("orders.journal.jsonl") as file:
+        return sum(1 for _ in file)
+
+
+def seed(directory, orders, paid):
+    """A fresh data directory; returns the orders the fixture pays for."""
+    for name in os.listdir(directory):
+        if name != "menu.json":
+            os.remove(os.path.join(directory, name))
+    history = synthetic_orders(orders)
+    for order in history[-paid:]:
+        order['status'] = 'Pending'
+    with open("orders.json", 'w') as file:
+        json.dump(history, file)
+    return history[-paid:]
+
+
+def post_all(port, deliveries, clients):
+    local = threading.local()
+
+    def post(delivery):
+        if not hasattr(local, 'connection'):
+            local.connection = http.client.HTTPConnection("127.0.0.1", port)
+        local.connection.request('POST', "/", body=delivery['payload'].encode(),
+                                 headers={'Stripe-Signature': delivery['signature'],
+                                          'Content-Type': 'application/json'})
+        response = local.connection.getresponse()
+        response.read()
+        return response.status
+
+    with ThreadPoolExecutor(clients) as pool:
+        return list(pool.map(post, deliveries))
+
+
+def start_webhook(processor, batch_size):
+    """Serve the webhook receiver on a free local port, on a background thread."""
+    from payment_events import WebhookServer
+    server = WebhookServer(("127.0.0.1", 0), processor, batch_size)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--orders', type=int, default=100000, help="orders in the history")
+    parser.add_argument('--paid', type=int, default=5000, help="pending orders the fixture pays for")
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--http', action='store_true', help="also POST the fixture to the webhook receiver")
+    parser.add_argument('--clients', type=int, default=16, help="concurrent webhook deliveries with --http")
+    parser.add_argument('--write', help="only write the fixture (for the paid orders of the history) to this file")
+    args = parser.parse_args()
+
+    root = os.getcwd()
+    directory = tempfile.mkdtemp(prefix="payment_events_")
+    try:
+        shutil.copy("menu.json", directory)
+        os.chdir(directory)
+        stub_streamlit.install()
+        from payment_events import PaymentEventProcessor, paid_order_id, verify_signature
+        from shared import Database
+
+        deliveries = fixture(seed(directory, args.orders, args.paid))
+        if args.write:
+            with open(os.path.join(root, args.write), 'w') as file:
+                file.writelines(json.dumps(delivery) + "\n" for delivery in deliveries)
+            print(f"Wrote {len(deliveries)} deliveries for {args.paid} paid orders to {args.write}")
+            return
+        lines = [json.dumps(delivery) for delivery in deliveries]
+        # The orders with at least one genuine paid event
+        expected = set()
+        for delivery in deliveries:
+            try:
+                verify_signature(delivery['payload'], delivery['signature'], SECRET, tolerance=None)
+            except ValueError:
+                continue
+            expected.add(paid_order_id(json.loads(delivery['payload'])))
+        expected.discard(None)
+        print(f"{len(deliveries)} deliveries for {args.paid} paid orders, {args.orders} orders in the history")
+        print(f"{'':<22} {'time':>9} {'events/s':>10} {'order writes':>13} {'newly paid':>11}")
+
+        def report(name, elapsed, writes, paid):
+            print(f"{name:<22} {elapsed:>7.2f} s {len(deliveries) / elapsed:>10.0f} {writes:>13} {paid:>11}")
+
+        # Per event, as the success page did it: no signature check, no dedupe
+        seed(directory, args.orders, args.paid)
+        db = Database(compact_threshold=10 ** 9)
+        paid_before = db.count_by_status('Paid')
+        start = time.perf_counter()
+        for delivery in deliveries:
+            event = json.loads(delivery['payload'])
+            if event['type'] == 'checkout.session.completed':
+                db.update_order_status(int(event['data']['object']['client_reference_id']), 'Paid')
+        report("per event", time.perf_counter() - start, journal_lines(), db.count_by_status('Paid') - paid_before)
+
+        runs = [('batched', None)] + ([('webhook', args.clients)] if args.http else [])
+        for name, clients in runs:
+            seed(directory, args.orders, args.paid)
+            db = Database(compact_threshold=10 ** 9)
+            paid_before = db.count_by_status('Paid')
+            processor = PaymentEventProcessor(db, SECRET, tolerance=None)
+            start = time.perf_counter()
+            if clients:
+                server = start_webhook(processor, args.batch_size)
+                statuses = post_all(server.server_address[1], deliveries, clients)
+                server.shutdown()
+                assert statuses.count(400) == processor.stats['rejected']
+            else:
+                processor.replay(lines, args.batch_size)
+            elapsed = time.perf_counter() - start
+            newly_paid = db.count_by_status('Paid') - paid_before
+            report(name, elapsed, journal_lines(), newly_paid)
+            print(f"{'':<22} {processor.stats}")
+
+            # Replaying everything again must not change a thing
+            writes, events = journal_lines(), db.events.state.seq
+            again = PaymentEventProcessor(Database(compact_threshold=10 ** 9), SECRET, tolerance=None)
+            stats = again.replay(lines, args.batch_size)
+            assert stats['paid'] == 0 and journal_lines() == writes and db.events.state.seq == events, stats
+            assert newly_paid == len(expected)
+            assert all(db.get_order(order_id)['status'] == 'Paid' for order_id in expected)
+            print(f"{'replayed again':<22} {stats}")
+    finally:
+        os.chdir(root)
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+"""A stand-in for the streamlit module, to run the pages without a server.
+
+install() puts it in sys.modules, so call it before importing any app
+module. Every thread is one browser session with its own session_state,
+query params, widget values (see set_inputs) and collected messages.
+Output elements do nothing.
+"""
+import sys
+import threading
+import types
+from datetime import date
+
+_local = threading.local()
+
+
+def session():
+    """Return this thread's session: state, inputs, clicks, query params and messages."""
+    if not hasattr(_local, 'session'):
+        _local.session = {'state': {}, 'inputs': {}, 'clicks': set(), 'query_params': {}, 'messages': []}
+    return _local.session
+
+
+def set_inputs(inputs=None, clicks=()):
+    """Set the widget values (by key or label) and the buttons clicked for the next rerun."""
+    current = session()
+    current['inputs'] = dict(inputs or {})
+    current['clicks'] = set(clicks)
+    current['messages'] = []
+
+
+class _SessionDict:
+    """Dict and attribute access to one entry of the current thread's session."""
+
+    def __init__(self, name):
+        self._name = name
+
+    def _data(self):
+        return session()[self._name]
+
+    def __contains__(self, key):
+        return key in self._data()
+
+    def __getitem__(self, key):
+        return self._data()[key]
+
+    def __setitem__(self, key, value):
+        self._data()[key] = value
+
+    def __delitem__(self, key):
+        del self._data()[key]
+
+    def __iter__(self):
+        return iter(self._data())
+
+    def __len__(self):
+        return len(self._data())
+
+    def get(self, key, default=None):
+        return self._data().get(key, default)
+
+    def pop(self, key, *default):
+        return self._data().pop(key, *default)
+
+    def setdefault(self, key, default=None):
+        return self._data().setdefault(key, default)
+
+    def update(self, *args, **kwargs):
+        self._data().update(*args, **kwargs)
+
+    def keys(self):
+        return self._data().keys()
+
+    def items(self):
+        return self._data().items()
+
+    def __getattr__(self, key):
+        try:
+            return self._data()[key]
+        except KeyError:
+            raise AttributeError(key) from None
+
+    def to_dict(self):
+        return dict(self._data())
+
+
+class _Container:
+    """What st.columns, st.sidebar and friends return: usable with `with` and as `st`."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __getattr__(self, name):
+        return getattr(module, name)
+
+
+def _noop(*args, **kwargs):
+    return None
+
+
+def _passthrough(func=None, **kwargs):
+    # @st.fragment / @st.fragment(run_every=1)
+    return func if func is not None else (lambda func: func)
+
+
+def _memoize(func=None, **kwargs):
+    # @st.cache_data / @st.cache_resource(ttl=...): cache by arguments
+    def decorate(func):
+        cache = {}
+        lock = threading.Lock()
+
+        def wrapper(*args, **kw):
+            key = (args, tuple(sorted(kw.items())))
+            with lock:
+                if key not in cache:
+                    cache[key] = func(*args, **kw)
+                return cache[key]
+        wrapper.clear = cache.clear
+        return wrapper
+    return decorate(func) if func is not None else decorate
+
+
+def _widget(label, default, key=None):
+    inputs = session()['inputs']
+    value = inputs.get(key, inputs.get(label, default))
+    if key is not None:
+        session()['state'][key] = value
+    return value
+
+
+def _selectbox(label, options, index=0, key=None, **kwargs):
+    options = list(options)
+    return _widget(label, options[index] if options else None, key)
+
+
+def _number_input(label, min_value=None, max_value=None, value=None, step=None, key=None, **kwargs):
+    return _widget(label, value if value is not None else (min_value if min_value is not None else 0), key)
+
+
+def _text_input(label, value="", key=None, **kwargs):
+    return _widget(label, value, key)
+
+
+def _slider(label, min_value=0, max_value=100, value=None, key=None, **kwargs):
+    return _widget(label, value if value is not None else min_value, key)
+
+
+def _checkbox(label, value=False, key=None, **kwargs):
+    return _widget(label, value, key)
+
+
+def _date_input(label, value="today", key=None, **kwargs):
+    return _widget(label, date.today() if value == "today" else value, key)
+
+
+def _multiselect(label, options, default=None, key=None, **kwargs):
+    return _widget(label, list(default or []), key)
+
+
+def _button(label, key=None, on_click=None, args=(), kwargs=None, **options):
+    clicks = session()['clicks']
+    clicked = (key or label) in clicks or label in clicks
+    if clicked and on_click is not None:
+        on_click(*args, **(kwargs or {}))
+    return clicked
+
+
+def _message(kind):
+    def show(body, *args, **kwargs):
+        session()['messages'].append((kind, str(body)))
+    return show
+
+
+def _columns(spec, **kwargs):
+    return [_Container() for _ in range(spec if isinstance(spec, int) else len(spec))]
+
+
+def _tabs(labels):
+    return [_Container() for _ in labels]
+
+
+def _get_option(name):
+    return False if name == "server.enableStaticServing" else None
+
+
+def _module_getattr(name):
+    # Every other element (st.title, st.dataframe, st.bar_chart, ...) draws nothing
+    if name.startswith('__'):
+        raise AttributeError(name)
+    return _noop
+
+
+module = types.ModuleType('streamlit')
+module.__dict__.update({
+    '__getattr__': _module_getattr,
+    'session_state': _SessionDict('state'),
+    'query_params': _SessionDict('query_params'),
+    'secrets': {'stripe': {'STRIPE_SECRET_KEY': 'sk_test_stub'}},
+    'sidebar': _Container(),
+    'fragment': _passthrough,
+    'cache_data': _memoize,
+    'cache_resource': _memoize,
+    'selectbox': _selectbox,
+    'radio': _selectbox,
+    'number_input': _number_input,
+    'text_input': _text_input,
+    'slider': _slider,
+    'multiselect': _multiselect,
+    'checkbox': _checkbox,
+    'date_input': _date_input,
+    'button': _button,
+    'form_submit_button': _button,
+    'error': _message('error'),
+    'warning': _message('warning'),
+    'success': _message('success'),
+    'info': _message('info'),
+    'columns': _columns,
+    'tabs': _tabs,
+    'container': lambda *args, **kwargs: _Container(),
+    'expander': lambda *args, **kwargs: _Container(),
+    'form': lambda *args, **kwargs: _Container(),
+    'spinner': lambda *args, **kwargs: _Container(),
+    'empty': lambda *args, **kwargs: _Container(),
+    'get_option': _get_option,
+})
+
+
+def install():
+    """Make `import streamlit` return the stub."""
+    sys.modules['streamlit'] = module
+    return module
@@ -0,0 +1,72 @@
+import json
+import threading
+
+from storage import file_version
+
+MENU_FILE = "menu.json"
+
+
+class Catalog:
+    """The menu: item, price, unit cost and image for every item.
+
+    Loaded from a JSON list of {item, price, cost, image} objects and
+    indexed by item name. refresh() reloads the file when it changes, so the
+    menu can be edited without restarting the server.
+    """
+
+    def __init__(self, path=MENU_FILE):
+        self.path = path
+        self.items = {}  # item -> entry, in menu order
+        # item -> unit cost; updated in place so holders (e.g. SalesRollup) see new costs
+        self.costs = {}
+        self.version = None
+        self._lock = threading.Lock()
+        self.refresh()
+
+    def refresh(self):
+        """Reload the menu file if it changed. Returns True if it was reloaded."""
+        version = file_version(self.path)
+        if version == self.version:
+            return False
+        with self._lock:
+            if version == self.version:
+                return False
+            try:
+                with open(self.path, 'r') as file:
+                    entries = json.load(file)
+            except (OSError, json.JSONDecodeError) as e:
+                # Keep serving the last good menu while the file is being edited
+                print(f"Could not load menu from {self.path}: {e}")
+                return False
+            items = {}
+            for entry in entries:
+                entry.setdefault('cost', 0.0)
+                entry.setdefault('image', None)
+                items[entry['item']] = entry
+            self.items = items
+            self.costs.update({item: entry['cost'] for item, entry in items.items()})
+            for item in set(self.costs) - set(items):
+                del self.costs[item]
+            self.version = version
+            return True
+
+    def __contains__(self, item):
+        return item in self.items
+
+    def __len__(self):
+        return len(self.items)
+
+    def get(self, item):
+        """Return the menu entry for an item, or None."""
+        return self.items.get(item)
+
+    def names(self):
+        return list(self.items)
+
+    def entries(self):
+        return list(self.items.values())
+
+    def price(self, item):
+        """Return an item's price, or None if it is not on the menu (any more)."""
+        entry = self.items.get(item)
+        return None if entry is None else entry['price']
@@ -0,0 +1,145 @@
+"""Coupons: campaigns of codes sharing a discount, an expiry and usage limits.
+
+A campaign holds the terms; its codes only name it, so a campaign of 100k
+single-use codes costs one dict entry per code. Redemptions are kept per
+order, and counted per code and per customer of the campaign, so a
+cancelled order gives its use back. Journaled like the stock (coupons.json
+plus coupons.journal.jsonl), and redeemed inside the journal's
+transaction, so the limits hold with buyers in any number of processes.
+"""
+import secrets
+import time
+
+from storage import Journal
+
+# Symbols codes are made of: 32 of them, without 0/O and 1/I
+CODE_ALPHABET = "ABCDEFGHJKLMNPQRSTUVWXYZ23456789"
+CODE_LENGTH = 10
+
+# Random bytes to code symbols; 256 is a multiple of 32, so every symbol is equally likely
+_SYMBOLS = bytes(ord(CODE_ALPHABET[byte % len(CODE_ALPHABET)]) for byte in range(256))
+
+
+class CouponError(ValueError):
+    """Why a coupon cannot be used, in words to show the customer."""
+
+
+def normalize_code(code):
+    return code.strip().upper()
+
+
+def generate_codes(count, prefix="", length=CODE_LENGTH, taken=()):
+    """Return count new random codes, prefix plus length symbols each, none of them in taken."""
+    codes = set()
+    while len(codes) < count:
+        missing = count - len(codes)
+        symbols = secrets.token_bytes(missing * length).translate(_SYMBOLS).decode('ascii')
+        for start in range(0, len(symbols), length):
+            code = prefix + symbols[start:start + length]
+            if code not in taken:
+                codes.add(code)
+    return list(codes)
+
+
+class CouponBook:
+    """Campaigns, the codes of each, and the redemptions made so far."""
+
+    def __init__(self, campaigns=None, codes=None, redemptions=()):
+        self.campaigns = dict(campaigns or {})  # name -> {'discount', 'expires', 'max_uses', 'per_customer'}
+        self.codes = {}           # code -> campaign name
+        self.uses = {}            # code -> redemptions
+        self.customer_uses = {}   # (campaign name, customer) -> redemptions
+        self.redemptions = {}     # order_id -> (code, customer)
+        for name, campaign_codes in (codes or {}).items():
+            for code in campaign_codes:
+                self.codes[code] = name
+        for order_id, code, customer in redemptions:
+            self._redeem(order_id, code, customer)
+
+    @classmethod
+    def from_json(cls, data):
+        if 'campaigns' not in data:
+            # Plain {code: {'coupon_code', 'discount'}}, as written before campaigns existed
+            return cls({code: {'discount': coupon.get('discount', 0)} for code, coupon in data.items()},
+                       {code: [code] for code in data})
+        return cls(data['campaigns'], data.get('codes', {}), data.get('redemptions', []))
+
+    def to_json(self):
+        codes = {}
+        for code, name in self.codes.items():
+            codes.setdefault(name, []).append(code)
+        return {
+            'campaigns': self.campaigns,
+            'codes': codes,
+            'redemptions': [[order_id, code, customer] for order_id, (code, customer) in self.redemptions.items()],
+        }
+
+    def check(self, code, customer, now=None):
+        """Return the terms of a code the customer may redeem now, or raise CouponError."""
+        name = self.codes.get(code)
+        if name is None:
+            raise CouponError("That coupon code does not exist.")
+        terms = self.campaigns[name]
+        if terms.get('expires') is not None and (time.time() if now is None else now) >= terms['expires']:
+            raise CouponError("That coupon has expired.")
+        if terms.get('max_uses') is not None and self.uses.get(code, 0) >= terms['max_uses']:
+            raise CouponError("That coupon has already been used.")
+        if terms.get('per_customer') is not None and \
+                self.customer_uses.get((name, customer), 0) >= terms['per_customer']:
+            raise CouponError("You have already used this offer.")
+        return terms
+
+    def _redeem(self, order_id, code, customer):
+        if order_id in self.redemptions or code not in self.codes:
+            return
+        self.redemptions[order_id] = (code, customer)
+        self.uses[code] = self.uses.get(code, 0) + 1
+        key = (self.codes[code], customer)
+        self.customer_uses[key] = self.customer_uses.get(key, 0) + 1
+
+    def _release(self, order_id):
+        code, customer = self.redemptions.pop(order_id)
+        self.uses[code] -= 1
+        key = (self.codes[code], customer)
+        self.customer_uses[key] -= 1
+
+    def apply(self, entry):
+        """Apply one journal entry: campaign, redeem or release."""
+        op = entry.get('op')
+        if op == 'campaign':
+            self.campaigns[entry['name']] = entry['terms']
+            for code in entry['codes']:
+                self.codes[code] = entry['name']
+        elif op == 'redeem':
+            self._redeem(entry['order_id'], entry['code'], entry['customer'])
+        elif op == 'release':
+            for order_id in entry['order_ids']:
+                if order_id in self.redemptions:
+                    self._release(order_id)
+
+    def summary(self):
+        """Return one row per campaign: name, terms, codes and redemptions."""
+        codes, uses = {}, {}
+        for code, name in self.codes.items():
+            codes[name] = codes.get(name, 0) + 1
+        for code, _ in self.redemptions.values():
+            name = self.codes[code]
+            uses[name] = uses.get(name, 0) + 1
+        return [{'campaign': name, **terms, 'codes': codes.get(name, 0), 'redeemed': uses.get(name, 0)}
+                for name, terms in self.campaigns.items()]
+
+
+class CouponJournal(Journal):
+    """coupons.json plus coupons.journal.jsonl, held as a CouponBook."""
+
+    def __init__(self, path="coupons.json", **kwargs):
+        super().__init__(path, "coupons.journal.jsonl", dict, **kwargs)
+
+    def new_state(self, data, compacting=False):
+        return CouponBook.from_json(data)
+
+    def apply(self, state, entry):
+        state.apply(entry)
+
+    def dump(self, state):
+        return state.to_json()
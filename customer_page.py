@@ -1,75 +1,72 @@
 import streamlit as st
-import stripe
-import pandas as pd
-import random
 import json
-from admin_dashboard import admin_dashboard_page
-from shared import db
+from menu_assets import image_src
+from metrics import timed
+from payments import get_checkout_queue
+from shared import PAYABLE_STATUSES, get_db, paged_orders
+from coupons import CouponError, normalize_code
 from datetime import datetime
-from PIL import Image
 
-# Access the Stripe secret key from Streamlit's secrets
-stripe.api_key = st.secrets["stripe"]["STRIPE_SECRET_KEY"]
+# Checkout sessions are created on a background worker pool shared by all sessions
+def stripe_secret_key():
+    # Access the Stripe secret key from Streamlit's secrets
+    stripe_secret_key = st.secrets["stripe"]["STRIPE_SECRET_KEY"]
 
-# Check if the Stripe API key is available
-if not stripe.api_key:
-    st.error("Stripe secret key is not set. Please check your Streamlit secrets.")
+    # Check if the Stripe API key is available
+    if not stripe_secret_key:
+        st.error("Stripe secret key is not set. Please check your Streamlit secrets.")
+    return stripe_secret_key
+
+def checkout_queue():
+    """Return the checkout queue, set up on first use (stripe is only imported then)."""
+    # The secret is only read for the real Stripe client, so the fake one runs without secrets.toml
+    return get_checkout_queue(stripe_secret_key)
 
 # Stripe payment session creation
-def create_checkout_session(customer_name, total_price, order_id, coupon_code=None):
-    try:
-        # Check if coupon is valid
-        discount = 0
-        if coupon_code:
-            coupon = db.coupons.get(coupon_code)
-            if coupon:
-                discount = coupon.get('discount', 0)
-                total_price *= (1 - discount / 100)
-        
-        total_price_cents = int(total_price * 100)
-        session = stripe.checkout.Session.create(
-            payment_method_types=['card'],
-            line_items=[{
-                'price_data': {
-                    'currency': 'myr',  # Change if necessary
-                    'product_data': {
-                        'name': f"Coffee Order for {customer_name}"
-                    },
-                    'unit_amount': total_price_cents,
-                },
-                'quantity': 1,
-            }],
-            mode='payment',
-            success_url=f'https://koopi-co.streamlit.app/?success=true&order_id={order_id}',
-            cancel_url=f'https://koopi-co.streamlit.app/?cancel=true',
-        )
-        
-        return session.url  # Ensure this returns the URL to proceed to payment
-    
-    except Exception as e:
-        st.error(f"Error creating payment session: {e}")
-        return None
+def create_checkout_session(customer_name, total_price, order_id):
+    """Queue the Stripe checkout session for an order; poll checkout_queue() for the URL."""
+    total_price_cents = round(total_price * 100)
+    checkout_queue().submit(customer_name, total_price_cents, order_id)
+
+
+def payment_link(order_id):
+    """Show the payment link of an order, polling only while its session is being created."""
+    state, value = checkout_queue().status(order_id)
+    if state == 'pending':
+        wait_for_payment_link(order_id)
+    elif state == 'ready':
+        st.markdown(f"[Click here to complete your payment]({value})")
+    else:
+        if value:
+            st.error(f"Error creating payment session: {value}")
+        st.error("Failed to create payment session.")
 
 
+# Reruns on its own every second, so the link shows up without the customer doing anything
+@st.fragment(run_every=1)
+def wait_for_payment_link(order_id):
+    if checkout_queue().status(order_id)[0] != 'pending':
+        # Rerun the page once, which shows the outcome without this fragment, so the polling stops
+        st.rerun()
+    st.info("Creating your payment session...")
 
+
+
+@timed("page.customer_order_process")
 def customer_order_process():
     st.title("Coffee Shop - Customer Order")
+    db = get_db()
     st.subheader("Menu")
     
-    # Add images for menu items
-    menu_images = {
-        'Americano': 'https://dolo.com.au/cdn/shop/articles/522979505-shutterstock_1973536478.jpg?v=1690528484',
-        'Cappuccino': 'https://www.thespruceeats.com/thmb/oUxhx54zsjVWfPlrgedJU0MZ-y0=/1500x0/filters:no_upscale():max_bytes(150000):strip_icc()/how-to-make-cappuccinos-766116-hero-01-a754d567739b4ee0b209305138ecb996.jpg',
-        'Latte': 'https://images.arla.com/recordid/F2DA5762-13BB-4FF4-88839FDE14DE1993/chocolate-latte.jpg?width=1200&height=630&mode=crop&format=jpg',
-        'Caramel Macchiato': 'https://img.freepik.com/premium-photo/closeup-delicious-whipped-creamtopped-coffee-glass-with-coffee-beans-warm-bokeh-lights-background_1298779-1307.jpg'
-    }
+    # Menu images are served as small local thumbnails when an original is available
+    static_serving = st.get_option("server.enableStaticServing")
     
     col1, col2 = st.columns(2)
     
-    for index, row in db.menu.iterrows():
-        item = row['item']
-        price = row['price']
-        image_path = menu_images.get(item, None)
+    for index, entry in enumerate(db.catalog.entries()):
+        item = entry['item']
+        price = entry['price']
+        image_path = image_src(item, entry['image'], static_serving)
         
         with col1 if index % 2 == 0 else col2:
             if image_path:
@@ -91,20 +88,71 @@ def customer_order_process():
         st.error("You need to sign in first.")
         return
     
-    selected_item = st.selectbox("Choose your coffee:", db.menu['item'])
+    selected_item = st.selectbox("Choose your coffee:", db.catalog.names())
     quantity = st.number_input("Enter quantity:", min_value=1, step=1)
     coupon_code = st.text_input("Enter coupon code (if any):")
 
     
+    price = db.catalog.price(selected_item) if selected_item else None
+    if selected_item and price is None:
+        # The menu was reloaded since the selectbox was drawn
+        st.warning(f"{selected_item} is no longer on the menu. Please choose again.")
+        return
+
     if customer_name and selected_item:
-        price = db.menu[db.menu['item'] == selected_item]['price'].values[0]
         total_price = price * quantity
+        available = db.available_stock(selected_item)
         
-        st.write(f"**Total Price: RM{total_price:.2f}**")
+        # Only checked here; the code is redeemed when the order is placed
+        discount = 0
+        if coupon_code.strip():
+            try:
+                discount = db.coupon_discount(coupon_code, customer_name)
+            except CouponError as e:
+                st.error(str(e))
+        if discount:
+            st.write(f"**Total Price: ~~RM{total_price:.2f}~~ RM{total_price * (1 - discount / 100):.2f}** "
+                     f"({discount:g}% off)")
+        else:
+            st.write(f"**Total Price: RM{total_price:.2f}**")
+        if available <= 0:
+            st.warning(f"{selected_item} is sold out.")
+        elif available < 10:
+            st.caption(f"Only {available} left.")
+
+        # How long the kitchen would take, and whether it takes new orders at all
+        admission = db.admission()
+        if admission['refused']:
+            st.warning(admission['refused'])
+        else:
+            ahead = admission['backlog']
+            st.info(f"Estimated wait: about {max(1, round(admission['wait'] / 60))} min "
+                    f"({ahead} order{'' if ahead == 1 else 's'} ahead of yours)")
         
-        if st.button("Proceed to Payment"):
+        if st.button("Proceed to Payment", disabled=bool(admission['refused'])):
+            # Checked again: the kitchen may have filled up since the page was drawn
+            refused = db.admission()['refused']
+            if refused:
+                st.error(refused)
+                return
+
             # Generate an order ID
-            order_id = random.randint(1000, 9999)
+            order_id = db.generate_order_id()
+
+            # Use up the coupon now; another buyer may have taken its last use since it was checked
+            discount = 0
+            if coupon_code.strip():
+                try:
+                    discount = db.redeem_coupon(coupon_code, customer_name, order_id)
+                except CouponError as e:
+                    st.error(str(e))
+                    return
+
+            # Hold the stock until the order is paid, cancelled or times out
+            if not db.reserve_stock(order_id, selected_item, quantity):
+                db.release_coupons([order_id])
+                st.error(f"Sorry, only {max(db.available_stock(selected_item), 0)} {selected_item} left.")
+                return
             # Add current date and time
             order_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             
@@ -117,70 +165,81 @@ def customer_order_process():
                 'status': 'Pending',
                 'date': order_date
             }
+            if discount:
+                # The discounted price is what gets charged; the order keeps what was taken off
+                order_data['total_price'] = round(total_price * (1 - discount / 100), 2)
+                order_data['coupon_code'] = normalize_code(coupon_code)
+                order_data['discount'] = discount
             
-            # Add order to the orders list and save to JSON
-            db.orders.append(order_data)
-            db.save_orders()  # Save the order to the JSON file
-            
-            # Create a Stripe Checkout session and get the payment URL
-            payment_url = create_checkout_session(customer_name, total_price, order_id, coupon_code)
+            # Add order to the orders list and append it to the order journal
+            db.add_order(order_data)
             
-            if payment_url:
-                st.markdown(f"[Click here to complete your payment]({payment_url})")
-            else:
-                st.error("Failed to create payment session.")
+            # Create the Stripe Checkout session in the background
+            create_checkout_session(customer_name, order_data['total_price'], order_id)
+            st.session_state["checkout_order_id"] = order_id
+
+        # Show the payment link for the last order once its session is ready
+        if "checkout_order_id" in st.session_state:
+            payment_link(st.session_state["checkout_order_id"])
 
 
 
+@timed("page.order_notifications_page")
 def order_notifications_page(customer_name):
     st.title("Order Notifications")
-    
-    db.load_orders()
-    customer_orders = [order for order in db.orders if order['customer'] == customer_name]
-    
-    # Debugging step
-    st.write(f"Customer orders: {len(customer_orders)}")
+    db = get_db()
 
-    if not customer_orders:
-        st.write("No orders found.")
-        return
+    # Ready orders come from the event feed, not a scan of the customer's orders
+    ready_events = db.events.pending(customer_name)
 
-    ready_orders = [order for order in customer_orders if order['status'] == 'Ready' and not order['notification_sent']]
-    
-    # Debugging step
-    st.write(f"Ready orders: {len(ready_orders)}")
-
-    if ready_orders:
-        for order in ready_orders:
-            st.success(f"Your order #{order['order_id']} is Ready! 🎉")
-            order['notification_sent'] = True
-        db.save_orders()
+    if ready_events:
+        for event in ready_events:
+            st.success(f"Your order #{event['order_id']} is Ready! 🎉")
+        # One line in the event journal; the orders are not rewritten
+        db.events.acknowledge(customer_name, [event['order_id'] for event in ready_events])
     else:
         st.write("No notifications at the moment.")
 
 
+# Reruns on its own, so Ready orders pop up on whatever page the customer is on
+@st.fragment(run_every=5)
+def order_updates(customer_name):
+    db = get_db()
+    db.events.refresh()
+    ready_events = db.events.pending(customer_name)
+    if ready_events:
+        st.caption(f"🔔 {len(ready_events)} order(s) ready, see Notifications")
+    # Only toast events this session has not shown yet
+    cursor = st.session_state.get("event_cursor", 0)
+    for event in db.events.since(customer_name, cursor):
+        st.toast(f"Your order #{event['order_id']} is Ready! 🎉")
+        cursor = event['seq']
+    st.session_state["event_cursor"] = cursor
+
+
 
 
 
 # Success page
+@timed("page.success_page")
 def success_page():
+    import pandas as pd
     st.title("Payment Successful")
-    query_params = st.experimental_get_query_params()
-    order_id = query_params.get("order_id", [None])[0]
+    db = get_db()
+    order_id = st.query_params.get("order_id")
 
-    if order_id:
+    if order_id and order_id.isdigit():
         order_id = int(order_id)
         
-        # Find and update the order status
-        for order in db.orders:
-            if order['order_id'] == order_id:
-                order['status'] = 'Paid'
-                
-        # Save updated orders to JSON
-        db.save_orders()
+        # The order is marked Paid when Stripe's webhook event comes in
+        # (see payment_events.py), not by this URL, which anyone can open
+        order = db.get_order(order_id)
+        if order and order['status'] in PAYABLE_STATUSES:
+            st.info("We are confirming your payment with Stripe; your order status will update shortly.")
 
         # Display the order data as a DataFrame
-        order_data = pd.DataFrame([order for order in db.orders if order['order_id'] == order_id])
+        with timed("dataframe.order"):
+            order_data = pd.DataFrame([order] if order else [])
         st.write(f"Order ID: {order_id}")
         st.dataframe(order_data)
 
@@ -189,55 +248,55 @@ def success_page():
         feedback_service = st.slider("Rate the service (1 to 5):", 1, 5)
         
         if st.button("Submit Feedback"):
-            feedback_data = {
-                'order_id': order_id,
-                'rating': feedback_rating,
-                'service': feedback_service
-            }
-            db.feedback.append(feedback_data)
-            db.save_feedback()
+            db.add_feedback(order_id, feedback_rating, feedback_service)
             st.success("Thank you for your feedback!")
 
 
 # Cancel page
+@timed("page.cancel_page")
 def cancel_page():
     st.title("Payment Cancelled")
+    db = get_db()
+    order_id = st.query_params.get("order_id")
+    # Anyone can open this URL with any ID, so only the customer's own orders are
+    # cancelled here. Stripe's checkout.session.expired event cancels the rest
+    # (see payment_events.py).
+    order = db.get_order(int(order_id)) if order_id and order_id.isdigit() else None
+    if order and order['customer'] == st.session_state.get("username"):
+        # Give the order's stock back to other customers
+        db.cancel_order(order['order_id'])
     st.write("Your payment was not completed. Please try again.")
 
 
 # Order history page
+HISTORY_PAGE_SIZE = 20
+HISTORY_COLUMNS = ['order_id', 'item', 'quantity', 'total_price', 'status', 'date']
+
+@timed("page.order_history_page")
 def order_history_page():
+    import pandas as pd
     st.title("Order History")
-    
-    db.load_orders()  # Load the orders from the saved JSON
-
-    if not db.orders:
-        st.write("You have no past orders.")
-        return
-    
-    # Convert order data to DataFrame for display
-    order_data = pd.DataFrame(db.orders)
 
     # Get the current logged-in username
     username = st.session_state.get("username", None)
     
-    if username:
-        # Filter orders by username
-        order_data = order_data[order_data["customer"] == username]
-    else:
+    if not username:
         st.error("No username found in session. Please log in again.")
         return
 
+    # Only the page being shown is looked up, newest orders first
+    orders, total = paged_orders("history_page", page_size=HISTORY_PAGE_SIZE, customer=username)
+
     # Check if there are orders for the user
-    if order_data.empty:
+    if not total:
         st.write("You have no past orders.")
         return
 
-    # Exclude the 'customer' column
-    if 'customer' in order_data.columns:
-        order_data = order_data.drop(columns=['customer'])
-    
-    # Display the filtered order history
+    with timed("dataframe.order_history"):
+        order_data = pd.DataFrame(orders, columns=HISTORY_COLUMNS)
+
+    # Display the order history, without the 'customer' column
+    st.caption(f"{total} orders")
     st.dataframe(order_data)
 
 
@@ -256,17 +315,25 @@ def sidebar_navigation():
 
 # App routing
 def main():
+    # Pick up orders written by other server processes since the last rerun
+    get_db().refresh()
+
+    # Back from Stripe checkout, ahead of the sidebar pages
+    if 'success' in st.query_params:
+        success_page()
+        return
+    if 'cancel' in st.query_params:
+        cancel_page()
+        return
+
     # Get the selected page from the sidebar
     page = sidebar_navigation()
 
     if page == "order_history":
         order_history_page()
     elif page == "admin_dashboard":
+        from admin_dashboard import admin_dashboard_page
         admin_dashboard_page()  # Call the admin dashboard function
-    elif 'success' in st.experimental_get_query_params():
-        success_page()
-    elif 'cancel' in st.experimental_get_query_params():
-        cancel_page()
     else:
         customer_order_process()
 
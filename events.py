@@ -0,0 +1,138 @@
+"""Order status changes as a feed that customer sessions follow.
+
+Every status change is published as an event with a sequence number,
+journaled like the orders (order_events.json plus order_events.journal.jsonl)
+so other server processes see it on their next refresh(). Ready events stay
+pending for their customer until acknowledged, which appends one line to
+the event journal instead of touching the orders, or until they are
+KEEP_SECONDS old: every PRUNE_EVERY events the older ones are dropped.
+"""
+import time
+
+from admission import ThroughputWindow
+from kitchen import OPEN_STATUSES
+from storage import Journal
+
+# Statuses customers are notified about
+NOTIFY_STATUSES = ('Ready',)
+
+PRUNE_EVERY = 1000  # Events published between drops of old ones
+KEEP_SECONDS = 24 * 60 * 60  # A day-old "your order is ready" is no use to anyone
+
+
+class Notifications:
+    """The last event sequence number, each customer's unacknowledged events, and the kitchen's pace."""
+
+    def __init__(self, seq=0, pending=(), ready=None):
+        self.seq = seq
+        self.pending = {}  # customer -> {order_id: event}, oldest first
+        for event in pending:
+            self.pending.setdefault(event['customer'], {})[event['order_id']] = event
+        self.ready = ThroughputWindow.from_json(ready)  # See admission.py
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(data.get('seq', 0), data.get('pending', []), data.get('ready'))
+
+    def to_json(self):
+        return {'seq': self.seq, 'pending': [event for events in self.pending.values() for event in events.values()],
+                'ready': self.ready.to_json()}
+
+    def apply(self, entry):
+        """Apply one journal entry, returning the events it published."""
+        if entry.get('op') == 'publish':
+            events = entry['events'] if 'events' in entry else [entry['event']]
+            for event in events:
+                self.seq = max(self.seq, event['seq'])
+                if event['status'] in NOTIFY_STATUSES:
+                    self.pending.setdefault(event['customer'], {})[event['order_id']] = event
+                if event['status'] == 'Ready' and event['previous'] in OPEN_STATUSES:
+                    self.ready.ready(event['at'], event.get('backlog', 0))
+                # Timed by the event, not the clock, so every process and compaction drops the same ones
+                if event['seq'] % PRUNE_EVERY == 0:
+                    self.prune(event['at'] - KEEP_SECONDS)
+            return events
+        if entry.get('op') == 'ack':
+            events = self.pending.get(entry['customer'], {})
+            for order_id in entry['order_ids']:
+                events.pop(order_id, None)
+            if not events:
+                self.pending.pop(entry['customer'], None)
+        return []
+
+    def prune(self, before):
+        """Drop the pending events published before a time."""
+        for customer, events in list(self.pending.items()):
+            kept = {order_id: event for order_id, event in events.items() if event['at'] >= before}
+            if kept:
+                self.pending[customer] = kept
+            else:
+                del self.pending[customer]
+
+
+def open_after(changes, backlog):
+    """Orders still open after each of a batch of changes, given how many are after the whole batch."""
+    left = []
+    for order, old_status in reversed(changes):
+        left.append(backlog)
+        if old_status in OPEN_STATUSES and order['status'] not in OPEN_STATUSES:
+            backlog += 1
+    return left[::-1]
+
+
+class EventJournal(Journal):
+    """The order event feed, with in-process subscribers.
+
+    subscribe(callback) calls callback(event) for every event published
+    from now on, by this process or (once refresh() picks it up) another.
+    """
+
+    def __init__(self, path="order_events.json", **kwargs):
+        self.subscribers = []
+        super().__init__(path, "order_events.journal.jsonl", dict, **kwargs)
+
+    def new_state(self, data, compacting=False):
+        return Notifications.from_json(data)
+
+    def apply(self, state, entry):
+        events = state.apply(entry)
+        # Only live events: not replays while (re)loading or compacting
+        if events and state is getattr(self, 'state', None):
+            for event in events:
+                for callback in list(self.subscribers):
+                    callback(event)
+
+    def dump(self, state):
+        return state.to_json()
+
+    def subscribe(self, callback):
+        """Register callback(event); returns a function that unsubscribes it."""
+        self.subscribers.append(callback)
+        return lambda: self.subscribers.remove(callback)
+
+    def publish(self, changes, backlog=0):
+        """Publish status changes, given as (order, old status) pairs, in one write.
+
+        backlog is how many orders are still open after the changes. Returns
+        the events.
+        """
+        with self.transaction() as state:
+            now = time.time()
+            events = [{'seq': state.seq + number, 'order_id': order['order_id'], 'customer': order['customer'],
+                       'status': order['status'], 'previous': old_status, 'at': now, 'backlog': left}
+                      for number, ((order, old_status), left) in enumerate(zip(changes, open_after(changes, backlog)), 1)]
+            self.write({'op': 'publish', 'events': events})
+        return events
+
+    def pending(self, customer):
+        """Return a customer's unacknowledged events, oldest first."""
+        return list(self.state.pending.get(customer, {}).copy().values())
+
+    def since(self, customer, seq):
+        """Return a customer's unacknowledged events after sequence number seq."""
+        return [event for event in self.pending(customer) if event['seq'] > seq]
+
+    def acknowledge(self, customer, order_ids):
+        """Mark a customer's events for these orders as seen."""
+        if any(order_id in self.state.pending.get(customer, {}) for order_id in order_ids):
+            self.append({'op': 'ack', 'customer': customer, 'order_ids': list(order_ids)})
@@ -0,0 +1,124 @@
+"""Customer feedback: a coffee and a service rating per order.
+
+Submissions are appended to feedback.journal.jsonl, one line each, and
+folded into feedback.json (a list of the entries) like the other
+journals. Each entry carries the item and date of its order, looked up
+when it is submitted, so FeedbackRollup can keep per-item and per-day
+aggregates up to date as entries come in, and the dashboard never reads
+the entries or the orders themselves. Days are those the orders were
+placed on, not when they were rated. Rating an order again replaces its
+earlier entry.
+"""
+from datetime import timedelta
+
+from storage import Journal
+
+RATINGS = range(1, 6)
+
+# Item and date of feedback for an order we no longer know about
+UNKNOWN_ITEM = "Unknown"
+UNKNOWN_DATE = "1970-01-01 00:00:00"
+
+
+def order_fields(order):
+    """The item and date a feedback entry takes from its order (None if unknown)."""
+    return (order['item'], order['date']) if order else (UNKNOWN_ITEM, UNKNOWN_DATE)
+
+
+class FeedbackRollup:
+    """Per-day, per-item rating buckets, updated as feedback comes in.
+
+    Each bucket is [count, rating total, service total, then how many
+    coffee ratings of 1 to 5], so means and distributions come from a
+    handful of buckets whatever the number of entries.
+    """
+
+    def __init__(self):
+        self.days = {}   # 'YYYY-MM-DD' -> {item: bucket}
+        self.items = {}  # item -> bucket, all time
+
+    @classmethod
+    def from_daily_rows(cls, rows):
+        """Build a rollup from (day, item, count, rating total, service total, rated 1, ..., rated 5) rows."""
+        rollup = cls()
+        for day, item, *bucket in rows:
+            for target in (rollup.days.setdefault(day, {}).setdefault(item, [0] * 8),
+                           rollup.items.setdefault(item, [0] * 8)):
+                for position, value in enumerate(bucket):
+                    target[position] += value
+        return rollup
+
+    def add(self, entry, sign=1):
+        for bucket in (self.days.setdefault(entry['date'][:10], {}).setdefault(entry['item'], [0] * 8),
+                       self.items.setdefault(entry['item'], [0] * 8)):
+            bucket[0] += sign
+            bucket[1] += sign * entry['rating']
+            bucket[2] += sign * entry['service']
+            bucket[2 + entry['rating']] += sign
+
+    @staticmethod
+    def _row(bucket):
+        count = bucket[0]
+        return {'ratings': count, 'rating': bucket[1] / count, 'service': bucket[2] / count,
+                **{f"rated {stars}": bucket[2 + stars] for stars in RATINGS}}
+
+    def item_summary(self):
+        """Return all-time ratings per item: count, mean coffee and service rating, coffee rating distribution."""
+        return [{'item': item, **self._row(bucket)} for item, bucket in sorted(self.items.items()) if bucket[0]]
+
+    def daily(self, start, end):
+        """Return the ratings of each day from start to end, inclusive, that has any."""
+        rows = []
+        day = start
+        while day <= end:
+            buckets = self.days.get(day.strftime("%Y-%m-%d"), {}).values()
+            total = [sum(values) for values in zip(*buckets)]
+            if total and total[0]:
+                rows.append({'day': day, **self._row(total)})
+            day += timedelta(days=1)
+        return rows
+
+
+class FeedbackBook:
+    """Every feedback entry by order ID, and their rollup."""
+
+    def __init__(self, entries=()):
+        self.entries = {}  # order_id -> {'order_id', 'rating', 'service', 'item', 'date'}
+        self.rollup = FeedbackRollup()
+        for entry in entries:
+            self.rate(entry)
+
+    def rate(self, entry):
+        previous = self.entries.pop(entry['order_id'], None)
+        if previous:
+            self.rollup.add(previous, -1)
+        self.entries[entry['order_id']] = entry
+        self.rollup.add(entry)
+
+
+class FeedbackJournal(Journal):
+    """feedback.json plus feedback.journal.jsonl, held as a FeedbackBook.
+
+    order(order_id) returns an order or None; it fills in the item and date
+    of entries written before they were recorded.
+    """
+
+    def __init__(self, order, path="feedback.json", **kwargs):
+        self.order = order
+        super().__init__(path, "feedback.journal.jsonl", list, **kwargs)
+
+    def new_state(self, data, compacting=False):
+        entries = []
+        for entry in data:
+            if 'item' not in entry:
+                item, day = order_fields(self.order(entry['order_id']))
+                entry = dict(entry, item=item, date=day)
+            entries.append(entry)
+        return FeedbackBook(entries)
+
+    def apply(self, state, entry):
+        if entry.get('op') == 'rate':
+            state.rate(entry['entry'])
+
+    def dump(self, state):
+        return list(state.entries.values())
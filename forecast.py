@@ -0,0 +1,102 @@
+"""Demand forecasts and restock suggestions from the order history.
+
+Works on the order DataFrame of Database.orders_frame(). demand_series()
+bins every order into a (periods x items) array with one np.bincount,
+the forecasts smooth all items at once with pandas' rolling and ewm, and
+restock_plan() turns the forecast and the stock levels into how many
+units of each item to add. Nothing loops over the orders in Python,
+so a year of minute-level orders for hundreds of items takes well under
+a second (see benchmarks/forecast.py).
+"""
+import math
+
+import numpy as np
+
+from rollups import NON_SALE_STATUSES
+
+# Seconds per period of a demand series
+PERIODS = {'hour': 3600, 'day': 86400}
+
+METHODS = ('smoothing', 'average')
+
+
+def _seconds(moment):
+    return np.datetime64(moment, 's').astype(np.int64)
+
+
+def demand_series(frame, period='day', start=None, end=None, items=None):
+    """Return the units ordered per period and item, cancelled orders left out.
+
+    A DataFrame indexed by the start of each period, one column per item.
+    start (inclusive) and end (exclusive) are datetimes; by default the
+    series runs from the first order's period to the last one's. items
+    fixes the columns, so items nobody ordered get a column of zeros.
+    """
+    import pandas as pd
+    seconds = PERIODS[period]
+    names = list(frame['item'].cat.categories)
+    codes = frame['item'].cat.codes.to_numpy()
+    stamps = frame['date'].to_numpy().astype('datetime64[s]').astype(np.int64)
+    keep = ~frame['status'].isin(NON_SALE_STATUSES).to_numpy()
+    if start is not None:
+        start = _seconds(start)
+    else:
+        start = stamps[keep].min() // seconds * seconds if keep.any() else 0
+    if end is not None:
+        end = _seconds(end)
+    else:
+        end = (stamps[keep].max() // seconds + 1) * seconds if keep.any() else start
+    count = max(-(-(end - start) // seconds), 0)
+
+    slots = (stamps - start) // seconds
+    keep &= (slots >= 0) & (slots < count)
+    binned = np.bincount(slots[keep] * len(names) + codes[keep], weights=frame['quantity'].to_numpy()[keep],
+                         minlength=count * len(names)).reshape(count, len(names))
+    demand = pd.DataFrame(binned, columns=names,
+                          index=pd.to_datetime(start + np.arange(count) * seconds, unit='s'))
+    if items is not None:
+        demand = demand.reindex(columns=list(items), fill_value=0)
+    return demand
+
+
+def smoothed(demand, method='smoothing', alpha=0.3, window=7):
+    """Return the forecast level after each period, for every item at once.
+
+    'smoothing' is simple exponential smoothing with factor alpha,
+    'average' the mean of the last window periods. The last row is the
+    forecast demand per period from here on.
+    """
+    if method == 'smoothing':
+        return demand.ewm(alpha=alpha, adjust=False).mean()
+    if method == 'average':
+        return demand.rolling(window, min_periods=1).mean()
+    raise ValueError(f"Unknown forecast method {method!r}")
+
+
+def restock_plan(demand, levels, cover=7, method='smoothing', alpha=0.3, window=7, safety=1.65):
+    """Return how many units of each item to add to cover the next cover periods.
+
+    demand is a demand_series() of the recent past, levels maps each item
+    to (on hand, reserved) as Database.stock_levels() does. The target is
+    the forecast demand over cover periods, plus safety standard
+    deviations of the per-period demand (scaled to the cover) as a buffer;
+    the restock is what the available stock falls short of it, rounded up.
+    """
+    import pandas as pd
+    items = list(demand.columns)
+    on_hand = np.array([levels.get(item, (0, 0))[0] for item in items], dtype=np.int64)
+    available = on_hand - np.array([levels.get(item, (0, 0))[1] for item in items], dtype=np.int64)
+    if len(demand):
+        per_period = smoothed(demand, method, alpha, window).to_numpy()[-1]
+        spread = demand.to_numpy().std(axis=0)
+    else:
+        per_period = spread = np.zeros(len(items))
+    target = np.ceil(per_period * cover + safety * spread * math.sqrt(cover)).astype(np.int64)
+    return pd.DataFrame({
+        'item': items,
+        'on_hand': on_hand,
+        'available': available,
+        'forecast': per_period.round(2),
+        'target': target,
+        'restock': np.maximum(target - available, 0),
+    })
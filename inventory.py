@@ -0,0 +1,90 @@
+from storage import Journal
+
+# How long an unpaid order holds on to its stock
+RESERVATION_TTL = 15 * 60
+
+
+class StockLedger:
+    """Stock on hand per item, and the reservations unpaid orders hold on it.
+
+    Placing an order reserves stock, which takes it out of what is available
+    without touching what is on hand. Paying commits the reservation (the
+    stock leaves for good), cancelling or timing out releases it again.
+    """
+
+    def __init__(self, on_hand=None, reservations=()):
+        self.on_hand = dict(on_hand or {})  # item -> units on the shelf, reserved or not
+        self.reserved = {}                  # item -> units held by reservations
+        self.reservations = {}              # order_id -> (item, quantity, expires), oldest first
+        for order_id, item, quantity, expires in reservations:
+            self._hold(order_id, item, quantity, expires)
+
+    @classmethod
+    def from_json(cls, data):
+        if 'stock' not in data or not isinstance(data['stock'], dict):
+            return cls(data)  # Plain {item: stock}, as written before reservations existed
+        return cls(data['stock'], data.get('reservations', []))
+
+    def to_json(self):
+        return {
+            'stock': self.on_hand,
+            'reservations': [[order_id, *reservation] for order_id, reservation in self.reservations.items()],
+        }
+
+    def available(self, item):
+        return self.on_hand.get(item, 0) - self.reserved.get(item, 0)
+
+    def expired(self, now):
+        """Return the order IDs whose reservations expired by now.
+
+        Reservations are kept oldest first and all get the same TTL, so this
+        stops at the first one still running.
+        """
+        expired = []
+        for order_id, (_, _, expires) in self.reservations.items():
+            if expires > now:
+                break
+            expired.append(order_id)
+        return expired
+
+    def _hold(self, order_id, item, quantity, expires):
+        self.reservations[order_id] = (item, quantity, expires)
+        self.reserved[item] = self.reserved.get(item, 0) + quantity
+
+    def _drop(self, order_id):
+        item, quantity, _ = self.reservations.pop(order_id)
+        self.reserved[item] -= quantity
+        return item, quantity
+
+    def apply(self, entry):
+        """Apply one journal entry: reserve, release, commit or adjust."""
+        op = entry.get('op')
+        if op == 'reserve':
+            self._hold(entry['order_id'], entry['item'], entry['quantity'], entry['expires'])
+        elif op in ('release', 'commit'):
+            for order_id in entry['order_ids'] if 'order_ids' in entry else [entry['order_id']]:
+                if order_id not in self.reservations:
+                    continue
+                item, quantity = self._drop(order_id)
+                if op == 'commit':
+                    self.on_hand[item] = self.on_hand.get(item, 0) - quantity
+        elif op == 'adjust':
+            for item, delta in entry['deltas'].items() if 'deltas' in entry else [(entry['item'], entry['delta'])]:
+                self.on_hand[item] = self.on_hand.get(item, 0) + delta
+
+
+class InventoryJournal(Journal):
+    """inventory.json plus inventory.journal.jsonl, held as a StockLedger."""
+
+    def __init__(self, default, path="inventory.json", **kwargs):
+        super().__init__(path, "inventory.journal.jsonl", default, **kwargs)
+
+    def new_state(self, data, compacting=False):
+        return StockLedger.from_json(data)
+
+    def apply(self, state, entry):
+        state.apply(entry)
+
+    def dump(self, state):
+        return state.to_json()
+
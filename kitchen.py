@@ -0,0 +1,52 @@
+from bisect import bisect_left, insort
+
+# Orders the kitchen still has to prepare
+OPEN_STATUSES = ('Pending', 'Paid')
+
+
+class KitchenQueue:
+    """The open orders, oldest placed first, kept up to date as orders change.
+
+    Registered as an OrderIndex listener, so paging through the queue never
+    sorts, or even looks at, the closed orders. Orders are keyed by
+    (timestamp, order_id, id(order)), which stays unique if an ID is reused.
+    """
+
+    def __init__(self):
+        self.keys = []    # Sorted keys of the open orders
+        self.orders = {}  # key -> order
+        self.open = {}    # id(order) -> key
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _add(self, order):
+        key = (order.timestamp, order.order_id, id(order))
+        self.orders[key] = order
+        self.open[id(order)] = key
+        insort(self.keys, key)  # Usually at the end: new orders are the newest
+
+    def _remove(self, order):
+        key = self.open.pop(id(order), None)
+        if key is None:
+            return
+        position = bisect_left(self.keys, key)
+        if position < len(self.keys) and self.keys[position] == key:
+            del self.keys[position]
+        self.orders.pop(key, None)
+
+    def order_added(self, order):
+        if order.status in OPEN_STATUSES:
+            self._add(order)
+
+    def order_updated(self, order, old_values):
+        if 'status' not in old_values and 'date' not in old_values:
+            return
+        self._remove(order)
+        if order.status in OPEN_STATUSES:
+            self._add(order)
+
+    def page(self, offset=0, limit=20):
+        """Return the open orders from offset, at most limit of them."""
+        orders = (self.orders.get(key) for key in self.keys[offset:offset + limit])
+        return [order for order in orders if order is not None]  # Skip any closed while we looked
@@ -1,13 +1,8 @@
 import streamlit as st
 from sign_in import sign_in
-from customer_page import (
-    customer_order_process,
-    order_history_page,
-    success_page,
-    cancel_page,
-    order_notifications_page,  # Import the notifications page
-)
-from admin_dashboard import admin_dashboard_page, admin_coupon_page, manage_inventory
+from menu_assets import prepare as prepare_menu_images
+from metrics import start_exporters
+from shared import get_db
 
 # Set page configuration
 st.set_page_config(
@@ -17,6 +12,12 @@ st.set_page_config(
     initial_sidebar_state="auto"  
 )
 
+# Export timings if COFFEE_SHOP_METRICS_FILE or COFFEE_SHOP_METRICS_PORT is set
+start_exporters()
+
+# Download the menu images and build their thumbnails in the background, once per process
+prepare_menu_images()
+
 # Initialize session state
 if "logged_in" not in st.session_state:
     st.session_state["logged_in"] = False
@@ -25,37 +26,70 @@ if "logged_in" not in st.session_state:
 if not st.session_state["logged_in"]:
     sign_in()
 else:
+    # Pick up orders, coupons, etc. written by other server processes since the last rerun
+    get_db().refresh()
+
+    # Page modules are imported by the role that uses them, on its first rerun
     if st.session_state["role"] == "Customer":
-        # Add Notifications to the menu
-        page = st.sidebar.selectbox(
-            "Menu", ["Order Process", "Order History", "Notifications"]
+        from customer_page import (
+            customer_order_process,
+            order_history_page,
+            order_updates,
+            success_page,
+            cancel_page,
+            order_notifications_page,  # Import the notifications page
         )
 
-        if page == "Order Process":
-            customer_order_process()
-        elif page == "Order History":
-            order_history_page()
-        elif page == "Notifications":
-            order_notifications_page(st.session_state.get("username", "Customer"))  # Pass the customer name
-        elif 'success' in st.experimental_get_query_params():
-            success_page()
-        elif 'cancel' in st.experimental_get_query_params():
-            cancel_page()
+        with st.sidebar:
+            order_updates(st.session_state.get("username", "Customer"))
+
+        # Stripe sends the customer back with ?success=true or ?cancel=true, ahead of the menu
+        if 'success' in st.query_params or 'cancel' in st.query_params:
+            if 'success' in st.query_params:
+                success_page()
+            else:
+                cancel_page()
+            if st.button("Back to the menu"):
+                st.query_params.clear()
+                st.rerun()
+        else:
+            # Add Notifications to the menu
+            page = st.sidebar.selectbox(
+                "Menu", ["Order Process", "Order History", "Notifications"]
+            )
+
+            if page == "Order Process":
+                customer_order_process()
+            elif page == "Order History":
+                order_history_page()
+            elif page == "Notifications":
+                order_notifications_page(st.session_state.get("username", "Customer"))  # Pass the customer name
 
     elif st.session_state["role"] == "Admin":
+        from admin_dashboard import (
+            admin_dashboard_page, admin_coupon_page, export_sidebar, kitchen_queue_page, manage_inventory,
+            performance_page
+        )
+
         page = st.sidebar.selectbox(
-            "Choose a feature:", ["Dashboard", "Create Coupons", "Manage Inventory"]
+            "Choose a feature:", ["Dashboard", "Kitchen Queue", "Create Coupons", "Manage Inventory", "Performance"]
         )
+        with st.sidebar:
+            export_sidebar()
 
         if page == "Dashboard":
             admin_dashboard_page()
+        elif page == "Kitchen Queue":
+            kitchen_queue_page()
         elif page == "Create Coupons":
             admin_coupon_page()
         elif page == "Manage Inventory":
             manage_inventory()
+        elif page == "Performance":
+            performance_page()
 
     # Move the Log Out button to the sidebar
     if st.sidebar.button("Log Out"):
         st.session_state["logged_in"] = False
         st.session_state["role"] = None
-        st.experimental_rerun()
+        st.rerun()
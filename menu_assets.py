@@ -0,0 +1,191 @@
+"""Menu images, stored locally and served as small pre-resized thumbnails.
+
+Originals go in menu_images/ (named after the item, any format Pillow can
+read). prepare(), called as the app starts, downloads the missing ones from
+the image URLs in the menu and builds their thumbnails on a background
+thread; until then pages show the remote images. To do it ahead of time:
+
+    python menu_assets.py fetch
+    python menu_assets.py build
+
+Thumbnails are cached in static/menu/ under a name that includes a hash
+of the original, so editing an original makes a new thumbnail and
+browsers can cache each one forever. With Streamlit's
+server.enableStaticServing on (see .streamlit/config.toml) they are served
+from /app/static/menu/, otherwise they are inlined as data URIs.
+"""
+import argparse
+import base64
+import hashlib
+import os
+import re
+import tempfile
+import threading
+
+from catalog import Catalog
+from storage import file_version
+
+SOURCE_DIR = "menu_images"
+THUMBNAIL_DIR = os.path.join("static", "menu")
+THUMBNAIL_SIZE = (300, 200)
+THUMBNAIL_FORMAT = "WEBP"
+THUMBNAIL_QUALITY = 80
+
+# source path -> (source version, thumbnail path), so reruns skip hashing unchanged originals
+_thumbnails = {}
+_thumbnails_lock = threading.Lock()
+
+# thumbnail path -> data URI; thumbnails never change once written
+_data_uris = {}
+
+# (SOURCE_DIR version, {slug: original path}), rebuilt when the directory changes
+_sources = (None, {})
+
+_prepare_started = False
+_prepare_lock = threading.Lock()
+
+
+def slug(item):
+    return re.sub(r'[^a-z0-9]+', '-', item.lower()).strip('-')
+
+
+def source_path(item):
+    """Return the local original for an item, or None if there is none."""
+    global _sources
+    version = file_version(SOURCE_DIR)
+    if version is None:
+        return None
+    if _sources[0] != version:
+        sources = {}
+        for name in sorted(os.listdir(SOURCE_DIR)):
+            sources.setdefault(os.path.splitext(name)[0], os.path.join(SOURCE_DIR, name))
+        _sources = (version, sources)
+    return _sources[1].get(slug(item))
+
+
+def thumbnail_path(source):
+    """Return the thumbnail for an original image, generating it if needed."""
+    version = file_version(source)
+    with _thumbnails_lock:
+        cached = _thumbnails.get(source)
+    if cached and cached[0] == version and os.path.exists(cached[1]):
+        return cached[1]
+
+    with open(source, 'rb') as file:
+        digest = hashlib.sha256(file.read()).hexdigest()[:16]
+    name = os.path.splitext(os.path.basename(source))[0]
+    path = os.path.join(THUMBNAIL_DIR, f"{name}-{digest}.{THUMBNAIL_FORMAT.lower()}")
+    if not os.path.exists(path):
+        make_thumbnail(source, path)
+    with _thumbnails_lock:
+        _thumbnails[source] = (version, path)
+    return path
+
+
+def make_thumbnail(source, path):
+    """Crop and resize an image to THUMBNAIL_SIZE and save it compressed."""
+    from PIL import Image, ImageOps
+
+    with Image.open(source) as image:
+        image = ImageOps.exif_transpose(image).convert("RGB")
+        image = ImageOps.fit(image, THUMBNAIL_SIZE, Image.LANCZOS)
+        _write_atomic(path, lambda file: image.save(file, THUMBNAIL_FORMAT, quality=THUMBNAIL_QUALITY, method=6))
+
+
+def _write_atomic(path, write):
+    # write(file) fills a temp file of our own next to path, which is then
+    # renamed into place: concurrent builds never share or half-publish a file
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            write(file)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def image_src(item, url=None, static_serving=False):
+    """Return what to put in an <img src> for a menu item.
+
+    Falls back to the item's image URL (or None) when there is no local original.
+    """
+    source = source_path(item)
+    if source is None:
+        return url
+    path = thumbnail_path(source)
+    if static_serving:
+        return "app/" + path.replace(os.sep, "/")
+    if path not in _data_uris:
+        with open(path, 'rb') as file:
+            encoded = base64.b64encode(file.read()).decode()
+        _data_uris[path] = f"data:image/{THUMBNAIL_FORMAT.lower()};base64,{encoded}"
+    return _data_uris[path]
+
+
+def fetch_original(item, url):
+    """Download an item's original into SOURCE_DIR; returns its path, or None if url is not http(s)."""
+    if not url or not url.startswith(('http://', 'https://')):
+        return None
+    import urllib.request  # Only when downloading; slow to import for every process
+    request = urllib.request.Request(url, headers={'User-Agent': 'Mozilla/5.0'})
+    with urllib.request.urlopen(request, timeout=30) as response:
+        data = response.read()
+    path = os.path.join(SOURCE_DIR, slug(item) + ".jpg")
+    _write_atomic(path, lambda file: file.write(data))
+    return path
+
+
+def fetch(catalog):
+    """Download the original of each menu item into SOURCE_DIR."""
+    for entry in catalog.entries():
+        path = fetch_original(entry['item'], entry['image'])
+        if path:
+            print(f"{entry['item']}: {os.path.getsize(path):,} bytes -> {path}")
+
+
+def _prepare():
+    for entry in Catalog().entries():
+        item = entry['item']
+        try:
+            source = source_path(item) or fetch_original(item, entry['image'])
+            if source:
+                thumbnail_path(source)
+        except Exception as error:  # One bad image must not stop the others
+            print(f"Menu image for {item} not prepared: {error}")
+
+
+def prepare():
+    """Fetch missing originals and build their thumbnails on a background thread, once per process."""
+    global _prepare_started
+    with _prepare_lock:
+        if _prepare_started:
+            return
+        _prepare_started = True
+    threading.Thread(target=_prepare, name="menu-images", daemon=True).start()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage menu images.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('fetch', help=f"download the originals into {SOURCE_DIR}/")
+    subparsers.add_parser('build', help=f"generate the thumbnails in {THUMBNAIL_DIR}/")
+    args = parser.parse_args()
+
+    catalog = Catalog()
+    if args.command == 'fetch':
+        fetch(catalog)
+    else:
+        for item in catalog.names():
+            source = source_path(item)
+            if source is None:
+                print(f"{item}: no original in {SOURCE_DIR}/")
+            else:
+                print(f"{item}: {thumbnail_path(source)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""Timing of pages, storage and external calls.
+
+Wrap code in `timed(name)`, as a decorator or a `with` block, and the time
+it takes goes into that operation's histogram. Each process keeps its own.
+summary() gives recent percentiles for the admin Performance page, and
+prometheus_text() renders everything in the Prometheus text format. Set
+COFFEE_SHOP_METRICS_FILE to have it written to a file every few seconds
+(e.g. for node_exporter's textfile collector; "{pid}" in the path is
+replaced by the process ID), or COFFEE_SHOP_METRICS_PORT to serve it over
+HTTP at /metrics.
+"""
+import bisect
+import functools
+import os
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Upper bounds in seconds of the exported histogram buckets
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Recent samples kept per operation for the percentiles
+WINDOW = 1000
+
+METRIC_NAME = "coffee_shop_operation_seconds"
+
+
+class Histogram:
+    """Latency of one operation: bucket counts since start, plus the latest samples."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.buckets = [0] * (len(BUCKETS) + 1)  # The last one is +Inf
+        self.recent = deque(maxlen=WINDOW)
+        self.lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self.lock:
+            self.count += 1
+            self.total += seconds
+            self.buckets[bisect.bisect_left(BUCKETS, seconds)] += 1
+            self.recent.append(seconds)
+
+    def percentiles(self, *percentiles):
+        with self.lock:
+            samples = sorted(self.recent)
+        if not samples:
+            return [None for _ in percentiles]
+        return [samples[min(len(samples) - 1, int(len(samples) * pct / 100))] for pct in percentiles]
+
+
+_histograms = {}
+_histograms_lock = threading.Lock()
+
+
+def get_histogram(name):
+    histogram = _histograms.get(name)
+    if histogram is None:
+        with _histograms_lock:
+            histogram = _histograms.setdefault(name, Histogram())
+    return histogram
+
+
+def observe(name, seconds):
+    get_histogram(name).observe(seconds)
+
+
+class timed:
+    """Time a function (as a decorator) or a block (as a context manager) under a name."""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __call__(self, func):
+        name = self.name
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                observe(name, time.perf_counter() - start)
+        return wrapper
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.name, time.perf_counter() - self.start)
+        return False
+
+
+def summary():
+    """Return one dict per operation: count, mean and recent p50/p95/p99/max in seconds."""
+    rows = []
+    for name, histogram in sorted(_histograms.copy().items()):
+        p50, p95, p99, top = histogram.percentiles(50, 95, 99, 100)
+        rows.append({
+            'operation': name,
+            'count': histogram.count,
+            'mean': histogram.total / histogram.count if histogram.count else None,
+            'p50': p50, 'p95': p95, 'p99': p99, 'max': top,
+        })
+    return rows
+
+
+def prometheus_text():
+    """Render every histogram in the Prometheus text exposition format."""
+    lines = [f"# HELP {METRIC_NAME} Time spent per operation.", f"# TYPE {METRIC_NAME} histogram"]
+    for name, histogram in sorted(_histograms.copy().items()):
+        with histogram.lock:
+            buckets, count, total = list(histogram.buckets), histogram.count, histogram.total
+        label = f'operation="{name}"'
+        cumulative = 0
+        for bound, bucket in zip((*BUCKETS, '+Inf'), buckets):
+            cumulative += bucket
+            lines.append(f'{METRIC_NAME}_bucket{{{label},le="{bound}"}} {cumulative}')
+        lines.append(f"{METRIC_NAME}_sum{{{label}}} {total}")
+        lines.append(f"{METRIC_NAME}_count{{{label}}} {count}")
+    return "\n".join(lines) + "\n"
+
+
+def write_file(path):
+    """Write prometheus_text() to path, atomically."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as file:
+        file.write(prometheus_text())
+    os.replace(tmp_path, path)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = prometheus_text().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Keep scrapes out of the app's output
+
+
+_exporters_started = False
+_exporters_lock = threading.Lock()
+
+
+def start_exporters(interval=10):
+    """Start the file writer and/or HTTP endpoint configured in the environment, once per process."""
+    global _exporters_started
+    with _exporters_lock:
+        if _exporters_started:
+            return
+        _exporters_started = True
+    path = os.environ.get("COFFEE_SHOP_METRICS_FILE")
+    if path:
+        path = path.replace("{pid}", str(os.getpid()))
+
+        def write_periodically():
+            while True:
+                time.sleep(interval)
+                write_file(path)
+        threading.Thread(target=write_periodically, name="metrics-file", daemon=True).start()
+    port = os.environ.get("COFFEE_SHOP_METRICS_PORT")
+    if port:
+        try:
+            server = ThreadingHTTPServer(('', int(port)), _MetricsHandler)
+        except OSError as e:
+            print(f"Metrics endpoint not started on port {port}: {e}")  # e.g. taken by another server process
+            return
+        threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
@@ -0,0 +1,316 @@
+"""Orders held compactly in memory.
+
+An Order keeps its fields in slots: the date as integer seconds, the price
+in integer cents, and the customer, item and status as interned strings.
+It still reads and writes like the order dicts of orders.json (order['date']
+is the usual 'YYYY-MM-DD HH:MM:SS' string, order['total_price'] a float),
+and to_json() gives that dict back unchanged. OrderColumns also keeps the
+numeric fields of every order in numpy arrays, so pandas gets them
+without a copy.
+"""
+import sys
+import threading
+from collections.abc import MutableMapping
+from datetime import date, datetime
+
+# Required keys for an order to be considered valid
+ORDER_KEYS = ['order_id', 'customer', 'item', 'quantity', 'total_price', 'status', 'date', 'notification_sent']
+
+REQUIRED_KEYS = frozenset(ORDER_KEYS)
+
+# Order attributes holding the keys stored in another form
+ORDER_ATTRIBUTES = {'date': 'timestamp', 'total_price': 'cents'}
+
+_EPOCH_DAY = date(1970, 1, 1).toordinal()
+_day_names = {}  # Day number -> 'YYYY-MM-DD', for formatting dates back
+
+
+def to_timestamp(text):
+    """Return a 'YYYY-MM-DD HH:MM:SS' date as seconds since 1970-01-01 00:00:00.
+
+    Wall-clock time, with no time zone or DST applied, so every date string
+    maps to exactly one timestamp and back.
+    """
+    moment = datetime.fromisoformat(text)
+    return (moment.toordinal() - _EPOCH_DAY) * 86400 + moment.hour * 3600 + moment.minute * 60 + moment.second
+
+
+def day_timestamp(day):
+    """Return the timestamp of midnight at the start of a date."""
+    return (day.toordinal() - _EPOCH_DAY) * 86400
+
+
+def _day_name(days):
+    day = _day_names.get(days)
+    if day is None:
+        day = _day_names[days] = date.fromordinal(days + _EPOCH_DAY).isoformat()
+    return day
+
+
+def format_timestamp(timestamp):
+    """Return a timestamp as a 'YYYY-MM-DD HH:MM:SS' string."""
+    days, seconds = divmod(timestamp, 86400)
+    return f"{_day_name(days)} {seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+def valid_order(order):
+    """Check that an order has all the required keys."""
+    return order.keys() >= REQUIRED_KEYS
+
+
+def order_from_json(data):
+    """json object_hook for order files: a valid order as an Order, anything else as is."""
+    return Order.from_json(data) if valid_order(data) else data
+
+
+def _intern(value, intern=sys.intern):
+    return intern(value) if type(value) is str else value
+
+
+class Order(MutableMapping):
+    """One order, read and written like its orders.json dict.
+
+    Keys other than ORDER_KEYS go into `extra`, as do a date or price that
+    would not come back exactly from the compact form, so to_json() always
+    returns what from_json() was given. `row` is the order's position in
+    OrderColumns.
+    """
+
+    __slots__ = ('order_id', 'customer', 'item', 'quantity', 'cents', 'status', 'timestamp', 'notification_sent',
+                 'extra', 'row')
+
+    @classmethod
+    def from_json(cls, data, intern=sys.intern):
+        order = cls.__new__(cls)
+        order.extra = None
+        order.row = None
+        order.order_id = data['order_id']
+        order.quantity = data['quantity']
+        order.notification_sent = data.get('notification_sent', False)
+        # The common case inline, as this runs for every order on every load
+        try:
+            order.customer, order.item, order.status = intern(data['customer']), intern(data['item']), intern(data['status'])
+        except TypeError:
+            order.customer, order.item, order.status = _intern(data['customer']), _intern(data['item']), _intern(data['status'])
+        text, price = data['date'], data['total_price']
+        try:
+            moment = datetime.fromisoformat(text)
+            exact = len(text) == 19 and text[10] == ' '
+        except (TypeError, ValueError):
+            exact = False
+        if exact:
+            order.timestamp = ((moment.toordinal() - _EPOCH_DAY) * 86400
+                               + moment.hour * 3600 + moment.minute * 60 + moment.second)
+        else:
+            order._set_date(text)
+        cents = order.cents = round(price * 100)
+        if cents / 100 != price:
+            order._set_exact('total_price', price, False)
+        if len(data) > len(ORDER_KEYS) or 'notification_sent' not in data:
+            for key, value in data.items():
+                if key not in ORDER_KEYS:
+                    order[key] = value
+        return order
+
+    @property
+    def day(self):
+        """The 'YYYY-MM-DD' part of the date."""
+        if self.extra and 'date' in self.extra:
+            return str(self.extra['date'])[:10]
+        return _day_name(self.timestamp // 86400)
+
+    @property
+    def total_price(self):
+        if self.extra and 'total_price' in self.extra:
+            return self.extra['total_price']
+        return self.cents / 100
+
+    def to_json(self):
+        data = {
+            'order_id': self.order_id,
+            'customer': self.customer,
+            'item': self.item,
+            'quantity': self.quantity,
+            'total_price': self.cents / 100,
+            'status': self.status,
+            'date': format_timestamp(self.timestamp),
+            'notification_sent': self.notification_sent,
+        }
+        if self.extra:
+            data.update(self.extra)
+        return data
+
+    def _set_exact(self, key, value, exact):
+        # Keep the original value next to the compact one when they differ
+        if exact:
+            if self.extra and key in self.extra:
+                del self.extra[key]
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+
+    def _set_date(self, text):
+        try:
+            self.timestamp = to_timestamp(text)
+        except (TypeError, ValueError):
+            self.timestamp = 0
+            self._set_exact('date', text, False)
+            return
+        # Anything but 'YYYY-MM-DD HH:MM:SS' (e.g. with a 'T' or microseconds) is kept as given
+        self._set_exact('date', text, len(text) == 19 and text[10] == ' ')
+
+    def _set_price(self, price):
+        self.cents = round(price * 100)
+        self._set_exact('total_price', price, self.cents / 100 == price)
+
+    def __getitem__(self, key):
+        extra = self.extra
+        if extra is not None and key in extra:
+            return extra[key]
+        if key == 'date':
+            return format_timestamp(self.timestamp)
+        if key == 'total_price':
+            return self.cents / 100
+        if key in ORDER_KEYS:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key == 'date':
+            self._set_date(value)
+        elif key == 'total_price':
+            self._set_price(value)
+        elif key in ORDER_KEYS:
+            setattr(self, key, _intern(value))
+        else:
+            self._set_exact(key, value, False)
+
+    def __delitem__(self, key):
+        if key in ORDER_KEYS or not self.extra or key not in self.extra:
+            raise KeyError(key)
+        del self.extra[key]
+
+    def __iter__(self):
+        yield from ORDER_KEYS
+        if self.extra:
+            yield from (key for key in list(self.extra) if key not in ORDER_KEYS)
+
+    def __len__(self):
+        return len(ORDER_KEYS) + sum(key not in ORDER_KEYS for key in self.extra or ())
+
+    def __repr__(self):
+        return f"Order({self.to_json()!r})"
+
+
+def concat_frames(frames):
+    """Concatenate order DataFrames (see OrderColumns.frame), keeping the text columns categorical."""
+    if len(frames) == 1:
+        return frames[0]
+    if not frames:
+        return OrderColumns().frame()
+    import pandas as pd
+    frame = pd.concat(frames, ignore_index=True)
+    for name in OrderColumns.CODED:
+        frame[name] = frame[name].astype('category')
+    return frame
+
+
+class OrderColumns:
+    """The numeric fields of every order in numpy arrays, oldest first.
+
+    Reads the orders from a list that is only ever appended to, such as
+    OrderIndex.orders, or one filled through order_added(). Text fields
+    are stored as codes into per-column category lists. Orders appended
+    since the last frame() are written into the arrays in bulk by the
+    next one, so nothing is spent on them until a frame is asked for.
+    Changes to orders already written come in through order_updated().
+
+    frame() wraps the numeric arrays in a DataFrame without copying them,
+    so those columns are live views of the orders; the (much smaller)
+    categorical columns are copied.
+    """
+
+    CODED = ('customer', 'item', 'status')
+    DTYPES = {'order_id': 'int64', 'timestamp': 'int64', 'cents': 'int64', 'quantity': 'int64',
+              'customer': 'int32', 'item': 'int32', 'status': 'int32'}
+
+    def __init__(self, capacity=1024, orders=None):
+        import numpy as np  # Only once columns are made; the sign-in page never needs it
+        self.orders = [] if orders is None else orders
+        self.count = 0  # Orders of self.orders written into the arrays
+        self.arrays = {name: np.zeros(capacity, dtype) for name, dtype in self.DTYPES.items()}
+        self.codes = {name: {} for name in self.CODED}       # value -> code
+        self.categories = {name: [] for name in self.CODED}  # code -> value
+        self.lock = threading.Lock()
+
+    def _code(self, name, value):
+        codes = self.codes[name]
+        code = codes.get(value)
+        if code is None:
+            self.categories[name].append(value)
+            code = codes[value] = len(codes)
+        return code
+
+    def _flush(self):
+        # Called with the lock held
+        import numpy as np
+        orders = self.orders[self.count:]  # Writers may append while we work
+        if not orders:
+            return
+        start, stop = self.count, self.count + len(orders)
+        if stop > len(self.arrays['order_id']):
+            # Grow into new arrays; frames made from the old ones keep them alive
+            grown = {}
+            for name, array in self.arrays.items():
+                grown[name] = np.zeros(max(2 * len(array), stop), array.dtype)
+                grown[name][:start] = array[:start]
+            self.arrays = grown
+        arrays = self.arrays
+        for name in ('order_id', 'timestamp', 'cents', 'quantity'):
+            arrays[name][start:stop] = np.fromiter((getattr(order, name) for order in orders), np.int64, len(orders))
+        for name in self.CODED:
+            codes, code = self.codes[name], self._code
+            arrays[name][start:stop] = np.fromiter(
+                (codes[value] if value in codes else code(name, value)
+                 for value in (getattr(order, name) for order in orders)),
+                np.int32, len(orders))
+        for row, order in enumerate(orders, start):
+            order.row = row
+        self.count = stop
+
+    def order_added(self, order):
+        self.orders.append(order)
+
+    def order_updated(self, order, old_values):
+        with self.lock:
+            if order.row is None:
+                return  # Not written yet; will be with its current values
+            arrays, row = self.arrays, order.row
+            arrays['order_id'][row] = order.order_id
+            arrays['timestamp'][row] = order.timestamp
+            arrays['cents'][row] = order.cents
+            arrays['quantity'][row] = order.quantity
+            for name in self.CODED:
+                arrays[name][row] = self._code(name, getattr(order, name))
+
+    def frame(self):
+        """Return every order as a DataFrame.
+
+        Columns: order_id, date (datetime64[s]), customer, item and status
+        (categoricals), quantity and cents (total price in cents).
+        """
+        import pandas as pd  # Only once a frame is asked for; it is slow to import
+        with self.lock:
+            self._flush()
+            count, arrays = self.count, self.arrays
+            categories = {name: list(self.categories[name]) for name in self.CODED}
+        columns = {
+            'order_id': arrays['order_id'][:count],
+            'date': arrays['timestamp'][:count].view('datetime64[s]'),
+        }
+        for name in self.CODED:
+            columns[name] = pd.Categorical.from_codes(arrays[name][:count], categories[name])
+        columns['quantity'] = arrays['quantity'][:count]
+        columns['cents'] = arrays['cents'][:count]
+        return pd.DataFrame(columns, copy=False)
@@ -0,0 +1,310 @@
+"""Payment confirmation from Stripe webhook events.
+
+An order becomes Paid when Stripe reports its checkout session paid, not
+when the customer's browser lands on the success URL (which anyone can
+open, and which never happens if the tab is closed). Likewise an unpaid
+order is cancelled when its checkout session expires. Events come in
+either through the webhook receiver:
+
+    python payment_events.py serve --port 8765
+
+(point a Stripe webhook endpoint, or `stripe listen --forward-to
+localhost:8765`, at it), or from a file of recorded deliveries, one JSON
+line {"payload": ..., "signature": ...} each:
+
+    python payment_events.py replay deliveries.jsonl
+
+Run either from the data directory, with the endpoint's signing secret in
+STRIPE_WEBHOOK_SECRET. Every delivery's Stripe-Signature is checked.
+Events are applied in batches, each batch one write to the orders
+(Database.mark_paid) and one to payment_events.json, which remembers the
+event IDs already handled. So Stripe's retries, and replaying a file
+again, change nothing.
+"""
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from metrics import timed
+from storage import Journal
+
+# Events that mean a checkout session has been paid for
+PAID_EVENTS = ('checkout.session.completed', 'checkout.session.async_payment_succeeded')
+
+# Events that mean a checkout session will never be paid: its order is cancelled
+EXPIRED_EVENTS = ('checkout.session.expired',)
+
+# Signatures older than this many seconds are refused, as Stripe's own libraries do
+SIGNATURE_TOLERANCE = 300
+
+# How long handled event IDs are remembered; Stripe retries for up to three days
+EVENT_RETENTION = 30 * 86400
+
+
+class SignatureError(ValueError):
+    """A delivery whose Stripe-Signature header does not match its payload."""
+
+
+def sign_payload(payload, secret, timestamp=None):
+    """Return the Stripe-Signature header Stripe would send with payload."""
+    timestamp = int(time.time() if timestamp is None else timestamp)
+    signature = hmac.new(secret.encode(), f"{timestamp}.{payload}".encode(), hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={signature}"
+
+
+def verify_signature(payload, header, secret, tolerance=SIGNATURE_TOLERANCE, now=None):
+    """Check a Stripe-Signature header against the payload, or raise SignatureError.
+
+    tolerance=None skips the timestamp check, for replaying recorded deliveries.
+    """
+    timestamp, signatures = None, []
+    for part in (header or "").split(','):
+        key, _, value = part.strip().partition('=')
+        if key == 't':
+            timestamp = value
+        elif key == 'v1':
+            signatures.append(value)
+    if not timestamp or not timestamp.isdigit() or not signatures:
+        raise SignatureError("Malformed Stripe-Signature header")
+    expected = hmac.new(secret.encode(), f"{timestamp}.{payload}".encode(), hashlib.sha256).hexdigest()
+    if not any(hmac.compare_digest(expected, signature) for signature in signatures):
+        raise SignatureError("Signature does not match the payload")
+    if tolerance is not None and (time.time() if now is None else now) - int(timestamp) > tolerance:
+        raise SignatureError("Signature timestamp is too old")
+
+
+def _session_order_id(session):
+    # Set by StripeCheckoutClient.create_session
+    reference = (session.get('metadata') or {}).get('order_id') or session.get('client_reference_id')
+    try:
+        return int(reference)
+    except (TypeError, ValueError):
+        return None
+
+
+def paid_order_id(event):
+    """Return the order ID a paid checkout event is for, or None for any other event."""
+    if event.get('type') not in PAID_EVENTS:
+        return None
+    session = event.get('data', {}).get('object', {})
+    if session.get('payment_status') != 'paid':
+        return None  # E.g. a bank transfer still on its way; async_payment_succeeded follows
+    return _session_order_id(session)
+
+
+def expired_order_id(event):
+    """Return the order ID an expired checkout event is for, or None for any other event."""
+    if event.get('type') not in EXPIRED_EVENTS:
+        return None
+    return _session_order_id(event.get('data', {}).get('object', {}))
+
+
+class PaymentEventLog(Journal):
+    """payment_events.json plus its journal: {event ID: created} of the events handled."""
+
+    def __init__(self, path="payment_events.json", **kwargs):
+        super().__init__(path, "payment_events.journal.jsonl", dict, **kwargs)
+
+    def new_state(self, data, compacting=False):
+        return dict(data)
+
+    def apply(self, state, entry):
+        if entry.get('op') == 'seen':
+            state.update(entry['events'])
+
+    def dump(self, state):
+        cutoff = time.time() - EVENT_RETENTION
+        return {event_id: created for event_id, created in state.items() if created >= cutoff}
+
+
+class PaymentEventProcessor:
+    """Verifies deliveries and applies the paid events, a batch at a time."""
+
+    def __init__(self, db, secret, log=None, tolerance=SIGNATURE_TOLERANCE):
+        self.db = db
+        self.secret = secret
+        self.log = log if log is not None else PaymentEventLog()
+        self.tolerance = tolerance
+        self.stats = {'received': 0, 'rejected': 0, 'duplicates': 0, 'ignored': 0, 'paid': 0, 'cancelled': 0}
+        self._lock = threading.Lock()
+
+    def parse(self, payload, signature):
+        """Return the event in a delivery, or raise SignatureError (or ValueError for bad JSON)."""
+        if isinstance(payload, bytes):
+            payload = payload.decode()
+        verify_signature(payload, signature, self.secret, self.tolerance)
+        event = json.loads(payload)
+        if not isinstance(event, dict) or not event.get('id'):
+            raise ValueError("Not a Stripe event")
+        return event
+
+    @timed("payments.process_events")
+    def process(self, events):
+        """Apply a batch of verified events; returns the IDs of the orders that became Paid.
+
+        Orders whose checkout session expired unpaid are cancelled, which
+        gives their stock (and coupon) back.
+        """
+        with self._lock:  # Batches from one process go one at a time
+            self.stats['received'] += len(events)
+            with self.log.transaction() as seen:
+                new = {}
+                for event in events:
+                    if event['id'] in seen or event['id'] in new:
+                        self.stats['duplicates'] += 1
+                    else:
+                        new[event['id']] = event
+                order_ids = [order_id for order_id in map(paid_order_id, new.values()) if order_id is not None]
+                expired = [order_id for order_id in map(expired_order_id, new.values()) if order_id is not None]
+                self.stats['ignored'] += len(new) - len(order_ids) - len(expired)
+                # Orders first: if we stop in between, the events are handled again, and change nothing
+                paid = self.db.mark_paid(order_ids) if order_ids else []
+                # cancel_order leaves orders alone once they are no longer Pending
+                cancelled = [order_id for order_id in expired if self.db.cancel_order(order_id)]
+                if new:
+                    self.log.write({'op': 'seen', 'events': {event_id: event.get('created', int(time.time()))
+                                                             for event_id, event in new.items()}})
+            self.stats['paid'] += len(paid)
+            self.stats['cancelled'] += len(cancelled)
+            return paid
+
+    def replay(self, lines, batch_size=500):
+        """Verify and apply recorded deliveries (JSON lines of payload and signature), batch_size at a time."""
+        batch = []
+        for line in lines:
+            if not line.strip():
+                continue
+            delivery = json.loads(line)
+            try:
+                batch.append(self.parse(delivery['payload'], delivery['signature']))
+            except ValueError:
+                self.stats['rejected'] += 1
+            if len(batch) >= batch_size:
+                self.process(batch)
+                batch = []
+        if batch:
+            self.process(batch)
+        return self.stats
+
+
+class EventBatcher:
+    """Collects events from the webhook handler threads into batches for the processor.
+
+    submit() returns a Future that completes once the event's batch has
+    been written, so the webhook only answers Stripe after that. A batch is
+    whatever arrived while the previous one was being written, so a lone
+    event is not held back, and a burst costs a few writes.
+    """
+
+    def __init__(self, processor, batch_size=500):
+        self.processor = processor
+        self.batch_size = batch_size
+        self.queue = queue.Queue()
+        threading.Thread(target=self._run, daemon=True, name="payment-events").start()
+
+    def submit(self, event):
+        future = Future()
+        self.queue.put((event, future))
+        return future
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.processor.process([event for event, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+            else:
+                for _, future in batch:
+                    future.set_result(True)
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, as Stripe sends deliveries one after another
+
+    def do_POST(self):
+        processor = self.server.processor
+        payload = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        try:
+            event = processor.parse(payload, self.headers.get('Stripe-Signature'))
+        except ValueError as e:
+            processor.stats['rejected'] += 1
+            return self._reply(400, str(e))
+        try:
+            self.server.batcher.submit(event).result(timeout=30)
+        except Exception as e:
+            # Not a 2xx, so Stripe delivers the event again later
+            return self._reply(500, str(e))
+        self._reply(200, "ok")
+
+    def _reply(self, status, message):
+        body = json.dumps({'message': message}).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # One line per delivery is too much; see processor.stats
+
+
+class WebhookServer(ThreadingHTTPServer):
+    """The webhook receiver: a thread per connection, the events batched for the processor."""
+
+    daemon_threads = True
+    request_queue_size = 128  # Stripe may open many connections at once after an outage
+
+    def __init__(self, address, processor, batch_size=500):
+        self.processor = processor
+        self.batcher = EventBatcher(processor, batch_size)
+        super().__init__(address, WebhookHandler)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Confirm order payments from Stripe webhook events.")
+    parser.add_argument('--secret', default=os.environ.get("STRIPE_WEBHOOK_SECRET"),
+                        help="webhook signing secret (default: $STRIPE_WEBHOOK_SECRET)")
+    commands = parser.add_subparsers(dest='command', required=True)
+    serve = commands.add_parser('serve', help="receive webhook deliveries over HTTP")
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=8765)
+    replay = commands.add_parser('replay', help="apply recorded deliveries from a JSON lines file")
+    replay.add_argument('file')
+    replay.add_argument('--batch-size', type=int, default=500)
+    args = parser.parse_args()
+    if not args.secret:
+        parser.error("No webhook signing secret: set STRIPE_WEBHOOK_SECRET or pass --secret")
+
+    from shared import create_database
+    db = create_database()
+    if args.command == 'replay':
+        # Recorded deliveries are older than the signature tolerance; the event IDs stop replays
+        processor = PaymentEventProcessor(db, args.secret, tolerance=None)
+        with open(args.file) as file:
+            print(processor.replay(file, args.batch_size))
+    else:
+        processor = PaymentEventProcessor(db, args.secret)
+        server = WebhookServer((args.host, args.port), processor)
+        print(f"Listening for Stripe webhooks on http://{args.host}:{args.port}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            print(processor.stats)
+
+
+if __name__ == "__main__":
+    main()
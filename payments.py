@@ -0,0 +1,174 @@
+"""Stripe checkout session creation, off the Streamlit script thread.
+
+Set COFFEE_SHOP_STRIPE=fake to use FakeStripeClient instead of the real
+Stripe API, e.g. for offline load tests.
+"""
+import os
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import timed
+
+SUCCESS_URL = 'https://koopi-co.streamlit.app/?success=true&order_id={order_id}'
+CANCEL_URL = 'https://koopi-co.streamlit.app/?cancel=true&order_id={order_id}'
+
+
+class TransientCheckoutError(Exception):
+    """A checkout failure worth retrying: network trouble, rate limits, Stripe 5xx."""
+
+
+class StripeCheckoutClient:
+    """Creates checkout sessions through the Stripe API."""
+
+    def __init__(self, api_key):
+        import stripe
+        self.stripe = stripe
+        stripe.api_key = api_key
+        # One pooled requests.Session per worker thread instead of a new
+        # connection per call. Retries are done by CheckoutQueue.
+        requests_client = getattr(stripe, 'RequestsClient', None) or stripe.http_client.RequestsClient
+        stripe.default_http_client = requests_client()
+        stripe.max_network_retries = 0
+
+    def create_session(self, customer_name, amount_cents, order_id):
+        stripe = self.stripe
+        try:
+            session = stripe.checkout.Session.create(
+                payment_method_types=['card'],
+                line_items=[{
+                    'price_data': {
+                        'currency': 'myr',  # Change if necessary
+                        'product_data': {
+                            'name': f"Coffee Order for {customer_name}"
+                        },
+                        'unit_amount': amount_cents,
+                    },
+                    'quantity': 1,
+                }],
+                mode='payment',
+                success_url=SUCCESS_URL.format(order_id=order_id),
+                cancel_url=CANCEL_URL.format(order_id=order_id),
+                client_reference_id=str(order_id),
+                metadata={'order_id': str(order_id)},
+            )
+        except (stripe.error.APIConnectionError, stripe.error.RateLimitError) as e:
+            raise TransientCheckoutError(str(e)) from e
+        except stripe.error.APIError as e:
+            if e.http_status is None or e.http_status >= 500:
+                raise TransientCheckoutError(str(e)) from e
+            raise
+        return session.url
+
+
+class FakeStripeClient:
+    """Offline stand-in for StripeCheckoutClient.
+
+    Sleeps for a log-normally distributed latency around `latency` seconds
+    and fails with TransientCheckoutError at `failure_rate`.
+    """
+
+    def __init__(self, latency=0.3, jitter=0.5, failure_rate=0.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.rng = random.Random(seed)
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def create_session(self, customer_name, amount_cents, order_id):
+        with self._lock:
+            self.calls += 1
+            delay = self.latency * self.rng.lognormvariate(0, self.jitter)
+            fail = self.rng.random() < self.failure_rate
+        time.sleep(delay)
+        if fail:
+            raise TransientCheckoutError("simulated Stripe failure")
+        return f"https://checkout.stripe.test/pay/cs_test_{order_id}"
+
+
+class CheckoutQueue:
+    """Creates checkout sessions on a bounded worker pool.
+
+    submit() returns at once; status() reports ('pending', None),
+    ('ready', url), ('failed', message) or ('missing', None). Transient
+    failures are retried with exponential backoff and jitter.
+    """
+
+    def __init__(self, client, workers=8, retries=3, backoff=0.5, max_backoff=8.0, max_jobs=10000):
+        self.client = client
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_jobs = max_jobs
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="checkout")
+        self.jobs = OrderedDict()  # order_id -> Future, oldest first
+        self.latencies = deque(maxlen=10000)  # seconds from submit to URL, for percentiles
+        self._lock = threading.Lock()
+
+    def submit(self, customer_name, amount_cents, order_id):
+        future = self.pool.submit(self._create, customer_name, amount_cents, order_id, time.perf_counter())
+        with self._lock:
+            self.jobs[order_id] = future
+            # Drop the oldest finished jobs nobody came back for
+            while len(self.jobs) > self.max_jobs:
+                oldest_id, oldest = next(iter(self.jobs.items()))
+                if not oldest.done():
+                    break
+                del self.jobs[oldest_id]
+        return future
+
+    def _create(self, customer_name, amount_cents, order_id, submitted):
+        for attempt in range(self.retries + 1):
+            try:
+                with timed("stripe.create_session"):
+                    url = self.client.create_session(customer_name, amount_cents, order_id)
+            except TransientCheckoutError:
+                if attempt == self.retries:
+                    raise
+                time.sleep(min(self.max_backoff, self.backoff * 2 ** attempt) * random.uniform(0.5, 1))
+            else:
+                self.latencies.append(time.perf_counter() - submitted)
+                return url
+
+    def status(self, order_id):
+        with self._lock:
+            future = self.jobs.get(order_id)
+        if future is None:
+            return 'missing', None
+        if not future.done():
+            return 'pending', None
+        error = future.exception()
+        if error is not None:
+            return 'failed', str(error)
+        return 'ready', future.result()
+
+    def latency_percentiles(self, *percentiles):
+        """Return submit-to-URL latency percentiles in seconds."""
+        samples = sorted(self.latencies)
+        if not samples:
+            return [None for _ in percentiles]
+        return [samples[min(len(samples) - 1, int(len(samples) * pct / 100))] for pct in percentiles]
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_checkout_queue(api_key=None):
+    """Return the process-wide CheckoutQueue, creating it on first use.
+
+    api_key() returns the Stripe secret key; it is only called when the
+    real StripeCheckoutClient is created.
+    """
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            if os.environ.get("COFFEE_SHOP_STRIPE", "").lower() == "fake":
+                client = FakeStripeClient()
+            else:
+                client = StripeCheckoutClient(api_key())
+            _queue = CheckoutQueue(client, workers=int(os.environ.get("COFFEE_SHOP_CHECKOUT_WORKERS", 8)))
+        return _queue
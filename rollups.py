@@ -0,0 +1,88 @@
+from datetime import timedelta
+
+# Orders in these statuses do not count as sales
+NON_SALE_STATUSES = ('Cancelled',)
+
+# Order fields that change what an order contributes to the rollup
+SALES_FIELDS = {'item', 'quantity', 'total_price', 'date', 'status'}
+
+
+class SalesRollup:
+    """Per-day, per-item sales totals, updated as orders are added or change.
+
+    Registered as an OrderIndex listener (so given order_model.Order
+    objects), so the dashboard reads a handful of buckets instead of
+    recomputing everything from the full order list.
+    Each bucket is [quantity, revenue]; profit is worked out from costs
+    when read, so it follows the menu's current unit costs.
+    """
+
+    def __init__(self, costs):
+        self.costs = costs
+        self.days = {}   # 'YYYY-MM-DD' -> {item: bucket}
+        self.items = {}  # item -> bucket, all time
+
+    @classmethod
+    def from_daily_rows(cls, rows, costs):
+        """Build a rollup from (day, item, quantity, revenue) rows."""
+        rollup = cls(costs)
+        for day, item, quantity, revenue in rows:
+            rollup._add(day, item, quantity, revenue)
+        return rollup
+
+    def _add(self, day, item, quantity, revenue, sign=1):
+        for bucket in (self.days.setdefault(day, {}).setdefault(item, [0, 0.0]),
+                       self.items.setdefault(item, [0, 0.0])):
+            bucket[0] += sign * quantity
+            bucket[1] += sign * revenue
+
+    def _profit(self, item, bucket):
+        return bucket[1] - bucket[0] * self.costs.get(item, 0)
+
+    def _contribute(self, order, sign):
+        if order['status'] not in NON_SALE_STATUSES:
+            self._add(order['date'][:10], order['item'], order['quantity'], order['total_price'], sign)
+
+    def order_added(self, order):
+        # Straight from the Order attributes, as this runs for every order on every load
+        if order.status not in NON_SALE_STATUSES:
+            self._add(order.day, order.item, order.quantity, order.total_price)
+
+    def order_updated(self, order, old_values):
+        """Move an order's contribution after some of its fields changed."""
+        if not SALES_FIELDS.intersection(old_values):
+            return
+        self._contribute(dict(order, **old_values), -1)
+        self._contribute(order, 1)
+
+    def totals(self, start, end):
+        """Return (revenue, quantity, profit) for the days from start to end, inclusive."""
+        quantity, revenue, profit = 0, 0.0, 0.0
+        day = start
+        while day <= end:
+            for item, bucket in self.days.get(day.strftime("%Y-%m-%d"), {}).items():
+                quantity += bucket[0]
+                revenue += bucket[1]
+                profit += self._profit(item, bucket)
+            day += timedelta(days=1)
+        return revenue, quantity, profit
+
+    def daily_items(self, start=None, end=None):
+        """Yield each day's totals per item, oldest day first, for the days from start to end, inclusive."""
+        low = start.strftime("%Y-%m-%d") if start else ""
+        high = end.strftime("%Y-%m-%d") if end else "9999"
+        # Copied, orders may be coming in meanwhile
+        for day in sorted(day for day in list(self.days) if low <= day <= high):
+            for item, bucket in sorted(list(self.days[day].items())):
+                if bucket[0]:
+                    yield {'day': day, 'item': item, 'quantity': bucket[0], 'revenue': round(bucket[1], 2),
+                           'profit': round(self._profit(item, bucket), 2)}
+
+    def item_breakdown(self):
+        """Return all-time totals per item as a list of dicts."""
+        return [
+            {'item': item, 'total_sold': bucket[0], 'total_revenue': bucket[1],
+             'total_profit': self._profit(item, bucket)}
+            for item, bucket in sorted(self.items.items())
+            if bucket[0]
+        ]
@@ -1,113 +1,752 @@
 import os
-import json
-import pandas as pd
+import time
+import heapq
 import streamlit as st
-from datetime import datetime
-import random
+from bisect import bisect_left
+from itertools import islice
+from operator import attrgetter
+from datetime import date, datetime, timedelta
+from admission import DEFAULT_SETTINGS, AdmissionJournal, estimate_wait, refusal, seconds_per_order
+from archive import CLOSED_STATUSES, OrderArchive
+from storage import Journal, Sequence, file_lock, load_json
+from catalog import Catalog
+from coupons import CouponError, CouponJournal, generate_codes, normalize_code
+from events import EventJournal
+from feedback import RATINGS, FeedbackJournal, order_fields
+from inventory import RESERVATION_TTL, InventoryJournal
+from kitchen import OPEN_STATUSES, KitchenQueue
+from metrics import timed
+from order_model import (ORDER_ATTRIBUTES, ORDER_KEYS, Order, OrderColumns, concat_frames, day_timestamp,
+                         order_from_json, valid_order)
+from rollups import SalesRollup
+
+# Statuses an order goes through
+ORDER_STATUSES = ('Pending', 'Paid', 'Ready', 'Cancelled')
+
+# Columns order queries can sort by
+SORT_KEYS = ('date', 'order_id', 'customer', 'item', 'quantity', 'total_price', 'status')
+
+# First ID handed out by the order ID sequence, clear of the old random 4-digit IDs
+FIRST_ORDER_ID = 10000
+
+# Statuses a payment moves to Paid: Cancelled too, for orders paid after their reservation ran out
+PAYABLE_STATUSES = ('Pending', 'Cancelled')
+
+# Stock each menu item starts with when there is no inventory file yet
+DEFAULT_STOCK = 50
 
 class Database:
-    def __init__(self):
-        self.menu = pd.DataFrame({
-            'item': ['Americano', 'Cappuccino', 'Latte', 'Caramel Macchiato'],
-            'price': [7.90, 8.50, 9.00, 10.00]
-        })
+    def __init__(self, journal=True, compact_threshold=1000):
+        # Menu items, prices and unit costs, reloaded by refresh() when menu.json changes
+        self.catalog = Catalog()
+        # Journaled mode: new orders and status changes are appended to
+        # orders.journal.jsonl as one JSON line each, and folded into
+        # orders.json (the snapshot) once the journal reaches
+        # compact_threshold entries.
         self.orders_file = "orders.json"
-        self.orders = self.load_orders()
-        self.feedback_file = "feedback.json"
-        self.feedback = self.load_feedback()
-        self.coupons_file = "coupons.json"
-        self.coupons = self.load_coupons()
+        # Closed orders moved out of orders.json by archive_orders()
+        self.archive = OrderArchive()
+        self.order_log = OrderJournal(self, journal=journal, compact_threshold=compact_threshold)
+        self.order_ids = Sequence("order_id.seq", start=self._first_order_id)
+        # Stock and reservations, journaled the same way as the orders
         self.inventory_file = "inventory.json"
-        self.inventory = self.load_inventory()
+        self.stock = InventoryJournal(self.default_inventory, self.inventory_file,
+                                      journal=journal, compact_threshold=compact_threshold)
+        # Feed of order status changes that customers get notified from
+        self.events = EventJournal(journal=journal, compact_threshold=compact_threshold)
+        # Coupon campaigns, codes and redemptions
+        self.coupons = CouponJournal(journal=journal, compact_threshold=compact_threshold)
+        # Ratings per order, with their per-item and per-day rollup
+        self.feedback = FeedbackJournal(self.get_order, journal=journal, compact_threshold=compact_threshold)
+        # Admission control settings: pause, backlog and wait limits
+        self.admission_log = AdmissionJournal(journal=journal, compact_threshold=compact_threshold)
+        # Per data set counts of refresh() outcomes: served from memory (hits),
+        # new journal lines applied (tails) or re-parsed from disk (reloads)
+        self.cache_stats = {'orders': self.order_log.stats, 'inventory': self.stock.stats,
+                            'events': self.events.stats, 'coupons': self.coupons.stats,
+                            'feedback': self.feedback.stats, 'admission': self.admission_log.stats,
+                            'menu': {'hits': 0, 'tails': 0, 'reloads': 0}}
+
+    @property
+    def orders(self):
+        return self.order_log.state.orders
+
+    @property
+    def index(self):
+        return self.order_log.state
 
+    @property
+    def sales(self):
+        return self.order_log.state.listeners['sales']
+
+    @property
+    def ratings(self):
+        return self.feedback.state.rollup
+
+    @property
+    def inventory(self):
+        """Units on hand per item, reserved or not."""
+        return self.stock.state.on_hand
+
+    @timed("db.load_orders")
     def load_orders(self):
-        if os.path.exists(self.orders_file):
-            try:
-                with open(self.orders_file, 'r') as file:
-                    orders = json.load(file)
-                    validated_orders = []
-                    for order in orders:
-                        # Ensure all required keys are in the order
-                        if all(key in order for key in ['order_id', 'customer', 'item', 'quantity', 'total_price', 'status', 'date', 'notification_sent']):
-                            validated_orders.append(order)
-                        else:
-                            print(f"Invalid order detected: {order}")
-                    return validated_orders
-            except json.JSONDecodeError:
-                st.error("Error loading orders file.")
-                return []
-        return []
+        """Load the orders snapshot and replay the journal on top of it."""
+        with file_lock(self.orders_file, shared=True):
+            return self.order_log.read()[0].orders
 
+    @timed("db.reload_orders")
+    def reload_orders(self):
+        """Replace the in-memory orders with what is on disk."""
+        self.order_log.reload()
 
-    def load_feedback(self):
-        if os.path.exists(self.feedback_file):
-            try:
-                with open(self.feedback_file, 'r') as file:
-                    return json.load(file)
-            except json.JSONDecodeError:
-                return []
-        return []
-
-    def load_coupons(self):
-        if os.path.exists(self.coupons_file):
-            try:
-                with open(self.coupons_file, 'r') as file:
-                    return json.load(file)
-            except json.JSONDecodeError:
-                return {}
-        return {}
-    
-    def load_inventory(self):
-        if os.path.exists(self.inventory_file):
-            try:
-                with open(self.inventory_file, 'r') as file:
-                    return json.load(file)
-            except json.JSONDecodeError:
-                st.error("Error loading inventory file.")
-                return {}
-        # Initialize with default inventory if file doesn't exist
-        return {
-            'Americano': 50,
-            'Cappuccino': 50,
-            'Latte': 50,
-            'Caramel Macchiato': 50
-        }
+    def default_inventory(self):
+        return {item: DEFAULT_STOCK for item in self.catalog.names()}
+
+    @timed("db.refresh")
+    def refresh(self):
+        """Pick up changes other processes have made to the data files.
 
+        Costs a stat() per file when nothing changed. Returns True if anything
+        was reloaded. Also releases the stock of orders left unpaid too long.
+        """
+        changed = self.refresh_orders()
+        if self.catalog.refresh():
+            self.cache_stats['menu']['reloads'] += 1
+            changed = True
+        else:
+            self.cache_stats['menu']['hits'] += 1
+        changed = self.stock.refresh() or changed
+        changed = self.events.refresh() or changed
+        changed = self.coupons.refresh() or changed
+        changed = self.feedback.refresh() or changed
+        changed = self.admission_log.refresh() or changed
+        return bool(self.expire_reservations()) or changed
+
+    def refresh_orders(self):
+        """Apply new journal entries from other processes, or reload if the snapshot changed."""
+        return self.order_log.refresh()
+
+    @timed("db.save_inventory")
     def save_inventory(self):
         """Save inventory to the JSON file."""
-        with open(self.inventory_file, 'w') as file:
-            json.dump(self.inventory, file, indent=4)
+        self.stock.save()
 
+    @timed("db.save_orders")
     def save_orders(self):
         """Save orders to the JSON file."""
-        with open(self.orders_file, 'w') as file:
-            json.dump(self.orders, file, indent=4)
+        self.order_log.save()
+
+    def append_journal(self, entry):
+        """Append a single order event to the journal and apply it in memory."""
+        return self.order_log.append(entry)
 
-    def save_feedback(self):
-        """Save feedback to the JSON file."""
-        with open(self.feedback_file, 'w') as file:
-            json.dump(self.feedback, file, indent=4)
+    def compact_orders(self):
+        """Fold the order journal into the orders snapshot."""
+        return self.order_log.compact()
 
-    def save_coupons(self):
-        """Save coupons to the JSON file."""
-        with open(self.coupons_file, 'w') as file:
-            json.dump(self.coupons, file, indent=4)
+    @timed("db.add_feedback")
+    def add_feedback(self, order_id, rating, service):
+        """Record a customer's coffee and service ratings (1 to 5) for an order, replacing any earlier ones."""
+        if rating not in RATINGS or service not in RATINGS:
+            raise ValueError("Ratings go from 1 to 5")
+        # The order's item and date go with the entry, so the rollup never has to look up the order
+        item, day = order_fields(self.get_order(order_id))
+        self.feedback.append({'op': 'rate', 'entry': {
+            'order_id': order_id, 'rating': rating, 'service': service, 'item': item, 'date': day,
+        }})
 
+    @timed("db.add_order")
     def add_order(self, order_data):
         """Add a new order and save it to the list."""
-        self.orders.append(order_data)
-        self.save_orders()
+        order_data.setdefault('notification_sent', False)
+        self.append_journal({'op': 'add', 'order': order_data})
+
+    @timed("db.update_order")
+    def update_order(self, order_id, **fields):
+        """Update fields of the orders with the given ID.
+
+        Returns the number of matching orders. Nothing is written when the
+        orders already hold the given values.
+        """
+        return self.update_orders([order_id], **fields)
+
+    @timed("db.update_orders")
+    def update_orders(self, order_ids, **fields):
+        """Give several orders the same field values, in a single write.
+
+        Returns the number of matching orders. Orders that already hold the
+        values are left out of the write.
+        """
+        matched, changed = 0, {}
+        with self.order_log.transaction() as index:
+            for order_id in order_ids:
+                matches = index.by_id.get(order_id, [])
+                matched += len(matches)
+                if any(order.get(key) != value for order in matches for key, value in fields.items()):
+                    changed[order_id] = (matches[0], matches[0]['status'])
+            if not changed:
+                return matched
+            self.order_log.write({'op': 'update', 'order_ids': list(changed), 'fields': fields})
+        self._statuses_changed([(order, old_status) for order, old_status in changed.values()
+                                if order['status'] != old_status])
+        return matched
 
     def update_order_status(self, order_id, status):
         """Update the status of an existing order."""
-        for order in self.orders:
-            if order['order_id'] == order_id:
-                order['status'] = status
-                self.save_orders()
+        return self.update_order(order_id, status=status)
+
+    @timed("db.mark_paid")
+    def mark_paid(self, order_ids):
+        """Mark the orders still waiting for payment as Paid, in a single write.
+
+        Returns the IDs of the orders that changed. Orders already Paid, or
+        further along, are left as they are, so a payment reported twice
+        changes nothing.
+        """
+        changed = {}
+        with self.order_log.transaction() as index:
+            for order_id in order_ids:
+                for order in index.by_id.get(order_id, []):
+                    if order.status in PAYABLE_STATUSES and order_id not in changed:
+                        changed[order_id] = (order, order.status)
+            if not changed:
+                return []
+            self.order_log.write({'op': 'update', 'order_ids': list(changed), 'fields': {'status': 'Paid'}})
+        self._statuses_changed(list(changed.values()))
+        return list(changed)
+
+    @timed("db.cancel_order")
+    def cancel_order(self, order_id):
+        """Cancel an order that is still waiting for payment and release its stock.
+
+        Returns False if the order is not Pending (e.g. it was paid meanwhile).
+        """
+        with self.order_log.transaction() as index:
+            if not any(order['status'] == 'Pending' for order in index.by_id.get(order_id, [])):
+                return False
+            self.order_log.write({'op': 'update', 'order_id': order_id, 'fields': {'status': 'Cancelled'}})
+        self._statuses_changed([(self.get_order(order_id), 'Pending')])
+        return True
+
+    def _statuses_changed(self, changes):
+        # changes: (order, old status) pairs of orders whose status just changed
+        if not changes:
+            return
+        self.events.publish(changes, self.count_by_status(*OPEN_STATUSES))
+        # Payment takes the reserved stock off the shelf, cancelling gives it back
+        committed = self._settle_reservations('commit', [order['order_id'] for order, _ in changes
+                                                         if order['status'] == 'Paid'])
+        cancelled = [order['order_id'] for order, _ in changes if order['status'] == 'Cancelled']
+        self._settle_reservations('release', cancelled)
+        # ... and gives back the coupon use, if one was redeemed
+        self.release_coupons(cancelled)
+        # Paid after being cancelled: the stock and coupon use it gave back are taken again
+        revived = [order for order, old_status in changes if order['status'] == 'Paid' and old_status == 'Cancelled']
+        for order in revived:
+            if order['order_id'] not in committed:
+                self.adjust_stock(order['item'], -order['quantity'])
+        self.restore_coupons(revived)
+
+    def coupon_discount(self, code, customer):
+        """Return the discount percentage a code would give the customer now, or raise CouponError."""
+        return self.coupons.state.check(normalize_code(code), customer)['discount']
+
+    @timed("db.redeem_coupon")
+    def redeem_coupon(self, code, customer, order_id):
+        """Use a coupon for an order, returning its discount percentage, or raise CouponError.
+
+        Checked and counted under the coupon journal's lock, so a code's
+        limits hold against concurrent buyers in any process. Redeeming
+        again for the same order changes nothing.
+        """
+        code = normalize_code(code)
+        with self.coupons.transaction() as book:
+            if order_id in book.redemptions:
+                return book.campaigns[book.codes[book.redemptions[order_id][0]]]['discount']
+            terms = book.check(code, customer)
+            self.coupons.write({'op': 'redeem', 'order_id': order_id, 'code': code, 'customer': customer})
+        return terms['discount']
+
+    def release_coupons(self, order_ids):
+        """Give back the coupon uses of orders that will not go ahead."""
+        if any(order_id in self.coupons.state.redemptions for order_id in order_ids):
+            with self.coupons.transaction() as book:
+                self.coupons.write({'op': 'release', 'order_ids': [order_id for order_id in order_ids
+                                                                  if order_id in book.redemptions]})
+
+    def restore_coupons(self, orders):
+        """Count again the coupon uses of cancelled orders that were paid after all.
+
+        The discount has been paid for, so the use counts even if it takes
+        the code past its limits.
+        """
+        orders = [order for order in orders if order.get('coupon_code')]
+        if not orders:
+            return
+        with self.coupons.transaction() as book:
+            for order in orders:
+                if order['order_id'] not in book.redemptions:
+                    self.coupons.write({'op': 'redeem', 'order_id': order['order_id'],
+                                        'code': normalize_code(order['coupon_code']), 'customer': order['customer']})
+
+    @timed("db.create_coupons")
+    def create_coupons(self, name, discount, codes=(), count=0, prefix="", expires=None, max_uses=None,
+                       per_customer=None):
+        """Create a coupon campaign in a single write, and return its codes.
+
+        The codes are those given plus count random ones starting with
+        prefix. expires is a timestamp; max_uses limits each code and
+        per_customer each customer across the campaign (None: no limit).
+        Raises CouponError if the name or a given code is already taken.
+        """
+        codes = [normalize_code(code) for code in codes]
+        with self.coupons.transaction() as book:
+            if name in book.campaigns:
+                raise CouponError(f"There already is a campaign called {name}.")
+            taken = [code for code in codes if code in book.codes] or \
+                [code for code in codes if codes.count(code) > 1]
+            if taken:
+                raise CouponError(f"Coupon code {taken[0]} is already taken.")
+            codes += generate_codes(count, normalize_code(prefix), taken=book.codes.keys() | set(codes))
+            terms = {'discount': discount, 'expires': expires, 'max_uses': max_uses, 'per_customer': per_customer}
+            self.coupons.write({'op': 'campaign', 'name': name, 'terms': terms, 'codes': codes})
+        return codes
+
+    def coupon_campaigns(self):
+        """Return one row per campaign: its name, terms, number of codes and of redemptions."""
+        return self.coupons.state.summary()
+
+    def ready_window(self):
+        """Return the ThroughputWindow of recent Ready transitions."""
+        return self.events.state.ready
+
+    @timed("db.admission")
+    def admission(self, now=None):
+        """Return whether a new order would be taken now, and how long it would wait.
+
+        A dict of backlog (open orders), seconds_per_order, wait (estimated
+        seconds) and refused (why the order cannot be taken, or None).
+        """
+        now = time.time() if now is None else now
+        settings = self.admission_settings()
+        backlog = self.count_by_status(*OPEN_STATUSES)
+        window = self.ready_window()
+        wait = estimate_wait(window, backlog, now, settings['seconds_per_order'])
+        return {'backlog': backlog, 'seconds_per_order': seconds_per_order(window, now, settings['seconds_per_order']),
+                'wait': wait, 'refused': refusal(settings, backlog, wait)}
+
+    def admission_settings(self):
+        """Return the admission settings, see admission.DEFAULT_SETTINGS."""
+        return dict(self.admission_log.state)
+
+    def update_admission(self, **settings):
+        """Change admission settings: paused, max_backlog, max_wait or seconds_per_order."""
+        unknown = settings.keys() - DEFAULT_SETTINGS.keys()
+        if unknown:
+            raise ValueError(f"Unknown admission setting {sorted(unknown)[0]!r}")
+        with self.admission_log.transaction():
+            self.admission_log.write({'op': 'settings', 'settings': settings})
+
+    def available_stock(self, item):
+        """Units of an item that can still be ordered."""
+        return self.stock.state.available(item)
+
+    def stock_levels(self):
+        """Return {item: (on hand, reserved)}."""
+        ledger = self.stock.state
+        return {item: (on_hand, ledger.reserved.get(item, 0)) for item, on_hand in ledger.on_hand.items()}
+
+    @timed("db.reserve_stock")
+    def reserve_stock(self, order_id, item, quantity, ttl=RESERVATION_TTL):
+        """Hold stock for a new order until it is paid, cancelled or ttl seconds pass.
+
+        Returns False, holding nothing, if fewer than quantity units are
+        available. Safe against concurrent buyers in any process.
+        """
+        with self.stock.transaction() as ledger:
+            if order_id in ledger.reservations:
+                return True
+            if ledger.available(item) < quantity:
+                return False
+            self.stock.write({'op': 'reserve', 'order_id': order_id, 'item': item,
+                              'quantity': quantity, 'expires': time.time() + ttl})
+        return True
+
+    def release_stock(self, order_id):
+        """Give an order's reserved stock back. Returns False if it held none."""
+        return bool(self._settle_reservations('release', [order_id]))
+
+    def commit_stock(self, order_id):
+        """Take an order's reserved stock off the shelf. Returns False if it held none."""
+        return bool(self._settle_reservations('commit', [order_id]))
+
+    def _settle_reservations(self, op, order_ids):
+        # Release or commit the reservations of the orders that hold one, in
+        # one write. Returns the IDs of those orders.
+        if not order_ids:
+            return set()
+        with self.stock.transaction() as ledger:
+            held = [order_id for order_id in order_ids if order_id in ledger.reservations]
+            if held:
+                self.stock.write({'op': op, 'order_ids': held})
+        return set(held)
+
+    def adjust_stock(self, item, delta):
+        """Add (or with a negative delta, remove) units of an item."""
+        self.stock.append({'op': 'adjust', 'item': item, 'delta': delta})
+
+    @timed("db.adjust_stocks")
+    def adjust_stocks(self, deltas):
+        """Add units of several items ({item: delta}) in a single write."""
+        deltas = {item: int(delta) for item, delta in deltas.items() if delta}
+        if deltas:
+            self.stock.append({'op': 'adjust', 'deltas': deltas})
+
+    def expire_reservations(self, now=None):
+        """Release the stock of orders left unpaid past their reservation and cancel them.
+
+        Returns the IDs of the orders whose reservations expired. Only looks
+        at the oldest reservation when none has.
+        """
+        now = time.time() if now is None else now
+        if not self.stock.state.expired(now):
+            return []
+        # Cancelling and releasing happen under the orders lock, so a payment
+        # cannot land in between and find its reservation already gone
+        with self.order_log.transaction() as index:
+            with self.stock.transaction() as ledger:
+                expired = ledger.expired(now)
+                statuses = {order_id: {order.status for order in index.by_id.get(order_id, [])} for order_id in expired}
+                pending = [order_id for order_id in expired if 'Pending' in statuses[order_id]]
+                if pending:
+                    self.order_log.write({'op': 'update', 'order_ids': pending, 'fields': {'status': 'Cancelled'}})
+                # Orders paid in the meantime take their stock; only the cancelled
+                # ones, and those never placed (the page stopped after reserving), give it back
+                paid = [order_id for order_id in expired
+                        if order_id not in pending and statuses[order_id] & {'Paid', 'Ready'}]
+                released = [order_id for order_id in expired if order_id not in pending and order_id not in paid]
+                for op, order_ids in (('commit', paid), ('release', pending + released)):
+                    if order_ids:
+                        self.stock.write({'op': op, 'order_ids': order_ids})
+        self._statuses_changed([(self.get_order(order_id), 'Pending') for order_id in pending])
+        return expired
+
+    def get_order(self, order_id):
+        """Return the order with the given ID, or None."""
+        matches = self.index.by_id.get(order_id)
+        return matches[0] if matches else self.archive.find(order_id)
+
+    def customer_orders(self, customer):
+        """Return a customer's orders, oldest first."""
+        return self._with_archived(list(self.index.by_customer.get(customer, [])), customer=customer)
+
+    def orders_by_status(self, *statuses):
+        """Return the orders in any of the given statuses, oldest first."""
+        orders = self.index.with_status(*statuses)
+        archived = [status for status in statuses if status in CLOSED_STATUSES]
+        return self._with_archived(orders, statuses=archived) if archived else orders
+
+    def count_by_status(self, *statuses):
+        """Return how many orders are in any of the given statuses, without listing them."""
+        return (sum(len(self.index.by_status.get(status, {})) for status in statuses)
+                + self.archive.count_by_status(*statuses))
+
+    def _with_archived(self, orders, customer=None, statuses=()):
+        # Archived orders are all older than the cutoff they were archived at, but
+        # open orders from before it stay in orders.json, so merge rather than prepend
+        if not self.archive.months(customer, statuses=statuses):
+            return orders
+        archived = self.archive.stream(customer, statuses)
+        return list(heapq.merge(archived, orders, key=attrgetter('timestamp')))
+
+    def kitchen_queue(self, offset=0, limit=20):
+        """Return a page of the open orders, oldest placed first, and how many there are in all."""
+        queue = self.index.listeners['kitchen']
+        return queue.page(offset, limit), len(queue)
+
+    @timed("db.query_orders")
+    def query_orders(self, customer=None, statuses=(), start=None, end=None, sort='date', descending=True,
+                     offset=0, limit=50):
+        """Return one page of the orders matching the filters, and how many match in all.
+
+        start and end are dates, both inclusive. sort is one of SORT_KEYS;
+        ties go by when the orders were placed (newest first when descending).
+        """
+        if sort not in SORT_KEYS:
+            raise ValueError(f"Cannot sort orders by {sort!r}")
+        low = day_timestamp(start) if start else None
+        high = day_timestamp(end) + 86400 if end else None
+        if not self.archive.months(customer, low, high, statuses):
+            return self.index.query(customer, statuses, start, end, sort, descending, offset, limit)
+        # The page is within the first offset + limit matches of each side, merged.
+        # The archive reads only the segments it needs.
+        hot, hot_total = self.index.query(customer, statuses, start, end, sort, descending, 0, offset + limit)
+        total = hot_total + self.archive.count(customer, statuses, low, high)
+        archived = self.archive.stream(customer, statuses, low, high, descending)
+        if sort == 'date':
+            orders = heapq.merge(hot, archived, key=attrgetter('timestamp'), reverse=descending)
+        else:
+            # Ties go by when the orders were placed, as in index.query
+            key = attrgetter(ORDER_ATTRIBUTES.get(sort, sort), 'timestamp')
+            best = heapq.nlargest if descending else heapq.nsmallest
+            orders = heapq.merge(hot, best(offset + limit, archived, key=key), key=key, reverse=descending)
+        return list(islice(orders, offset, offset + limit)), total
+
+    def stream_orders(self, customer=None, statuses=(), start=None, end=None):
+        """Iterate over the orders matching the filters (as for query_orders), oldest first.
+
+        Archived months are read a segment at a time and orders.json's
+        orders are not copied, so memory stays flat however many match.
+        """
+        low = day_timestamp(start) if start else None
+        high = day_timestamp(end) + 86400 if end else None
+        hot = self._stream_hot(customer, statuses, low, high)
+        if not self.archive.months(customer, low, high, statuses):
+            return hot
+        return heapq.merge(self.archive.stream(customer, statuses, low, high), hot, key=attrgetter('timestamp'))
+
+    def _stream_hot(self, customer, statuses, low, high):
+        index = self.index
+        orders = index.by_customer.get(customer, []) if customer is not None else index.orders
+        stop = len(orders)  # Other sessions may append while we stream
+        begin = 0
+        if not index.in_date_order:
+            orders = sorted(orders[:stop], key=attrgetter('timestamp'))
+        elif low is not None:
+            begin = bisect_left(orders, low, 0, stop, key=attrgetter('timestamp'))
+        for position in range(begin, stop):
+            order = orders[position]
+            if high is not None and order.timestamp >= high:
+                break
+            if (low is None or order.timestamp >= low) and (not statuses or order.status in statuses):
+                yield order
+
+    def stream_feedback(self, start=None, end=None):
+        """Iterate over the feedback entries for orders placed from start to end (dates, inclusive)."""
+        low = start.isoformat() if start else None
+        high = (end + timedelta(days=1)).isoformat() if end else None
+        for entry in list(self.feedback.state.entries.values()):  # Copied, refresh() may be adding to it
+            if (low is None or entry['date'] >= low) and (high is None or entry['date'] < high):
+                yield entry
+
+    @timed("db.orders_frame")
+    def orders_frame(self, start=None):
+        """Return every order as a DataFrame (see OrderColumns.frame).
+
+        Archived orders come first, oldest month first, then those in
+        orders.json, oldest first. With nothing archived the columns are
+        views of arrays kept up to date as orders change: the first call
+        fills them, later ones only add new orders. The archived ones are
+        read once per archive run. start (a date) leaves out older orders.
+        """
+        hot = self.index.columns().frame()
+        if start:
+            hot = hot[hot['date'] >= datetime(start.year, start.month, start.day)]
+        if not self.archive.months():
+            return hot.reset_index(drop=True) if start else hot
+        return concat_frames([self.archive.frame(day_timestamp(start) if start else None), hot])
+
+    def all_orders(self):
+        """Return every order, oldest first, archived ones included.
+
+        A copy, since other sessions keep appending to the live list.
+        """
+        return self._with_archived(list(self.orders))
+
+    @timed("db.archive_orders")
+    def archive_orders(self, before=None):
+        """Move Ready and Cancelled orders placed before a date (default today) into the archive.
+
+        Returns how many were moved. Safe to run again if interrupted: the
+        archive skips orders it already has.
+        """
+        cutoff = day_timestamp(before or date.today())
+        with self.order_log.transaction() as index:
+            closed, kept = [], []
+            for order in index.orders:
+                if order.status in CLOSED_STATUSES and order.timestamp < cutoff:
+                    closed.append(order)
+                else:
+                    kept.append(order)
+            if closed:
+                self.archive.add(closed)
+                # Reloads the index, so the sales rollup now starts from the archive's totals
+                self.order_log.replace([order.to_json() for order in kept])
+        return len(closed)
 
     def generate_order_id(self):
         """Generate a unique order ID."""
-        return random.randint(1000, 9999)  # This could be replaced with a more sophisticated ID generator.
+        return self.order_ids.next()
+
+    def _first_order_id(self):
+        # Only used when the sequence file is first created
+        archived = self.archive.max_order_id()
+        return max([FIRST_ORDER_ID - 1, *self.index.by_id, *([archived] if archived else [])]) + 1
+
+
+class OrderJournal(Journal):
+    """orders.json plus orders.journal.jsonl, held as an OrderIndex."""
+
+    def __init__(self, database, **kwargs):
+        self.database = database
+        super().__init__(database.orders_file, "orders.journal.jsonl", list, **kwargs)
+
+    def load_snapshot(self):
+        # Orders become Order objects as they are parsed, so the dicts never all exist at once.
+        # A corrupt file raises: starting from no orders would overwrite them at the next compaction
+        orders = load_json(self.path, self.default(), object_hook=order_from_json)
+        validated_orders = []
+        for order in orders:
+            # Ensure all required keys are in the order
+            if isinstance(order, Order):
+                validated_orders.append(order)
+            else:
+                print(f"Invalid order detected: {order}")
+        return validated_orders
+
+    def new_state(self, orders, compacting=False):
+        if compacting:
+            return OrderIndex(orders)
+        # Sales of archived orders come from the archive's daily totals
+        sales = SalesRollup.from_daily_rows(self.database.archive.sales_rows(), self.database.catalog.costs)
+        return OrderIndex(orders, {'sales': sales, 'kitchen': KitchenQueue()})
+
+    def apply(self, index, entry):
+        return apply_journal_entry(index, entry)
+
+    def dump(self, index):
+        return [order.to_json() for order in index.orders]
+
+
+class OrderIndex:
+    """An order list with dict indexes over it: by ID, by customer and by status.
+
+    Orders are held as order_model.Order objects; add() converts dicts.
+
+    Kept up to date by apply_journal_entry, which every order change goes
+    through, so lookups never scan the whole order list. Listeners (such as
+    SalesRollup), given as {name: listener}, are told about every added and
+    updated order through order_added(order) and order_updated(order, old_values).
+    """
+
+    def __init__(self, orders=(), listeners=None):
+        self.orders = []
+        self.by_id = {}        # order_id -> orders with that ID
+        self.by_customer = {}  # customer -> orders, oldest first
+        self.by_status = {}    # status -> order IDs, in the order they got there (dict as an ordered set)
+        self.listeners = dict(listeners or {})
+        self.in_date_order = True  # Whether self.orders (and so every by_customer list) is sorted by date
+        self._columns = None  # OrderColumns over self.orders, made by the first columns()
+        for order in orders:
+            self.add(order)
+
+    def add(self, order):
+        if not isinstance(order, Order):
+            order = Order.from_json(order)
+        if self.orders and order.timestamp < self.orders[-1].timestamp:
+            self.in_date_order = False
+        self.orders.append(order)
+        self.by_id.setdefault(order.order_id, []).append(order)
+        self.by_customer.setdefault(order.customer, []).append(order)
+        self.by_status.setdefault(order.status, {})[order.order_id] = None
+        for listener in self.listeners.values():
+            listener.order_added(order)
+
+    def update(self, order, fields):
+        """Apply fields to an order that is already indexed."""
+        old_values = {key: order.get(key) for key in fields}
+        old_status = order.status
+        if 'date' in fields:
+            self.in_date_order = False
+        order.update(fields)
+        if order.status != old_status:
+            order_id = order.order_id
+            # Another order sharing this ID may still be in the old status
+            if not any(other.status == old_status for other in self.by_id[order_id]):
+                self.by_status.get(old_status, {}).pop(order_id, None)
+            self.by_status.setdefault(order.status, {})[order_id] = None
+        for listener in self.listeners.values():
+            listener.order_updated(order, old_values)
+        if self._columns is not None:
+            self._columns.order_updated(order, old_values)
+
+    def columns(self):
+        """Return the OrderColumns of the orders, made on first use.
+
+        Left out of loading, as only the dashboard's DataFrames need them.
+        """
+        if self._columns is None:
+            self._columns = OrderColumns(orders=self.orders)
+        return self._columns
+
+    def with_status(self, *statuses):
+        """Return the orders in any of the given statuses, oldest first."""
+        orders = [
+            order
+            for status in statuses
+            for order_id in list(self.by_status.get(status, {}))  # Copied, writers may be adding to it
+            for order in self.by_id[order_id]
+            if order.status == status
+        ]
+        if len(statuses) > 1:
+            orders.sort(key=lambda order: order.timestamp)
+        return orders
+
+    def query(self, customer=None, statuses=(), start=None, end=None, sort='date', descending=True,
+              offset=0, limit=50):
+        """Return one page of the matching orders, and how many match in all (see Database.query_orders)."""
+        orders = self.by_customer.get(customer, []) if customer is not None else self.orders
+        low, high = 0, len(orders)  # Other sessions may append while we look
+        start = day_timestamp(start) if start else None
+        end = day_timestamp(end) + 86400 if end else None
+        if self.in_date_order:
+            # Placed oldest first, so a date range is a slice
+            if start:
+                low = bisect_left(orders, start, 0, high, key=lambda order: order.timestamp)
+            if end:
+                high = bisect_left(orders, end, low, high, key=lambda order: order.timestamp)
+            if not statuses and sort == 'date':
+                # ... and the page is too, without looking at anything else
+                if descending:
+                    stop = max(low, high - offset)
+                    return orders[max(low, stop - limit):stop][::-1], high - low
+                begin = min(high, low + offset)
+                return orders[begin:min(high, begin + limit)], high - low
+            matches = orders[low:high]
+        else:
+            matches = [order for order in orders[:high]
+                       if (not start or order.timestamp >= start) and (not end or order.timestamp < end)]
+        if statuses:
+            matches = [order for order in matches if order.status in statuses]
+        if sort != 'date' or not self.in_date_order:
+            # Stable, so ties stay in placement order
+            matches.sort(key=attrgetter(ORDER_ATTRIBUTES.get(sort, sort)))
+        if descending:
+            matches.reverse()
+        return matches[offset:offset + limit], len(matches)
+
+
+def apply_journal_entry(index, entry):
+    """Apply one journal event to an OrderIndex.
+
+    Returns the number of orders the event touched.
+    """
+    if entry.get('op') == 'add':
+        order = entry['order']
+        if not valid_order(order):
+            print(f"Invalid order detected: {order}")
+            return 0
+        index.add(order)
+        return 1
+    if entry.get('op') == 'update':
+        touched = 0
+        for order_id in entry['order_ids'] if 'order_ids' in entry else [entry['order_id']]:
+            for order in index.by_id.get(order_id, []):
+                index.update(order, entry['fields'])
+                touched += 1
+        return touched
+    return 0
+
 
 # Mock database
 users = {
@@ -130,4 +769,47 @@ def register_user(username, password, role):
     return True
 
 
-db = Database()
+def create_database():
+    """Create the Database for the storage backend picked by configuration.
+
+    COFFEE_SHOP_STORAGE=sqlite selects the SQLite backend, stored in
+    COFFEE_SHOP_SQLITE_PATH (default coffee_shop.db). Anything else keeps the
+    JSON files.
+    """
+    backend = os.environ.get("COFFEE_SHOP_STORAGE", "json").lower()
+    if backend == "sqlite":
+        from sqlite_backend import SqliteDatabase
+        return SqliteDatabase(os.environ.get("COFFEE_SHOP_SQLITE_PATH", "coffee_shop.db"))
+    return Database()
+
+
+@st.cache_resource
+def get_db():
+    """Return the Database shared by every session, created on first use."""
+    return create_database()
+
+
+def __getattr__(name):
+    # shared.db, as before: the Database is only created when first asked for
+    if name == 'db':
+        return get_db()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def paged_orders(key, page_size=25, **filters):
+    """Return one page of db.query_orders(**filters) and the total, with a page picker.
+
+    The picker (a number input under key) picks the page on the next rerun,
+    since how many pages there are is only known once the query has run.
+    """
+    db = get_db()
+    page = max(1, st.session_state.get(key, 1))
+    orders, total = db.query_orders(offset=(page - 1) * page_size, limit=page_size, **filters)
+    pages = max(1, -(-total // page_size))
+    if page > pages:
+        # The filters changed and there are fewer pages now
+        page = pages
+        orders, total = db.query_orders(offset=(page - 1) * page_size, limit=page_size, **filters)
+    st.session_state[key] = page
+    st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, step=1, key=key)
+    return orders, total
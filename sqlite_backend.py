@@ -0,0 +1,865 @@
+"""SQLite storage backend for the Database.
+
+Select it with COFFEE_SHOP_STORAGE=sqlite. To move the existing JSON files
+into a new database, run this module from the directory holding them:
+
+    python sqlite_backend.py import --db coffee_shop.db
+"""
+import argparse
+import json
+import sqlite3
+import threading
+import time
+from datetime import timedelta
+
+from admission import DEFAULT_SETTINGS, WINDOW, ThroughputWindow
+from catalog import Catalog
+from coupons import CouponError, generate_codes, normalize_code
+from events import KEEP_SECONDS, NOTIFY_STATUSES, PRUNE_EVERY, open_after
+from feedback import RATINGS, UNKNOWN_DATE, UNKNOWN_ITEM, FeedbackRollup, order_fields
+from rollups import NON_SALE_STATUSES, SalesRollup
+from inventory import RESERVATION_TTL
+from metrics import timed
+from shared import DEFAULT_STOCK, FIRST_ORDER_ID, OPEN_STATUSES, ORDER_KEYS, PAYABLE_STATUSES, SORT_KEYS, Database
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS orders (
+    order_id INTEGER NOT NULL,
+    customer TEXT NOT NULL,
+    item TEXT NOT NULL,
+    quantity INTEGER NOT NULL,
+    total_price REAL NOT NULL,
+    status TEXT NOT NULL,
+    date TEXT NOT NULL,
+    notification_sent INTEGER NOT NULL DEFAULT 0,
+    extra TEXT NOT NULL DEFAULT '{}'
+);
+CREATE INDEX IF NOT EXISTS orders_order_id ON orders (order_id);
+CREATE INDEX IF NOT EXISTS orders_customer_date ON orders (customer, date);
+CREATE INDEX IF NOT EXISTS orders_status ON orders (status);
+CREATE INDEX IF NOT EXISTS orders_date ON orders (date);
+CREATE INDEX IF NOT EXISTS orders_status_date ON orders (status, date);
+
+-- One coffee and service rating per order, see feedback.py
+CREATE TABLE IF NOT EXISTS feedback (
+    order_id INTEGER PRIMARY KEY,
+    item TEXT NOT NULL,
+    date TEXT NOT NULL,
+    rating INTEGER NOT NULL,
+    service INTEGER NOT NULL
+);
+-- Per-day, per-item ratings, kept up to date by the triggers below
+CREATE TABLE IF NOT EXISTS feedback_daily (
+    day TEXT NOT NULL,
+    item TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    rating INTEGER NOT NULL,
+    service INTEGER NOT NULL,
+    rated_1 INTEGER NOT NULL,
+    rated_2 INTEGER NOT NULL,
+    rated_3 INTEGER NOT NULL,
+    rated_4 INTEGER NOT NULL,
+    rated_5 INTEGER NOT NULL,
+    PRIMARY KEY (day, item)
+);
+CREATE TRIGGER IF NOT EXISTS feedback_daily_insert AFTER INSERT ON feedback BEGIN
+    INSERT INTO feedback_daily
+    VALUES (substr(NEW.date, 1, 10), NEW.item, 1, NEW.rating, NEW.service,
+            NEW.rating = 1, NEW.rating = 2, NEW.rating = 3, NEW.rating = 4, NEW.rating = 5)
+    ON CONFLICT (day, item) DO UPDATE SET
+        count = count + 1, rating = rating + excluded.rating, service = service + excluded.service,
+        rated_1 = rated_1 + excluded.rated_1, rated_2 = rated_2 + excluded.rated_2, rated_3 = rated_3 + excluded.rated_3,
+        rated_4 = rated_4 + excluded.rated_4, rated_5 = rated_5 + excluded.rated_5;
+END;
+CREATE TRIGGER IF NOT EXISTS feedback_daily_delete AFTER DELETE ON feedback BEGIN
+    UPDATE feedback_daily SET
+        count = count - 1, rating = rating - OLD.rating, service = service - OLD.service,
+        rated_1 = rated_1 - (OLD.rating = 1), rated_2 = rated_2 - (OLD.rating = 2), rated_3 = rated_3 - (OLD.rating = 3),
+        rated_4 = rated_4 - (OLD.rating = 4), rated_5 = rated_5 - (OLD.rating = 5)
+    WHERE day = substr(OLD.date, 1, 10) AND item = OLD.item;
+END;
+-- Coupons, see coupons.py: campaigns hold the terms, codes count their redemptions
+CREATE TABLE IF NOT EXISTS coupon_campaigns (
+    name TEXT PRIMARY KEY,
+    discount REAL NOT NULL,
+    expires REAL,
+    max_uses INTEGER,
+    per_customer INTEGER
+);
+CREATE TABLE IF NOT EXISTS coupon_codes (
+    code TEXT PRIMARY KEY,
+    campaign TEXT NOT NULL,
+    uses INTEGER NOT NULL DEFAULT 0
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS coupon_redemptions (
+    order_id INTEGER PRIMARY KEY,
+    code TEXT NOT NULL,
+    campaign TEXT NOT NULL,
+    customer TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS coupon_redemptions_customer ON coupon_redemptions (campaign, customer);
+CREATE TABLE IF NOT EXISTS inventory (
+    item TEXT PRIMARY KEY,
+    stock INTEGER NOT NULL,
+    reserved INTEGER NOT NULL DEFAULT 0
+);
+-- Stock held by unpaid orders, released when they expire
+CREATE TABLE IF NOT EXISTS reservations (
+    order_id INTEGER PRIMARY KEY,
+    item TEXT NOT NULL,
+    quantity INTEGER NOT NULL,
+    expires REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS reservations_expires ON reservations (expires);
+-- Per-day, per-item sales, kept up to date by the triggers below
+CREATE TABLE IF NOT EXISTS sales_daily (
+    day TEXT NOT NULL,
+    item TEXT NOT NULL,
+    quantity INTEGER NOT NULL,
+    revenue REAL NOT NULL,
+    PRIMARY KEY (day, item)
+);
+CREATE TRIGGER IF NOT EXISTS sales_daily_insert AFTER INSERT ON orders BEGIN
+    INSERT INTO sales_daily (day, item, quantity, revenue)
+    SELECT substr(NEW.date, 1, 10), NEW.item, NEW.quantity, NEW.total_price
+    WHERE NEW.status NOT IN ({non_sale})
+    ON CONFLICT (day, item) DO UPDATE SET
+        quantity = quantity + excluded.quantity, revenue = revenue + excluded.revenue;
+END;
+CREATE TRIGGER IF NOT EXISTS sales_daily_update
+AFTER UPDATE OF item, quantity, total_price, date, status ON orders BEGIN
+    UPDATE sales_daily SET quantity = quantity - OLD.quantity, revenue = revenue - OLD.total_price
+    WHERE day = substr(OLD.date, 1, 10) AND item = OLD.item AND OLD.status NOT IN ({non_sale});
+    INSERT INTO sales_daily (day, item, quantity, revenue)
+    SELECT substr(NEW.date, 1, 10), NEW.item, NEW.quantity, NEW.total_price
+    WHERE NEW.status NOT IN ({non_sale})
+    ON CONFLICT (day, item) DO UPDATE SET
+        quantity = quantity + excluded.quantity, revenue = revenue + excluded.revenue;
+END;
+
+-- Feed of order status changes, see events.py
+CREATE TABLE IF NOT EXISTS order_events (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    order_id INTEGER NOT NULL,
+    customer TEXT NOT NULL,
+    status TEXT NOT NULL,
+    previous TEXT,
+    at REAL NOT NULL,
+    acknowledged INTEGER NOT NULL DEFAULT 0,
+    backlog INTEGER NOT NULL DEFAULT 0  -- Orders still open after the change
+);
+CREATE INDEX IF NOT EXISTS order_events_pending ON order_events (customer, acknowledged, seq);
+
+-- Admission control settings, see admission.py; values are JSON
+CREATE TABLE IF NOT EXISTS admission (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS sequences (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+""".replace('{non_sale}', ', '.join(f"'{status}'" for status in NON_SALE_STATUSES))
+
+ORDER_COLUMNS = ', '.join(ORDER_KEYS) + ', extra'
+
+# Rows fetched at a time by stream_orders() and stream_feedback()
+STREAM_ROWS = 1000
+
+
+def order_to_row(order):
+    extra = {key: value for key, value in order.items() if key not in ORDER_KEYS}
+    return tuple(order[key] for key in ORDER_KEYS[:-1]) + (int(order.get('notification_sent', False)), json.dumps(extra))
+
+
+def row_to_order(row):
+    order = dict(zip(ORDER_KEYS, row[:-1]))
+    order['notification_sent'] = bool(order['notification_sent'])
+    order.update(json.loads(row[-1]))
+    return order
+
+
+class SqliteDatabase(Database):
+    """Database that keeps everything in one SQLite file (WAL mode).
+
+    Orders, stock, coupons and feedback are queried through indexes
+    instead of being held in memory.
+    """
+
+    def __init__(self, path="coffee_shop.db"):
+        self.db_path = path
+        self._local = threading.local()
+        with self.connection() as conn:
+            # Feedback used to be stored as JSON blobs; moved into the new table below
+            legacy_feedback = 'data' in [row[1] for row in conn.execute("PRAGMA table_info(feedback)")]
+            if legacy_feedback:
+                conn.execute("ALTER TABLE feedback RENAME TO feedback_legacy")
+            # Databases created before admission control lack the events' backlog column
+            if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'order_events'").fetchone() \
+                    and 'backlog' not in [row[1] for row in conn.execute("PRAGMA table_info(order_events)")]:
+                conn.execute("ALTER TABLE order_events ADD COLUMN backlog INTEGER NOT NULL DEFAULT 0")
+            conn.executescript(SCHEMA)
+            conn.execute("CREATE INDEX IF NOT EXISTS order_events_ready ON order_events (status, at)")
+            if legacy_feedback:
+                rows = {}  # Only the last rating of an order counts
+                for data, in conn.execute("SELECT data FROM feedback_legacy ORDER BY id").fetchall():
+                    entry = json.loads(data)
+                    order = conn.execute("SELECT item, date FROM orders WHERE order_id = ?",
+                                         (entry['order_id'],)).fetchone() or (UNKNOWN_ITEM, UNKNOWN_DATE)
+                    rows[entry['order_id']] = (entry['order_id'], *order, entry['rating'], entry['service'])
+                conn.executemany("INSERT INTO feedback (order_id, item, date, rating, service) "
+                                 "VALUES (?, ?, ?, ?, ?)", rows.values())
+                conn.execute("DROP TABLE feedback_legacy")
+            # Databases created before reservations existed lack the reserved column
+            if 'reserved' not in [row[1] for row in conn.execute("PRAGMA table_info(inventory)")]:
+                conn.execute("ALTER TABLE inventory ADD COLUMN reserved INTEGER NOT NULL DEFAULT 0")
+            # orders_customer_date covers what the old customer-only index did
+            conn.execute("DROP INDEX IF EXISTS orders_customer")
+            # Coupons from before campaigns existed become a campaign of one code each
+            if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'coupons'").fetchone():
+                for code, data in conn.execute("SELECT code, data FROM coupons").fetchall():
+                    conn.execute("INSERT OR IGNORE INTO coupon_campaigns (name, discount) VALUES (?, ?)",
+                                 (code, json.loads(data).get('discount', 0)))
+                    conn.execute("INSERT OR IGNORE INTO coupon_codes (code, campaign) VALUES (?, ?)", (code, code))
+                conn.execute("DROP TABLE coupons")
+            # Databases created before sales_daily existed need it filled in once
+            if not conn.execute("SELECT 1 FROM sales_daily LIMIT 1").fetchone():
+                conn.execute(
+                    "INSERT INTO sales_daily (day, item, quantity, revenue) "
+                    "SELECT substr(date, 1, 10), item, SUM(quantity), SUM(total_price) FROM orders "
+                    f"WHERE status NOT IN ({', '.join('?' * len(NON_SALE_STATUSES))}) GROUP BY 1, 2",
+                    NON_SALE_STATUSES,
+                )
+            # Start the order ID sequence past every existing ID
+            conn.execute(
+                "INSERT OR IGNORE INTO sequences (name, value) "
+                "SELECT 'order_id', MAX(? - 1, IFNULL(MAX(order_id), 0)) FROM orders",
+                (FIRST_ORDER_ID,),
+            )
+        self.cache_stats = {name: {'hits': 0, 'tails': 0, 'reloads': 0}
+                            for name in ('orders', 'feedback', 'coupons', 'inventory', 'admission', 'menu')}
+        self.events = SqliteEventFeed(self)
+        self.cache_stats['events'] = self.events.stats
+        self.catalog = Catalog()
+        with self.connection() as conn:
+            # A new database starts every menu item with the default stock
+            if not conn.execute("SELECT 1 FROM inventory LIMIT 1").fetchone():
+                conn.executemany("INSERT INTO inventory (item, stock) VALUES (?, ?)",
+                                 [(item, DEFAULT_STOCK) for item in self.catalog.names()])
+
+    def connection(self):
+        """Return this thread's connection, opening it on first use."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @property
+    def orders(self):
+        return self.all_orders()
+
+    @property
+    def inventory(self):
+        return dict(self.connection().execute("SELECT item, stock FROM inventory"))
+
+    @property
+    def sales(self):
+        rows = self.connection().execute("SELECT day, item, quantity, revenue FROM sales_daily")
+        return SalesRollup.from_daily_rows(rows, self.catalog.costs)
+
+    @property
+    def ratings(self):
+        rows = self.connection().execute("SELECT day, item, count, rating, service, rated_1, rated_2, rated_3, "
+                                         "rated_4, rated_5 FROM feedback_daily WHERE count > 0")
+        return FeedbackRollup.from_daily_rows(rows)
+
+    def _query_orders(self, where="", params=(), limit=-1, order_by="rowid", offset=0):
+        rows = self.connection().execute(f"SELECT {ORDER_COLUMNS} FROM orders {where} ORDER BY {order_by} LIMIT ? OFFSET ?",
+                                         (*params, limit, offset))
+        return [row_to_order(row) for row in rows]
+
+    @timed("db.load_orders")
+    def load_orders(self):
+        return self.all_orders()
+
+    def reload_orders(self):
+        pass  # Orders are read straight from the database
+
+    def all_orders(self):
+        return self._query_orders()
+
+    def get_order(self, order_id):
+        orders = self._query_orders("WHERE order_id = ?", (order_id,), limit=1)
+        return orders[0] if orders else None
+
+    def customer_orders(self, customer):
+        return self._query_orders("WHERE customer = ?", (customer,))
+
+    def orders_by_status(self, *statuses):
+        placeholders = ', '.join('?' * len(statuses))
+        return self._query_orders(f"WHERE status IN ({placeholders})", statuses)
+
+    @timed("db.orders_frame")
+    def orders_frame(self, start=None):
+        import pandas as pd
+        where, params = ("WHERE date >= ? ", (start.isoformat(),)) if start else ("", ())
+        frame = pd.read_sql_query("SELECT order_id, date, customer, item, status, quantity, total_price FROM orders "
+                                  f"{where}ORDER BY rowid", self.connection(), params=params)
+        frame['date'] = pd.to_datetime(frame['date'], format="%Y-%m-%d %H:%M:%S").astype('datetime64[s]')
+        for column in ('customer', 'item', 'status'):
+            frame[column] = frame[column].astype('category')
+        frame['cents'] = (frame.pop('total_price') * 100).round().astype('int64')
+        return frame
+
+    @timed("db.query_orders")
+    def query_orders(self, customer=None, statuses=(), start=None, end=None, sort='date', descending=True,
+                     offset=0, limit=50):
+        if sort not in SORT_KEYS:
+            raise ValueError(f"Cannot sort orders by {sort!r}")
+        where, params = self._order_filters(customer, statuses, start, end)
+        direction = "DESC" if descending else "ASC"
+        total = self.connection().execute(f"SELECT COUNT(*) FROM orders {where}", params).fetchone()[0]
+        orders = self._query_orders(where, params, limit=limit, order_by=f"{sort} {direction}, rowid {direction}",
+                                    offset=offset)
+        return orders, total
+
+    def _order_filters(self, customer=None, statuses=(), start=None, end=None):
+        # The WHERE clause and its parameters for query_orders' filters
+        conditions, params = [], []
+        if customer is not None:
+            conditions.append("customer = ?")
+            params.append(customer)
+        if statuses:
+            conditions.append(f"status IN ({', '.join('?' * len(statuses))})")
+            params.extend(statuses)
+        if start:
+            conditions.append("date >= ?")
+            params.append(start.isoformat())
+        if end:
+            conditions.append("date < ?")
+            params.append((end + timedelta(days=1)).isoformat())
+        return (f"WHERE {' AND '.join(conditions)}" if conditions else ""), params
+
+    def stream_orders(self, customer=None, statuses=(), start=None, end=None):
+        where, params = self._order_filters(customer, statuses, start, end)
+        cursor = self.connection().execute(f"SELECT {ORDER_COLUMNS} FROM orders {where} ORDER BY date, rowid", params)
+        while True:
+            rows = cursor.fetchmany(STREAM_ROWS)
+            if not rows:
+                return
+            yield from map(row_to_order, rows)
+
+    def stream_feedback(self, start=None, end=None):
+        conditions, params = [], []
+        if start:
+            conditions.append("date >= ?")
+            params.append(start.isoformat())
+        if end:
+            conditions.append("date < ?")
+            params.append((end + timedelta(days=1)).isoformat())
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        cursor = self.connection().execute(f"SELECT order_id, item, date, rating, service FROM feedback {where} "
+                                           "ORDER BY order_id", params)
+        while True:
+            rows = cursor.fetchmany(STREAM_ROWS)
+            if not rows:
+                return
+            for order_id, item, day, rating, service in rows:
+                yield {'order_id': order_id, 'item': item, 'date': day, 'rating': rating, 'service': service}
+
+    @timed("db.add_order")
+    def add_order(self, order_data):
+        order_data.setdefault('notification_sent', False)
+        with self.connection() as conn:
+            conn.execute(f"INSERT INTO orders ({ORDER_COLUMNS}) VALUES ({', '.join('?' * (len(ORDER_KEYS) + 1))})",
+                         order_to_row(order_data))
+
+    @timed("db.update_order")
+    def update_order(self, order_id, **fields):
+        return self.update_orders([order_id], **fields)
+
+    @timed("db.update_orders")
+    def update_orders(self, order_ids, **fields):
+        order_ids = list(dict.fromkeys(order_ids))
+        if not order_ids:
+            return 0
+        assignments, set_params = [], []
+        differs, where_params = [], []
+        for key, value in fields.items():
+            if key in ORDER_KEYS:
+                value = int(value) if key == 'notification_sent' else value
+                assignments.append(f"{key} = ?")
+                set_params.append(value)
+                differs.append(f"{key} IS NOT ?")
+                where_params.append(value)
+            else:
+                # Fields outside the fixed columns live in the extra JSON object
+                assignments.append("extra = json_set(extra, ?, json(?))")
+                set_params.extend([f"$.{key}", json.dumps(value)])
+                differs.append("json_extract(extra, ?) IS NOT json_extract(json(?), '$')")
+                where_params.extend([f"$.{key}", json.dumps(value)])
+        id_list = ', '.join('?' * len(order_ids))
+        with self.connection() as conn:
+            # Take the write lock first, so the old statuses read are the ones replaced
+            conn.execute("BEGIN IMMEDIATE")
+            matches = conn.execute(f"SELECT order_id, status FROM orders WHERE order_id IN ({id_list})",
+                                   order_ids).fetchall()
+            if matches and assignments:
+                # Only rows whose values actually differ are rewritten
+                conn.execute(
+                    f"UPDATE orders SET {', '.join(assignments)} WHERE order_id IN ({id_list}) AND ({' OR '.join(differs)})",
+                    set_params + order_ids + where_params,
+                )
+        old_statuses = dict(matches)
+        changed = [order_id for order_id, status in old_statuses.items() if fields.get('status', status) != status]
+        if changed:
+            orders = {order['order_id']: order for order in
+                      self._query_orders(f"WHERE order_id IN ({', '.join('?' * len(changed))})", changed)}
+            self._statuses_changed([(orders[order_id], old_statuses[order_id]) for order_id in changed])
+        return len(matches)
+
+    @timed("db.mark_paid")
+    def mark_paid(self, order_ids):
+        order_ids = list(dict.fromkeys(order_ids))
+        if not order_ids:
+            return []
+        payable = ', '.join('?' * len(PAYABLE_STATUSES))
+        with self.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            matches = conn.execute(f"SELECT order_id, status FROM orders WHERE order_id IN ({', '.join('?' * len(order_ids))}) "
+                                   f"AND status IN ({payable})", order_ids + list(PAYABLE_STATUSES)).fetchall()
+            old_statuses = dict(matches)
+            if old_statuses:
+                conn.execute(f"UPDATE orders SET status = 'Paid' WHERE order_id IN ({', '.join('?' * len(old_statuses))}) "
+                             f"AND status IN ({payable})", list(old_statuses) + list(PAYABLE_STATUSES))
+        if old_statuses:
+            orders = {order['order_id']: order for order in
+                      self._query_orders(f"WHERE order_id IN ({', '.join('?' * len(old_statuses))})", list(old_statuses))}
+            self._statuses_changed([(orders[order_id], old_statuses[order_id]) for order_id in old_statuses])
+        return list(old_statuses)
+
+    def count_by_status(self, *statuses):
+        return self.connection().execute(f"SELECT COUNT(*) FROM orders WHERE status IN ({', '.join('?' * len(statuses))})",
+                                         statuses).fetchone()[0]
+
+    def kitchen_queue(self, offset=0, limit=20):
+        placeholders = ', '.join('?' * len(OPEN_STATUSES))
+        total = self.count_by_status(*OPEN_STATUSES)
+        orders = self._query_orders(f"WHERE status IN ({placeholders})", OPEN_STATUSES, limit=limit,
+                                    order_by="date, order_id", offset=offset)
+        return orders, total
+
+    def ready_window(self):
+        return self.events.ready_window()
+
+    def admission_settings(self):
+        rows = self.connection().execute("SELECT name, value FROM admission")
+        return dict(DEFAULT_SETTINGS, **{name: json.loads(value) for name, value in rows})
+
+    def update_admission(self, **settings):
+        unknown = settings.keys() - DEFAULT_SETTINGS.keys()
+        if unknown:
+            raise ValueError(f"Unknown admission setting {sorted(unknown)[0]!r}")
+        with self.connection() as conn:
+            conn.executemany("INSERT OR REPLACE INTO admission (name, value) VALUES (?, ?)",
+                             [(name, json.dumps(value)) for name, value in settings.items()])
+
+    @timed("db.cancel_order")
+    def cancel_order(self, order_id):
+        with self.connection() as conn:
+            cancelled = conn.execute("UPDATE orders SET status = 'Cancelled' WHERE order_id = ? AND status = 'Pending'",
+                                     (order_id,)).rowcount
+        if cancelled:
+            self._statuses_changed([(self.get_order(order_id), 'Pending')])
+        return bool(cancelled)
+
+    def _coupon_terms(self, conn, code, customer):
+        # The campaign of a code the customer may redeem now, or CouponError
+        row = conn.execute("SELECT c.name, c.discount, c.expires, c.max_uses, c.per_customer, k.uses "
+                           "FROM coupon_codes k JOIN coupon_campaigns c ON c.name = k.campaign WHERE k.code = ?",
+                           (code,)).fetchone()
+        if row is None:
+            raise CouponError("That coupon code does not exist.")
+        name, discount, expires, max_uses, per_customer, uses = row
+        if expires is not None and time.time() >= expires:
+            raise CouponError("That coupon has expired.")
+        if max_uses is not None and uses >= max_uses:
+            raise CouponError("That coupon has already been used.")
+        if per_customer is not None and conn.execute(
+                "SELECT COUNT(*) FROM coupon_redemptions WHERE campaign = ? AND customer = ?",
+                (name, customer)).fetchone()[0] >= per_customer:
+            raise CouponError("You have already used this offer.")
+        return name, discount
+
+    def coupon_discount(self, code, customer):
+        return self._coupon_terms(self.connection(), normalize_code(code), customer)[1]
+
+    @timed("db.redeem_coupon")
+    def redeem_coupon(self, code, customer, order_id):
+        code = normalize_code(code)
+        with self.connection() as conn:
+            # Take the write lock first, so the checks and the counts cannot interleave with another buyer's
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT c.discount FROM coupon_redemptions r JOIN coupon_campaigns c "
+                               "ON c.name = r.campaign WHERE r.order_id = ?", (order_id,)).fetchone()
+            if row:
+                return row[0]
+            name, discount = self._coupon_terms(conn, code, customer)
+            conn.execute("INSERT INTO coupon_redemptions (order_id, code, campaign, customer) VALUES (?, ?, ?, ?)",
+                         (order_id, code, name, customer))
+            conn.execute("UPDATE coupon_codes SET uses = uses + 1 WHERE code = ?", (code,))
+        return discount
+
+    def release_coupons(self, order_ids):
+        if not order_ids:
+            return
+        with self.connection() as conn:
+            for order_id in order_ids:
+                row = conn.execute("DELETE FROM coupon_redemptions WHERE order_id = ? RETURNING code",
+                                   (order_id,)).fetchone()
+                if row:
+                    conn.execute("UPDATE coupon_codes SET uses = uses - 1 WHERE code = ?", row)
+
+    def restore_coupons(self, orders):
+        orders = [order for order in orders if order.get('coupon_code')]
+        if not orders:
+            return
+        with self.connection() as conn:
+            for order in orders:
+                code = normalize_code(order['coupon_code'])
+                if conn.execute("INSERT INTO coupon_redemptions (order_id, code, campaign, customer) "
+                                "SELECT ?, code, campaign, ? FROM coupon_codes WHERE code = ? "
+                                "ON CONFLICT (order_id) DO NOTHING",
+                                (order['order_id'], order['customer'], code)).rowcount:
+                    conn.execute("UPDATE coupon_codes SET uses = uses + 1 WHERE code = ?", (code,))
+
+    @timed("db.create_coupons")
+    def create_coupons(self, name, discount, codes=(), count=0, prefix="", expires=None, max_uses=None,
+                       per_customer=None):
+        codes = [normalize_code(code) for code in codes]
+        with self.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            if conn.execute("SELECT 1 FROM coupon_campaigns WHERE name = ?", (name,)).fetchone():
+                raise CouponError(f"There already is a campaign called {name}.")
+            conn.execute("INSERT INTO coupon_campaigns (name, discount, expires, max_uses, per_customer) "
+                         "VALUES (?, ?, ?, ?, ?)", (name, discount, expires, max_uses, per_customer))
+            taken = [code for code, in conn.execute(
+                f"SELECT code FROM coupon_codes WHERE code IN ({', '.join('?' * len(codes))})", codes)] or \
+                [code for code in codes if codes.count(code) > 1]
+            if taken:
+                raise CouponError(f"Coupon code {taken[0]} is already taken.")
+            conn.executemany("INSERT INTO coupon_codes (code, campaign) VALUES (?, ?)", [(code, name) for code in codes])
+            # Random codes that collide with another campaign's are skipped, and drawn again
+            prefix, missing = normalize_code(prefix), count
+            while missing:
+                fresh = generate_codes(missing, prefix, taken=set(codes))
+                before = conn.total_changes
+                conn.executemany("INSERT OR IGNORE INTO coupon_codes (code, campaign) VALUES (?, ?)",
+                                 [(code, name) for code in fresh])
+                if conn.total_changes - before < len(fresh):
+                    ours = {code for code, in conn.execute("SELECT code FROM coupon_codes WHERE campaign = ?", (name,))}
+                    fresh = [code for code in fresh if code in ours]
+                codes += fresh
+                missing -= len(fresh)
+        return codes
+
+    def coupon_campaigns(self):
+        rows = self.connection().execute(
+            "SELECT c.name, c.discount, c.expires, c.max_uses, c.per_customer, "
+            "(SELECT COUNT(*) FROM coupon_codes WHERE campaign = c.name), "
+            "(SELECT COUNT(*) FROM coupon_redemptions WHERE campaign = c.name) FROM coupon_campaigns c")
+        return [dict(zip(('campaign', 'discount', 'expires', 'max_uses', 'per_customer', 'codes', 'redeemed'), row))
+                for row in rows]
+
+    def available_stock(self, item):
+        row = self.connection().execute("SELECT stock - reserved FROM inventory WHERE item = ?", (item,)).fetchone()
+        return row[0] if row else 0
+
+    def stock_levels(self):
+        return {item: (stock, reserved)
+                for item, stock, reserved in self.connection().execute("SELECT item, stock, reserved FROM inventory")}
+
+    @timed("db.reserve_stock")
+    def reserve_stock(self, order_id, item, quantity, ttl=RESERVATION_TTL):
+        conn = self.connection()
+        with conn:
+            # Both statements are writes, so the transaction holds the write
+            # lock from the first one and no other process can get in between
+            inserted = conn.execute("INSERT INTO reservations (order_id, item, quantity, expires) VALUES (?, ?, ?, ?) "
+                                    "ON CONFLICT (order_id) DO NOTHING",
+                                    (order_id, item, quantity, time.time() + ttl)).rowcount
+            if not inserted:
+                return True  # Already reserved
+            if not conn.execute("UPDATE inventory SET reserved = reserved + ? WHERE item = ? AND stock - reserved >= ?",
+                                (quantity, item, quantity)).rowcount:
+                conn.rollback()
+                return False
+        return True
+
+    def _settle_reservations(self, op, order_ids):
+        taken = "stock = stock - ?, " if op == 'commit' else ""
+        settled = set()
+        if not order_ids:
+            return settled
+        with self.connection() as conn:
+            for order_id in order_ids:
+                row = conn.execute("DELETE FROM reservations WHERE order_id = ? RETURNING item, quantity",
+                                   (order_id,)).fetchone()
+                if row is None:
+                    continue
+                item, quantity = row
+                conn.execute(f"UPDATE inventory SET {taken}reserved = reserved - ? WHERE item = ?",
+                             (quantity,) * (2 if taken else 1) + (item,))
+                settled.add(order_id)
+        return settled
+
+    def adjust_stock(self, item, delta):
+        with self.connection() as conn:
+            conn.execute("INSERT INTO inventory (item, stock) VALUES (?, ?) "
+                         "ON CONFLICT (item) DO UPDATE SET stock = stock + excluded.stock", (item, delta))
+
+    @timed("db.adjust_stocks")
+    def adjust_stocks(self, deltas):
+        with self.connection() as conn:
+            conn.executemany("INSERT INTO inventory (item, stock) VALUES (?, ?) "
+                             "ON CONFLICT (item) DO UPDATE SET stock = stock + excluded.stock",
+                             [(item, int(delta)) for item, delta in deltas.items() if delta])
+
+    def expire_reservations(self, now=None):
+        now = time.time() if now is None else now
+        conn = self.connection()
+        # Runs on every rerun, so check through the index before taking the write lock
+        if not conn.execute("SELECT 1 FROM reservations WHERE expires <= ? LIMIT 1", (now,)).fetchone():
+            return []
+        # Cancelling and releasing in one transaction, so a payment cannot land
+        # in between and find its reservation already gone
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            expired = conn.execute("DELETE FROM reservations WHERE expires <= ? RETURNING order_id, item, quantity",
+                                   (now,)).fetchall()
+            marks = ', '.join('?' * len(expired))
+            order_ids = [order_id for order_id, _, _ in expired]
+            cancelled = {order_id for order_id, in conn.execute(
+                f"UPDATE orders SET status = 'Cancelled' WHERE order_id IN ({marks}) AND status = 'Pending' "
+                f"RETURNING order_id", order_ids)}
+            # Orders paid in the meantime take their stock; only the cancelled
+            # ones, and those never placed (the page stopped after reserving), give it back
+            paid = {order_id for order_id, in conn.execute(
+                f"SELECT order_id FROM orders WHERE order_id IN ({marks}) AND status IN ('Paid', 'Ready')", order_ids)}
+            conn.executemany("UPDATE inventory SET stock = stock - ?, reserved = reserved - ? WHERE item = ?",
+                             [(quantity, quantity, item) for order_id, item, quantity in expired if order_id in paid])
+            conn.executemany("UPDATE inventory SET reserved = reserved - ? WHERE item = ?",
+                             [(quantity, item) for order_id, item, quantity in expired if order_id not in paid])
+        if cancelled:
+            orders = {order['order_id']: order for order in
+                      self._query_orders(f"WHERE order_id IN ({', '.join('?' * len(cancelled))})", list(cancelled))}
+            self._statuses_changed([(orders[order_id], 'Pending') for order_id in order_ids if order_id in cancelled])
+        return order_ids
+
+    def generate_order_id(self):
+        with self.connection() as conn:
+            return conn.execute(
+                "UPDATE sequences SET value = value + 1 WHERE name = 'order_id' RETURNING value"
+            ).fetchone()[0]
+
+    # Database builds these on the JSON files' in-memory index, journal and
+    # archive, which this backend does not set up; each is done the SQLite way
+
+    @property
+    def index(self):
+        raise AttributeError("The SQLite backend has no in-memory order index; use the query methods")
+
+    def append_journal(self, entry):
+        # Every change goes straight into the tables, so the entry is applied as it stands
+        if entry.get('op') == 'add':
+            self.add_order(entry['order'])
+        elif entry.get('op') == 'update':
+            self.update_orders(entry['order_ids'] if 'order_ids' in entry else [entry['order_id']], **entry['fields'])
+
+    def compact_orders(self):
+        # There is no order journal; the nearest thing is folding the WAL back into the database file
+        self.connection().execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return True
+
+    def _with_archived(self, orders, customer=None, statuses=()):
+        return orders  # Nothing is archived, so the orders given are all there are
+
+    def _stream_hot(self, customer, statuses, low, high):
+        raise NotImplementedError("Database.stream_orders() helper; SqliteDatabase.stream_orders() queries the table")
+
+    def _first_order_id(self):
+        return self.connection().execute("SELECT MAX(? - 1, IFNULL(MAX(order_id), 0)) + 1 FROM orders",
+                                          (FIRST_ORDER_ID,)).fetchone()[0]
+
+    def archive_orders(self, before=None):
+        # Queries go through the indexes, so old orders cost nothing kept in the table
+        raise NotImplementedError("The SQLite backend keeps every order in its table; there is nothing to archive")
+
+    @timed("db.save_orders")
+    def save_orders(self):
+        pass  # Every order change is written as it happens
+
+    @timed("db.add_feedback")
+    def add_feedback(self, order_id, rating, service):
+        if rating not in RATINGS or service not in RATINGS:
+            raise ValueError("Ratings go from 1 to 5")
+        item, day = order_fields(self.get_order(order_id))
+        with self.connection() as conn:
+            # Delete, then insert, so the triggers take the earlier rating out of feedback_daily
+            conn.execute("DELETE FROM feedback WHERE order_id = ?", (order_id,))
+            conn.execute("INSERT INTO feedback (order_id, item, date, rating, service) VALUES (?, ?, ?, ?, ?)",
+                         (order_id, item, day, rating, service))
+
+    @timed("db.save_inventory")
+    def save_inventory(self):
+        pass  # Every stock change is written as it happens
+
+    @timed("db.refresh")
+    def refresh(self):
+        changed = False
+        # Orders, stock, coupons and feedback are always queried live
+        for name in ('orders', 'inventory', 'coupons', 'feedback', 'admission'):
+            self.cache_stats[name]['hits'] += 1
+        if self.catalog.refresh():
+            self.cache_stats['menu']['reloads'] += 1
+            changed = True
+        else:
+            self.cache_stats['menu']['hits'] += 1
+        changed = self.events.refresh() or changed
+        return bool(self.expire_reservations()) or changed
+
+    def refresh_orders(self):
+        return False
+
+    def import_json(self, source):
+        """One-shot import of the orders, feedback, coupons and inventory of a JSON Database."""
+        with self.connection() as conn:
+            conn.executemany(f"INSERT INTO orders ({ORDER_COLUMNS}) VALUES ({', '.join('?' * (len(ORDER_KEYS) + 1))})",
+                             [order_to_row(order) for order in source.all_orders()])
+            conn.execute("DELETE FROM inventory")
+            conn.executemany("INSERT INTO inventory (item, stock) VALUES (?, ?)", source.inventory.items())
+            book = source.coupons.state
+            conn.executemany("INSERT INTO coupon_campaigns (name, discount, expires, max_uses, per_customer) "
+                             "VALUES (?, ?, ?, ?, ?)",
+                             [(name, terms['discount'], terms.get('expires'), terms.get('max_uses'),
+                               terms.get('per_customer')) for name, terms in book.campaigns.items()])
+            conn.executemany("INSERT INTO coupon_codes (code, campaign, uses) VALUES (?, ?, ?)",
+                             [(code, name, book.uses.get(code, 0)) for code, name in book.codes.items()])
+            conn.executemany("INSERT INTO coupon_redemptions (order_id, code, campaign, customer) VALUES (?, ?, ?, ?)",
+                             [(order_id, code, book.codes[code], customer)
+                              for order_id, (code, customer) in book.redemptions.items()])
+            conn.executemany("INSERT INTO feedback (order_id, item, date, rating, service) VALUES (?, ?, ?, ?, ?)",
+                             [(entry['order_id'], entry['item'], entry['date'], entry['rating'], entry['service'])
+                              for entry in source.feedback.state.entries.values()])
+
+
+class SqliteEventFeed:
+    """The order event feed of events.EventJournal, kept in the order_events table."""
+
+    EVENT_COLUMNS = "seq, order_id, customer, status, previous, at"
+
+    def __init__(self, database):
+        self.database = database
+        self.subscribers = []
+        self.stats = {'hits': 0, 'tails': 0, 'reloads': 0}
+        self._lock = threading.Lock()
+        self.last_seq = database.connection().execute("SELECT IFNULL(MAX(seq), 0) FROM order_events").fetchone()[0]
+
+    def _query(self, where, params):
+        rows = self.database.connection().execute(
+            f"SELECT {self.EVENT_COLUMNS} FROM order_events {where} ORDER BY seq", params)
+        return [dict(zip(self.EVENT_COLUMNS.split(', '), row)) for row in rows]
+
+    def subscribe(self, callback):
+        self.subscribers.append(callback)
+        return lambda: self.subscribers.remove(callback)
+
+    def publish(self, changes, backlog=0):
+        now = time.time()
+        events = [{'order_id': order['order_id'], 'customer': order['customer'], 'status': order['status'],
+                   'previous': old_status, 'at': now, 'backlog': left}
+                  for (order, old_status), left in zip(changes, open_after(changes, backlog))]
+        with self.database.connection() as conn:
+            for event in events:
+                event['seq'] = conn.execute(
+                    "INSERT INTO order_events (order_id, customer, status, previous, at, backlog) "
+                    "VALUES (?, ?, ?, ?, ?, ?) RETURNING seq",
+                    (event['order_id'], event['customer'], event['status'], event['previous'], event['at'],
+                     event['backlog']),
+                ).fetchone()[0]
+                # Old events go whether acknowledged or not, as in events.Notifications
+                if event['seq'] % PRUNE_EVERY == 0:
+                    conn.execute("DELETE FROM order_events WHERE at < ?", (now - KEEP_SECONDS,))
+        self.refresh()
+        return events
+
+    def refresh(self):
+        """Pass events published since the last call (by any process) to the subscribers."""
+        with self._lock:
+            events = self._query("WHERE seq > ?", (self.last_seq,))
+            if not events:
+                self.stats['hits'] += 1
+                return False
+            self.stats['tails'] += 1
+            self.last_seq = events[-1]['seq']
+        for event in events:
+            for callback in list(self.subscribers):
+                callback(event)
+        return True
+
+    def ready_window(self, now=None):
+        """Return a ThroughputWindow of the Ready transitions of the last WINDOW seconds, plus the one before."""
+        now = time.time() if now is None else now
+        placeholders = ', '.join('?' * len(OPEN_STATUSES))
+        window = ThroughputWindow()
+        # The last transition before the window starts the first gap in it
+        rows = self.database.connection().execute(
+            f"SELECT * FROM (SELECT at, backlog FROM order_events WHERE status = 'Ready' "
+            f"AND previous IN ({placeholders}) AND at < ? ORDER BY at DESC LIMIT 1) "
+            f"UNION ALL SELECT * FROM (SELECT at, backlog FROM order_events WHERE status = 'Ready' "
+            f"AND previous IN ({placeholders}) AND at >= ? ORDER BY at, seq)",
+            (*OPEN_STATUSES, now - WINDOW, *OPEN_STATUSES, now - WINDOW))
+        for at, backlog in rows:
+            window.ready(at, backlog)
+        return window
+
+    def pending(self, customer):
+        return self._query(f"WHERE customer = ? AND NOT acknowledged AND status IN ({', '.join('?' * len(NOTIFY_STATUSES))})",
+                           (customer, *NOTIFY_STATUSES))
+
+    def since(self, customer, seq):
+        return [event for event in self.pending(customer) if event['seq'] > seq]
+
+    def acknowledge(self, customer, order_ids):
+        order_ids = list(order_ids)
+        if not order_ids:
+            return
+        with self.database.connection() as conn:
+            conn.execute(f"UPDATE order_events SET acknowledged = 1 WHERE customer = ? AND NOT acknowledged "
+                         f"AND order_id IN ({', '.join('?' * len(order_ids))})", (customer, *order_ids))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the SQLite storage backend.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    import_parser = subparsers.add_parser('import', help="import the JSON data files in the current directory")
+    import_parser.add_argument('--db', default="coffee_shop.db", help="SQLite database file")
+    import_parser.add_argument('--force', action='store_true', help="import even if the database already has orders")
+    args = parser.parse_args()
+
+    target = SqliteDatabase(args.db)
+    existing = target.connection().execute("SELECT COUNT(*) FROM orders").fetchone()[0]
+    if existing and not args.force:
+        parser.exit(1, f"{args.db} already holds {existing} orders, use --force to import anyway\n")
+    source = Database()
+    target.import_json(source)
+    print(f"Imported {len(source.all_orders())} orders, {len(source.feedback.state.entries)} feedback entries, "
+          f"{len(source.coupons.state.codes)} coupon codes and {len(source.inventory)} inventory items into {args.db}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,361 @@
+import os
+import json
+import tempfile
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows has no fcntl, so only threads are locked out there
+    fcntl = None
+
+# One lock per file so threads in this process queue up before taking the file lock
+_thread_locks = {}
+_thread_locks_guard = threading.Lock()
+
+
+def _thread_lock(path):
+    with _thread_locks_guard:
+        return _thread_locks.setdefault(os.path.abspath(path), threading.Lock())
+
+
+@contextmanager
+def file_lock(path, shared=False):
+    """Hold an advisory lock on a data file, across threads and processes.
+
+    The lock lives in a separate "<path>.lock" file so it survives the data
+    file being replaced by atomic_write_json. Not re-entrant.
+    """
+    with _thread_lock(path):
+        if fcntl is None:
+            yield
+            return
+        with open(path + ".lock", 'a') as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+def atomic_write_json(path, data, indent=4):
+    """Write JSON to a temp file next to path, then rename it into place.
+
+    Readers see either the old file or the new one, never a half-written one.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, 'w') as file:
+            json.dump(data, file, indent=indent)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def file_version(path):
+    """Return a stamp that changes whenever the file is written, or None if it is missing."""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+def load_json(path, default, object_hook=None):
+    """Load a JSON file, returning default if it does not exist.
+
+    object_hook is passed on to json.load. A file that fails to parse is
+    left where it is and the error re-raised: carrying on with default
+    would let the next save or compaction overwrite the data in it.
+    """
+    if not os.path.exists(path):
+        return default
+    try:
+        with open(path, 'r') as file:
+            return json.load(file, object_hook=object_hook)
+    except json.JSONDecodeError:
+        print(f"Could not parse {path}; fix or restore it before starting again")
+        raise
+
+
+class Sequence:
+    """A persistent counter shared by every process using the same file.
+
+    next() takes the file lock, so values are unique and strictly increasing
+    across processes. The counter is rewritten in place, which survives a
+    process crash; it is not fsynced, so a machine crash may reuse values
+    handed out just before it.
+    """
+
+    WIDTH = 20  # Fixed-width value so every write is a single small overwrite
+
+    def __init__(self, path, start=1):
+        self.path = path
+        self.start = start
+
+    def next(self):
+        with file_lock(self.path):
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                current = os.read(fd, self.WIDTH).strip()
+                value = int(current) + 1 if current else self._initial()
+                os.lseek(fd, 0, os.SEEK_SET)
+                os.write(fd, str(value).rjust(self.WIDTH).encode())
+            finally:
+                os.close(fd)
+        return value
+
+    def _initial(self):
+        return self.start() if callable(self.start) else self.start
+
+
+def read_journal(path, offset=0):
+    """Read the complete journal lines after a byte offset.
+
+    Returns the parsed entries and the offset just past the last complete
+    line. A torn last line (e.g. from a crash mid-write) is left unread.
+    """
+    entries = []
+    if not os.path.exists(path):
+        return entries, offset
+    with open(path, 'rb') as file:
+        file.seek(offset)
+        for line in file:
+            if not line.endswith(b"\n"):
+                break
+            offset += len(line)
+            if not line.strip():
+                continue
+            try:
+                entries.append(json.loads(line))
+            except json.JSONDecodeError:
+                print(f"Skipping unreadable journal entry in {path}: {line!r}")
+    return entries, offset
+
+
+class Journal:
+    """A JSON snapshot plus a journal of changes to it, shared by processes.
+
+    Every change is one JSON line appended under the file lock, so a write
+    costs the same however much data there is, and other processes pick it
+    up by reading just the bytes appended since they last looked. Once the
+    journal holds compact_threshold entries it is folded into the snapshot
+    on a background thread. With journal=False every change rewrites the
+    snapshot instead.
+
+    Subclasses say what the data looks like in memory: new_state(data)
+    builds the state from the snapshot's contents, apply(state, entry)
+    applies one journal entry and dump(state) returns what to write back
+    to the snapshot.
+    """
+
+    def __init__(self, path, journal_path, default, journal=True, compact_threshold=1000):
+        self.path = path
+        self.journal_path = journal_path
+        self.compacting_path = journal_path + ".compacting"
+        self.default = default  # Called for the snapshot's contents when it does not exist
+        self.journal = journal
+        self.compact_threshold = compact_threshold
+        self.entries = 0  # Entries in the live journal
+        self.offset = 0   # Bytes of the live journal applied to the state
+        self.version = None
+        # refresh() outcomes: served from memory (hits), new journal lines
+        # applied (tails) or re-read from disk (reloads)
+        self.stats = {'hits': 0, 'tails': 0, 'reloads': 0}
+        self._compact_lock = threading.Lock()
+        self.reload()
+
+    def new_state(self, data, compacting=False):
+        """Build the in-memory state from the snapshot's contents.
+
+        compacting is True when the state is only built to be dumped again.
+        """
+        raise NotImplementedError
+
+    def apply(self, state, entry):
+        raise NotImplementedError
+
+    def dump(self, state):
+        raise NotImplementedError
+
+    def load_snapshot(self):
+        return load_json(self.path, self.default())
+
+    def current_version(self):
+        """Version of the files, ignoring appends to the live journal."""
+        journal_version = file_version(self.journal_path) if self.journal else None
+        return (
+            file_version(self.path),
+            file_version(self.compacting_path) if self.journal else None,
+            journal_version[0] if journal_version else None,  # inode only, appends are tailed
+        )
+
+    def journal_size(self):
+        version = file_version(self.journal_path) if self.journal else None
+        return version[2] if version else 0
+
+    def read(self):
+        """Build a state from the files on disk.
+
+        Returns the state, the journal offset read up to and the number of
+        live journal entries.
+        """
+        state = self.new_state(self.load_snapshot())
+        if not self.journal:
+            return state, 0, 0
+        # Replay the journal segment being compacted (if any), then the live journal
+        compacting, _ = read_journal(self.compacting_path)
+        live, offset = read_journal(self.journal_path)
+        for entry in compacting + live:
+            self.apply(state, entry)
+        return state, offset, len(live)
+
+    def reload(self):
+        """Replace the in-memory state with what is on disk."""
+        with file_lock(self.path, shared=True):
+            self._reload()
+
+    def _reload(self):
+        # Caller holds the lock
+        self.version = self.current_version()
+        self.state, self.offset, self.entries = self.read()
+
+    def refresh(self):
+        """Apply journal entries written by other processes, or reload if the snapshot changed.
+
+        Costs two stat() calls when nothing changed. Returns True if anything did.
+        """
+        if self.current_version() == self.version and self.journal_size() == self.offset:
+            self.stats['hits'] += 1
+            return False
+        with file_lock(self.path, shared=True):
+            self.stats['reloads' if self._needs_reload() else 'tails'] += 1
+            return self._catch_up()
+
+    def _needs_reload(self):
+        # Anything but appends to the journal (or its first creation) means
+        # the files must be read again from the start
+        version = self.current_version()
+        if version == self.version:
+            return False
+        recorded = self.version
+        return not (recorded and recorded[:2] == version[:2] and recorded[2] is None and self.offset == 0)
+
+    def _catch_up(self):
+        # Caller holds the lock
+        if self._needs_reload():
+            self._reload()
+            return True
+        self.version = self.current_version()
+        entries, self.offset = read_journal(self.journal_path, self.offset)
+        for entry in entries:
+            self.apply(self.state, entry)
+        self.entries += len(entries)
+        return bool(entries)
+
+    @contextmanager
+    def transaction(self):
+        """Hold the write lock, with the state caught up with the files on disk.
+
+        Yields the state, so a check followed by write() is atomic across
+        threads and processes.
+        """
+        with file_lock(self.path):
+            self._catch_up()
+            yield self.state
+        self._maybe_compact()
+
+    def write(self, entry):
+        """Persist one entry and apply it in memory, returning what apply() returns.
+
+        Only call this inside transaction().
+        """
+        if self.journal:
+            line = json.dumps(entry, separators=(',', ':')).encode() + b"\n"
+            with open(self.journal_path, 'ab') as file:
+                if file.tell() != self.offset:
+                    line = b"\n" + line  # Terminate a torn line left by a crashed writer
+                file.write(line)
+                self.offset = file.tell()
+            self.entries += 1
+        result = self.apply(self.state, entry)
+        if not self.journal:
+            atomic_write_json(self.path, self.dump(self.state))
+        self.version = self.current_version()
+        return result
+
+    def append(self, entry):
+        """Append one entry to the journal and apply it in memory."""
+        with self.transaction():
+            return self.write(entry)
+
+    def save(self):
+        """Write the whole in-memory state to the snapshot and start a new journal."""
+        with file_lock(self.path):
+            atomic_write_json(self.path, self.dump(self.state))
+            if self.journal:
+                for path in (self.compacting_path, self.journal_path):
+                    if os.path.exists(path):
+                        os.remove(path)
+                self.offset = 0
+                self.entries = 0
+            self.version = self.current_version()
+
+    def replace(self, data):
+        """Make data the new snapshot, with an empty journal, and reload the state from it.
+
+        Only call this inside transaction().
+        """
+        atomic_write_json(self.path, data)
+        if self.journal:
+            for path in (self.compacting_path, self.journal_path):
+                if os.path.exists(path):
+                    os.remove(path)
+        self._reload()
+
+    def _maybe_compact(self):
+        if self.journal and self.entries >= self.compact_threshold:
+            threading.Thread(target=self.compact, daemon=True).start()
+
+    def compact(self):
+        """Fold the journal into the snapshot.
+
+        The live journal is renamed to a "compacting" segment so new writes go
+        to a fresh journal, then the new snapshot is rebuilt from the files on
+        disk, so the in-memory state is never touched from this thread.
+        """
+        if not self._compact_lock.acquire(blocking=False):
+            return False  # Another compaction is already running
+        try:
+            with file_lock(self.path):
+                self._catch_up()
+                if not os.path.exists(self.compacting_path):
+                    if not os.path.exists(self.journal_path):
+                        return False
+                    os.replace(self.journal_path, self.compacting_path)
+                    self.offset = 0
+                    self.entries = 0
+                    self.version = self.current_version()
+                snapshot_version = file_version(self.path)
+
+            state = self.new_state(self.load_snapshot(), compacting=True)
+            segment, _ = read_journal(self.compacting_path)
+            for entry in segment:
+                self.apply(state, entry)
+
+            with file_lock(self.path):
+                if file_version(self.path) != snapshot_version or not os.path.exists(self.compacting_path):
+                    return False  # Someone else rewrote the snapshot meanwhile
+                up_to_date = self.current_version() == self.version
+                atomic_write_json(self.path, self.dump(state))
+                os.remove(self.compacting_path)
+                if up_to_date:
+                    self.version = self.current_version()
+            return True
+        finally:
+            self._compact_lock.release()